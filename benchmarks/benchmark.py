@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Throughput of the S3utils operations on folders of 1k, 10k and 100k files.
+
+To run the benchmark against the in process moto mock, run this in the root of repo:
+python -m benchmarks.benchmark --output results.json
+
+To run it against a moto server (pip install moto[server] && moto_server -p 5000), which also measures max_workers:
+python -m benchmarks.benchmark --host localhost --port 5000 --workers 8 --output results.json
+
+To compare the results with an earlier run:
+python -m benchmarks.benchmark --scales 1000 --compare old_results.json
+
+Each operation is timed on its own: uploading the folder with cp, listing it with iter_ls,
+fetching the permissions of every file with ll and deleting it with rm.
+The results are written as JSON with the keys per second, bytes per second and number of requests of every operation.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import boto
+from moto import mock_s3
+from s3utils import S3utils
+
+DEFAULT_SCALES = (1000, 10000, 100000)
+OPERATIONS = ('upload', 'list', 'acl', 'delete')
+BUCKET_NAME = 'benchmarkbucket'
+FILE_SIZE = 1024
+# number of files per local folder, so that the tree looks like a real one rather than one huge folder
+FILES_PER_FOLDER = 1000
+
+
+def make_folder(num_files, file_size=FILE_SIZE):
+    "A temporary folder of num_files files of file_size bytes."
+    folder = tempfile.mkdtemp(prefix='s3utils_benchmark_')
+    content = b'x' * file_size
+    for i in range(num_files):
+        # the top folder has files too, otherwise cp makes a key for it as an empty folder
+        subfolder = os.path.join(folder, 'folder%s' % (i // FILES_PER_FOLDER)) if i >= FILES_PER_FOLDER else folder
+        if not os.path.exists(subfolder):
+            os.makedirs(subfolder)
+        with open(os.path.join(subfolder, 'file%s.txt' % i), 'wb') as f:
+            f.write(content)
+    return folder
+
+
+def measure(s3utils, operation, fn, num_files, num_bytes=None):
+    "Time fn and return the result of the operation."
+    requests_before = sum(stats['requests'] for stats in s3utils.instrumentation.stats().values())
+    start = time.time()
+    failures = fn()
+    seconds = time.time() - start
+    requests = sum(stats['requests'] for stats in s3utils.instrumentation.stats().values()) - requests_before
+    return {
+        'operation': operation,
+        'keys': num_files,
+        'seconds': seconds,
+        'keys_per_second': num_files / seconds if seconds else None,
+        'bytes_per_second': num_bytes / seconds if num_bytes and seconds else None,
+        'requests': requests,
+        'failed': bool(failures),
+    }
+
+
+def run_scale(num_files, workers=1, host=None, port=None, operations=OPERATIONS):
+    "Run the operations on a folder of num_files files and return their results."
+    folder = make_folder(num_files)
+    kwargs = dict(AWS_STORAGE_BUCKET_NAME=BUCKET_NAME)
+    if host:
+        kwargs.update(AWS_ACCESS_KEY_ID='benchmark', AWS_SECRET_ACCESS_KEY='benchmark',
+                      AWS_S3_HOST=host, AWS_S3_PORT=port, AWS_S3_USE_SSL=False)
+    try:
+        s3utils = S3utils(**kwargs)
+        # so that connecting is not timed as part of the upload
+        s3utils.connect()
+        results = []
+        remote = 'benchmark%s/' % num_files
+        if 'upload' in operations:
+            results.append(measure(s3utils, 'upload', lambda: s3utils.cp(folder + "/*", remote, max_workers=workers),
+                                   num_files, num_files * FILE_SIZE))
+        if 'list' in operations:
+            results.append(measure(s3utils, 'list', lambda: sum(1 for name in s3utils.iter_ls(remote)) != num_files, num_files))
+        if 'acl' in operations:
+            results.append(measure(s3utils, 'acl', lambda: len(s3utils.ll(remote, max_workers=workers)) != num_files, num_files))
+        if 'delete' in operations:
+            results.append(measure(s3utils, 'delete', lambda: s3utils.rm(remote, max_workers=workers), num_files))
+        s3utils.disconnect()
+        return results
+    finally:
+        shutil.rmtree(folder)
+
+
+def run(scales=DEFAULT_SCALES, workers=1, host=None, port=None, operations=OPERATIONS):
+    """
+    Run the benchmark at every scale.
+
+    Without a host, the operations run against the in process moto mock. It can not answer requests sent in parallel,
+    so everything runs in one thread whatever workers is.
+
+    **Returns:**
+
+    The results as a dict that can be written as JSON.
+    """
+    if not host:
+        workers = 1
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'boto': boto.__version__,
+        'backend': '%s:%s' % (host, port) if host else 'moto mock',
+        'workers': workers,
+        'file_size': FILE_SIZE,
+        'results': [],
+    }
+    for num_files in scales:
+        if host:
+            conn = boto.connect_s3('benchmark', 'benchmark', host=host, port=port, is_secure=False,
+                                   calling_format=boto.s3.connection.OrdinaryCallingFormat())
+            conn.create_bucket(BUCKET_NAME)
+            report['results'].extend(run_scale(num_files, workers, host, port, operations))
+        else:
+            with mock_s3():
+                boto.connect_s3().create_bucket(BUCKET_NAME)
+                report['results'].extend(run_scale(num_files, workers, operations=operations))
+    return report
+
+
+def compare(report, baseline, max_slowdown=0.2):
+    """
+    Compare the keys per second of a report with those of a baseline report.
+
+    **Returns:**
+
+    (lines to print, whether any operation got more than max_slowdown slower)
+    """
+    before = dict(((result['operation'], result['keys']), result['keys_per_second']) for result in baseline['results'])
+    lines = []
+    slower = False
+    for result in report['results']:
+        old = before.get((result['operation'], result['keys']))
+        if not old or not result['keys_per_second']:
+            continue
+        ratio = result['keys_per_second'] / old
+        slower = slower or ratio < 1 - max_slowdown
+        lines.append("%-8s %8s keys %10.1f -> %10.1f keys/s %+6.1f%%" % (
+            result['operation'], result['keys'], old, result['keys_per_second'], (ratio - 1) * 100))
+    return lines, slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=list(DEFAULT_SCALES), help="numbers of files")
+    parser.add_argument('--operations', nargs='+', default=list(OPERATIONS), choices=OPERATIONS)
+    parser.add_argument('--workers', type=int, default=1, help="max_workers of the operations. Only used with --host.")
+    parser.add_argument('--host', help="host of a moto server. Default is the in process moto mock.")
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--output', help="file to write the JSON results to. Default is stdout.")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--max-slowdown', type=float, default=0.2,
+                        help="exit with 1 when an operation is this much slower than in --compare. Default is 0.2")
+    args = parser.parse_args(argv)
+
+    report = run(args.scales, args.workers, args.host, args.port, args.operations)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            lines, slower = compare(report, json.load(f), args.max_slowdown)
+        sys.stderr.write("\n".join(lines) + "\n")
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
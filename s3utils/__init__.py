@@ -1 +1,6 @@
-from .s3utils import *
\ No newline at end of file
+from .s3utils import *
+
+try:
+    from .async_s3utils import AsyncS3utils
+except SyntaxError:  # async/await needs Python 3.5 or newer
+    pass
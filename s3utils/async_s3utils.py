@@ -0,0 +1,187 @@
+"""
+asyncio interface to S3utils. Needs Python 3.5 or newer.
+"""
+import asyncio
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from . import invalidation
+from .s3utils import S3utils
+
+__all__ = ['AsyncS3utils']
+
+# Number of file names fetched from the listing in one go by the async iterator of AsyncS3utils.ls
+LISTING_PAGE_SIZE = 1000
+
+
+class AsyncS3utils(object):
+
+    """
+    Async S3 Utils
+
+    The same interface as S3utils for asyncio applications.
+    Every call is awaitable and runs in a pool of worker threads, so the event loop is never blocked.
+    The worker threads share one S3utils, which gives each of them its own connection to S3.
+
+    At most max_concurrency calls run at the same time. The rest wait for their turn without blocking the event loop.
+    Raising max_concurrency lets more small files be put in parallel from a single process.
+
+    Parameters
+    ----------
+
+    max_concurrency : integer, optional
+        Number of S3utils calls that run at the same time. Default is 10.
+
+    Any other parameter is passed to S3utils.
+
+    Examples
+    --------
+
+        >>> import asyncio
+        >>> from s3utils import AsyncS3utils
+        >>> s3utils = AsyncS3utils(
+        ... AWS_ACCESS_KEY_ID = 'your access key',
+        ... AWS_SECRET_ACCESS_KEY = 'your secret key',
+        ... AWS_STORAGE_BUCKET_NAME = 'your bucket name',
+        ... max_concurrency = 50,
+        ... )
+        >>> async def main():
+        ...     await asyncio.gather(*[s3utils.echo("Hello World!", "test/%s.txt" % i) for i in range(1000)])
+        ...     async for key in s3utils.ls("test/"):
+        ...         print(key)
+        >>> asyncio.get_event_loop().run_until_complete(main())
+        test/0.txt
+        test/1.txt
+        ...
+    """
+
+    def __init__(self, max_concurrency=10, **kwargs):
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.client = S3utils(**kwargs)
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # created on first use so it belongs to the event loop that awaits it
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _call(self, method, *args, **kwargs):
+        return getattr(self.client, method)(*args, **kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        "Run fn in a worker thread once there are less than max_concurrency calls running."
+        async with self.semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def close(self):
+        "Wait for the running calls to finish and stop the worker threads."
+        self.executor.shutdown(wait=True)
+        self.client.disconnect()
+
+    async def cp(self, local_path, target_path, **kwargs):
+        "Awaitable S3utils.cp"
+        return await self.run(self._call, 'cp', local_path, target_path, **kwargs)
+
+    async def mv(self, local_file, target_file, **kwargs):
+        "Awaitable S3utils.mv"
+        return await self.run(self._call, 'mv', local_file, target_file, **kwargs)
+
+    async def echo(self, content, target_path, **kwargs):
+        "Awaitable S3utils.echo"
+        return await self.run(self._call, 'echo', content, target_path, **kwargs)
+
+    async def mkdir(self, target_folder, **kwargs):
+        "Awaitable S3utils.mkdir"
+        return await self.run(self._call, 'mkdir', target_folder, **kwargs)
+
+    async def rm(self, path, **kwargs):
+        "Awaitable S3utils.rm"
+        return await self.run(self._call, 'rm', path, **kwargs)
+
+    async def chmod(self, target_file, acl='public-read'):
+        "Awaitable S3utils.chmod"
+        return await self.run(self._call, 'chmod', target_file, acl=acl)
+
+    async def get(self, remote_path, local_path):
+        "Awaitable S3utils.get"
+        return await self.run(self._call, 'get', remote_path, local_path)
+
+    async def invalidate(self, files_to_be_invalidated):
+        "Awaitable S3utils.invalidate"
+        return await self.run(self._call, 'invalidate', files_to_be_invalidated)
+
+    async def wait_for_invalidation(self, distro, request_id, timeout=900):
+        "Awaitable S3utils.wait_for_invalidation"
+        return not await self.wait_for_invalidations([(distro, request_id)], timeout=timeout)
+
+    async def wait_for_invalidations(self, requests, timeout=900, callback=None):
+        """
+        Awaitable S3utils.wait_for_invalidations.
+
+        Only the status checks run in the worker threads. The waits between them are on the event loop.
+        """
+        loop = asyncio.get_event_loop()
+        pending = list(requests)
+        deadline = loop.time() + timeout
+        delays = invalidation.poll_delays(invalidation.INVALIDATION_POLL_DELAY, invalidation.INVALIDATION_POLL_MAX_DELAY)
+        while True:
+            statuses = await asyncio.gather(
+                *[self.run(self._call, 'invalidation_status', *request) for request in pending], return_exceptions=True)
+            for request, status in zip(list(pending), statuses):
+                if status == 'Completed':
+                    pending.remove(request)
+                    if callback:
+                        callback(*request)
+            remaining = deadline - loop.time()
+            if not pending or remaining <= 0:
+                return pending
+            await asyncio.sleep(min(next(delays), remaining))
+
+    def ls(self, folder="", begin_from_file="", num=-1, recursive=True):
+        """
+        Async iterator over the file names (keys) in a s3 folder. See S3utils.iter_ls for the parameters.
+
+        The names are fetched from S3 in pages as they are needed.
+
+        Examples
+        --------
+
+            >>> async for key in s3utils.ls("test/", recursive=False):
+            ...     print(key)
+        """
+        return AsyncListing(self, folder=folder, begin_from_file=begin_from_file, num=num, recursive=recursive)
+
+
+class AsyncListing(object):
+
+    "Async iterator over S3utils.iter_ls that fetches LISTING_PAGE_SIZE names at a time in a worker thread."
+
+    def __init__(self, s3utils, **kwargs):
+        self.s3utils = s3utils
+        self.kwargs = kwargs
+        self.names = None
+        self.page = deque()
+        self.done = False
+
+    def _next_page(self):
+        if self.names is None:
+            self.names = self.s3utils.client.iter_ls(**self.kwargs)
+        return list(islice(self.names, LISTING_PAGE_SIZE))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.page and not self.done:
+            page = await self.s3utils.run(self._next_page)
+            self.done = len(page) < LISTING_PAGE_SIZE
+            self.page.extend(page)
+        if not self.page:
+            raise StopAsyncIteration
+        return self.page.popleft()
@@ -0,0 +1,91 @@
+import os
+import base64
+import binascii
+import hashlib
+
+from .sqlite import locked_connection
+
+__all__ = ['HashCache']
+
+
+def file_md5(local_file, chunk_size=1024 * 1024):
+    """Return the hex md5 of a local file, reading it in chunks."""
+    md5 = hashlib.md5()
+    with open(local_file, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def md5_tuple(hex_md5):
+    """Return the (hex md5, base64 md5) tuple that boto takes as the md5 of a file."""
+    return (hex_md5, base64.b64encode(binascii.unhexlify(hex_md5)).decode('ascii'))
+
+
+class HashCache(object):
+
+    """
+    A persistent cache of the md5 of local files, stored in a SQLite file.
+
+    The md5 of a file is kept along with its size, modification time and inode.
+    As long as none of them changes, the file is not read again to compute its md5.
+
+    hits and misses count how many times the md5 came from the cache and how many times the file had to be read.
+
+    Parameters
+    ----------
+
+    path : string
+        Path to the SQLite file. It is created if it does not exist.
+
+    Examples
+    --------
+
+        >>> from s3utils import S3utils
+        >>> s3utils = S3utils(
+        ... AWS_STORAGE_BUCKET_NAME = 'your bucket name',
+        ... S3UTILS_HASH_CACHE_PATH = '/var/cache/s3utils_hashes.sqlite',
+        ... )
+        >>> s3utils.cp("path/to/folder", "/test/")
+        >>> s3utils.hash_cache.stats()
+        {'hits': 0, 'misses': 4}
+        >>> s3utils.cp("path/to/folder", "/test/")
+        >>> s3utils.hash_cache.stats()
+        {'hits': 4, 'misses': 4}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.db, self.lock = locked_connection(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, inode INTEGER, md5 TEXT)")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def md5(self, local_file):
+        """Return the hex md5 of the local file, only reading the file if it changed since it was last hashed."""
+        local_file = os.path.abspath(local_file)
+        stat = os.stat(local_file)
+        fingerprint = (stat.st_size, stat.st_mtime, stat.st_ino)
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT size, mtime, inode, md5 FROM file_hashes WHERE path = ?", (local_file,)).fetchone()
+            if row and tuple(row[:3]) == fingerprint:
+                self.hits += 1
+                return row[3]
+            self.misses += 1
+
+        hex_md5 = file_md5(local_file)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?)", (local_file,) + fingerprint + (hex_md5,))
+        return hex_md5
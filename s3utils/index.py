@@ -0,0 +1,188 @@
+import time
+from itertools import islice
+
+from .sqlite import locked_connection
+
+__all__ = ['RemoteIndex']
+
+# The largest unicode character. Every key that starts with a prefix sorts before prefix + this character.
+_MAX_CHAR = u'\U0010ffff'
+
+
+def s3_timestamp(timestamp=None):
+    "Format a unix timestamp the way S3 formats the last modified time of keys in a listing."
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(timestamp))
+
+
+class RemoteIndex(object):
+
+    """
+    A local index of the keys in S3 buckets, stored in a SQLite file.
+
+    It keeps the name, size, ETag and last modified time of each key so that S3utils can answer
+    "does this file exist on S3?" without listing the bucket every time.
+
+    Staleness policy:
+        - A prefix is fresh for ttl seconds after it (or any of its parent prefixes) was listed from S3.
+        - Asking about a stale prefix re-lists only that prefix from S3. The fresh prefixes are not touched.
+        - Asking whether one file of a stale prefix exists asks S3 about that file only and does not list the prefix.
+        - The writes and deletes done through S3utils update the index right away but do not make a prefix fresh.
+        - Changes made to the bucket by anybody else are only seen once the prefix is stale.
+          Use expire to make a prefix stale right away when you know it has changed.
+
+    Parameters
+    ----------
+
+    path : string
+        Path to the SQLite file. It is created if it does not exist.
+
+    bucket_name : string
+        The bucket whose keys are indexed. One file can hold the index of several buckets.
+
+    ttl : integer, optional
+        Number of seconds a listed prefix is considered fresh. Default is 300.
+        With a ttl of 0 the prefixes are re-listed every time.
+
+    Examples
+    --------
+
+        >>> from s3utils import S3utils
+        >>> s3utils = S3utils(
+        ... AWS_STORAGE_BUCKET_NAME = 'your bucket name',
+        ... S3UTILS_INDEX_PATH = '/var/cache/s3utils.sqlite',
+        ... S3UTILS_INDEX_TTL = 600,
+        ... )
+        >>> # lists test/ from S3 once and answers from the index for the next 10 minutes
+        >>> s3utils.cp("path/to/folder", "/test/", overwrite=False)
+    """
+
+    def __init__(self, path, bucket_name, ttl=300):
+        self.path = path
+        self.bucket_name = bucket_name
+        self.ttl = ttl
+        self.db, self.lock = locked_connection(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS s3_keys ("
+            "bucket TEXT, name TEXT, size INTEGER, etag TEXT, last_modified TEXT, "
+            "PRIMARY KEY (bucket, name))")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS s3_prefixes ("
+            "bucket TEXT, prefix TEXT, refreshed_at REAL, "
+            "PRIMARY KEY (bucket, prefix))")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def is_fresh(self, prefix):
+        "Whether the prefix was listed from S3 less than ttl seconds ago."
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT prefix FROM s3_prefixes WHERE bucket = ? AND refreshed_at > ?",
+                (self.bucket_name, time.time() - self.ttl)).fetchall()
+        return any(prefix.startswith(fresh_prefix) for (fresh_prefix,) in rows)
+
+    def replace(self, prefix, keys, page_size=1000):
+        """
+        Replace everything under the prefix with the keys of a fresh listing and mark the prefix as fresh.
+
+        keys is an iterable of boto keys in the order S3 lists them. It is consumed lazily so the listing is never
+        held in memory, and page_size keys at a time are merged into the index, each page in a short transaction
+        of its own. The index is not locked while the next page is listed, so the other threads and processes
+        can use it in the meantime.
+        """
+        refreshed_at = time.time()
+        keys = iter(keys)
+        last_name = None
+        while True:
+            page = [(self.bucket_name, key.name, key.size, key.etag, key.last_modified) for key in islice(keys, page_size)]
+            with self.lock:
+                self.db.execute("BEGIN")
+                try:
+                    # the keys between the end of the last page and the end of this one that S3 did not list are gone
+                    end = page[-1][1] if page else prefix + _MAX_CHAR
+                    if last_name is None:
+                        rows = self.db.execute(
+                            "SELECT name FROM s3_keys WHERE bucket = ? AND name >= ? AND name <= ? AND name < ?",
+                            (self.bucket_name, prefix, end, prefix + _MAX_CHAR)).fetchall()
+                    else:
+                        rows = self.db.execute(
+                            "SELECT name FROM s3_keys WHERE bucket = ? AND name > ? AND name <= ? AND name < ?",
+                            (self.bucket_name, last_name, end, prefix + _MAX_CHAR)).fetchall()
+                    listed = set(row[1] for row in page)
+                    self.db.executemany(
+                        "DELETE FROM s3_keys WHERE bucket = ? AND name = ?",
+                        ((self.bucket_name, name) for (name,) in rows if name not in listed))
+                    self.db.executemany("INSERT OR REPLACE INTO s3_keys VALUES (?, ?, ?, ?, ?)", page)
+                    if len(page) < page_size:
+                        # the sub prefixes are covered by this listing now
+                        self.db.execute(
+                            "DELETE FROM s3_prefixes WHERE bucket = ? AND prefix >= ? AND prefix < ?",
+                            (self.bucket_name, prefix, prefix + _MAX_CHAR))
+                        self.db.execute(
+                            "INSERT OR REPLACE INTO s3_prefixes VALUES (?, ?, ?)",
+                            (self.bucket_name, prefix, refreshed_at))
+                except:
+                    self.db.execute("ROLLBACK")
+                    raise
+                self.db.execute("COMMIT")
+            if len(page) < page_size:
+                break
+            last_name = page[-1][1]
+
+    def expire(self, prefix=""):
+        "Make the prefix and everything under it stale so it is re-listed from S3 the next time."
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM s3_prefixes WHERE bucket = ? AND prefix >= ? AND prefix < ?",
+                (self.bucket_name, prefix, prefix + _MAX_CHAR))
+            # a parent prefix would still cover this prefix
+            for (fresh_prefix,) in self.db.execute(
+                    "SELECT prefix FROM s3_prefixes WHERE bucket = ?", (self.bucket_name,)).fetchall():
+                if prefix.startswith(fresh_prefix):
+                    self.db.execute(
+                        "DELETE FROM s3_prefixes WHERE bucket = ? AND prefix = ?", (self.bucket_name, fresh_prefix))
+
+    def add(self, name, size, etag, last_modified=None):
+        "Add or update a key that was written to S3."
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO s3_keys VALUES (?, ?, ?, ?, ?)",
+                (self.bucket_name, name, size, etag, last_modified or s3_timestamp()))
+
+    def remove(self, names):
+        "Remove keys that were deleted from S3."
+        with self.lock:
+            self.db.executemany(
+                "DELETE FROM s3_keys WHERE bucket = ? AND name = ?",
+                ((self.bucket_name, name) for name in names))
+
+    def exists(self, name):
+        return self.get(name) is not None
+
+    def get(self, name):
+        "Return the (size, etag, last_modified) of a key or None if it is not in the index."
+        with self.lock:
+            return self.db.execute(
+                "SELECT size, etag, last_modified FROM s3_keys WHERE bucket = ? AND name = ?",
+                (self.bucket_name, name)).fetchone()
+
+    def iter_names(self, prefix="", page_size=1000):
+        "Lazily yield the names of the keys under the prefix in the order S3 lists them."
+        last_name = None
+        while True:
+            # reading page by page so the lock is not held while the caller is busy with the names
+            with self.lock:
+                if last_name is None:
+                    rows = self.db.execute(
+                        "SELECT name FROM s3_keys WHERE bucket = ? AND name >= ? AND name < ? ORDER BY name LIMIT ?",
+                        (self.bucket_name, prefix, prefix + _MAX_CHAR, page_size)).fetchall()
+                else:
+                    rows = self.db.execute(
+                        "SELECT name FROM s3_keys WHERE bucket = ? AND name > ? AND name < ? ORDER BY name LIMIT ?",
+                        (self.bucket_name, last_name, prefix + _MAX_CHAR, page_size)).fetchall()
+            for (name,) in rows:
+                yield name
+            if len(rows) < page_size:
+                break
+            last_name = rows[-1][0]
@@ -0,0 +1,274 @@
+import bisect
+import logging
+import socket
+import threading
+import time
+
+__all__ = ['Instrumentation', 'InstrumentationHook', 'LoggingHook', 'StatsdHook', 'Histogram']
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the buckets of the latency histograms. The last bucket has no upper bound.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# The boto CloudFront methods that send a request, by the name of the request in the CloudFront API
+CLOUDFRONT_OPERATIONS = {
+    'get_all_distributions': 'ListDistributions',
+    'create_invalidation_request': 'CreateInvalidation',
+    'invalidation_request_status': 'GetInvalidation',
+    'get_invalidation_requests': 'ListInvalidations',
+}
+
+
+class RequestEvent(object):
+
+    """
+    One attempt of a request to S3 or CloudFront, as the hooks see it.
+
+    service : 's3' or 'cloudfront'
+    operation : name of the request in the AWS API, for example 'PutObject'
+    key : the key, or the distribution id for CloudFront. None for requests that are not about one key.
+    bytes : number of bytes sent or received, when it is known beforehand. Otherwise None.
+    retries : number of attempts of the same request before this one
+    started_at : unix time the attempt started
+    duration : number of seconds it took. None until it has ended.
+    status : 200 when it succeeded, the HTTP status S3 answered with when it failed,
+             or None when there was no answer, for example when the connection was reset
+    error : the exception it failed with or None
+    """
+
+    def __init__(self, service, operation, key=None, bytes=None, retries=0):
+        self.service = service
+        self.operation = operation
+        self.key = key
+        self.bytes = bytes
+        self.retries = retries
+        self.started_at = time.time()
+        self.duration = None
+        self.status = None
+        self.error = None
+
+    def __repr__(self):
+        return "<RequestEvent %s %s %s>" % (self.service, self.operation, self.key)
+
+
+class Histogram(object):
+
+    "Number of values that fell in each of the buckets, plus their count and sum, like Prometheus histograms."
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, percent):
+        "Upper bound of the bucket the percentile falls in. None if it is in the last bucket or there are no values."
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen and seen >= rank:
+                return bound
+        return None
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': dict(zip(self.buckets + ('inf',), self.counts)),
+        }
+
+
+class InstrumentationHook(object):
+
+    "Base class of the hooks. Override start and/or end. They are called in the thread that sends the request."
+
+    def start(self, event):
+        pass
+
+    def end(self, event):
+        pass
+
+
+class LoggingHook(InstrumentationHook):
+
+    """
+    Logs every request to S3 and CloudFront once it has ended.
+
+    Parameters
+    ----------
+
+    logger : logging.Logger, optional
+        Default is the logger of this module.
+
+    level : integer, optional
+        Level of the successful requests. The failed ones are logged as warnings. Default is logging.INFO.
+    """
+
+    def __init__(self, logger=logger, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def end(self, event):
+        self.logger.log(
+            logging.WARNING if event.error else self.level,
+            "%s %s %s bytes=%s status=%s retries=%s %.1fms",
+            event.service, event.operation, event.key or "", event.bytes, event.status, event.retries,
+            event.duration * 1000)
+
+
+class StatsdHook(InstrumentationHook):
+
+    """
+    Sends the timing of every request and the number of requests, errors and bytes to a statsd server over UDP.
+
+    The metrics are named prefix.service.operation.(duration|requests|errors|bytes), for example s3utils.s3.PutObject.duration
+    Nothing is waited for and nothing fails if the statsd server is not there.
+
+    Parameters
+    ----------
+
+    host : string, optional
+        Default is 127.0.0.1
+
+    port : integer, optional
+        Default is 8125
+
+    prefix : string, optional
+        Default is s3utils
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='s3utils'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def end(self, event):
+        name = "%s.%s.%s" % (self.prefix, event.service, event.operation)
+        lines = ["%s.duration:%.3f|ms" % (name, event.duration * 1000), "%s.requests:1|c" % name]
+        if event.error:
+            lines.append("%s.errors:1|c" % name)
+        if event.bytes:
+            lines.append("%s.bytes:%s|c" % (name, event.bytes))
+        try:
+            self.socket.sendto("\n".join(lines).encode('ascii'), self.address)
+        except socket.error:
+            pass
+
+
+class Instrumentation(object):
+
+    """
+    Reports every request to S3 and CloudFront to the hooks and keeps in process statistics of them.
+
+    Every attempt of a request is one start and one end event. See RequestEvent for what they hold.
+    The latency of each operation goes in a Histogram. stats() returns them along with the number of
+    requests, errors, retries and bytes of each operation, for example to be scraped by a monitoring system.
+
+    Parameters
+    ----------
+
+    hooks : list, optional
+        InstrumentationHook objects. More can be appended to instrumentation.hooks at any time.
+
+    Examples
+    --------
+
+        >>> from s3utils import S3utils, LoggingHook, StatsdHook
+        >>> s3utils = S3utils(
+        ... AWS_STORAGE_BUCKET_NAME = 'your bucket name',
+        ... S3UTILS_INSTRUMENTATION_HOOKS = [LoggingHook(), StatsdHook(port=8125)],
+        ... )
+        >>> s3utils.cp("path/to/folder", "/test/")
+        >>> s3utils.instrumentation.stats()['s3.PutObject']
+        {'requests': 4, 'errors': 0, 'retries': 0, 'bytes': 1024, 'duration': {'count': 4, 'sum': 0.08, 'buckets': {...}}}
+    """
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def wrap(self, fn, operation, key=None, bytes=None, service='s3'):
+        """
+        Return fn instrumented: every call to it is reported as an attempt of the request.
+
+        Made to be passed to RetryPolicy.call, which calls it once per attempt.
+        """
+        attempts = [0]
+
+        def instrumented(*args, **kwargs):
+            event = RequestEvent(service, operation, key=key, bytes=bytes, retries=attempts[0])
+            attempts[0] += 1
+            self.__emit('start', event)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                event.error = e
+                event.status = getattr(e, 'status', None)
+                raise
+            else:
+                event.status = 200
+                return result
+            finally:
+                event.duration = time.time() - event.started_at
+                self.__record(event)
+                self.__emit('end', event)
+        return instrumented
+
+    def cloudfront(self, conn):
+        "The CloudFront connection with its requests reported, or None when there is no connection."
+        return conn and InstrumentedConnection(conn, self, CLOUDFRONT_OPERATIONS, service='cloudfront')
+
+    def stats(self):
+        "{service.operation: {requests, errors, retries, bytes, duration}} of the requests so far."
+        with self.lock:
+            return dict((name, dict(stats, duration=stats['duration'].stats())) for name, stats in self.operations.items())
+
+    def __record(self, event):
+        name = "%s.%s" % (event.service, event.operation)
+        with self.lock:
+            stats = self.operations.get(name)
+            if stats is None:
+                stats = self.operations[name] = {'requests': 0, 'errors': 0, 'retries': 0, 'bytes': 0, 'duration': Histogram()}
+            stats['requests'] += 1
+            stats['errors'] += 1 if event.error else 0
+            stats['retries'] += 1 if event.retries else 0
+            stats['bytes'] += event.bytes or 0
+            stats['duration'].observe(event.duration)
+
+    def __emit(self, name, event):
+        for hook in self.hooks:
+            # a broken hook does not break the transfers
+            try:
+                getattr(hook, name)(event)
+            except:
+                logger.error("Error in the instrumentation hook %r", hook, exc_info=True)
+
+
+class InstrumentedConnection(object):
+
+    "A boto connection whose methods in operations report their requests. The first argument is taken as the key."
+
+    def __init__(self, conn, instrumentation, operations, service):
+        self.conn = conn
+        self.instrumentation = instrumentation
+        self.operations = operations
+        self.service = service
+
+    def __getattr__(self, name):
+        method = getattr(self.conn, name)
+        if name not in self.operations:
+            return method
+
+        def instrumented(*args, **kwargs):
+            return self.instrumentation.wrap(
+                method, self.operations[name], key=args[0] if args else None, service=self.service)(*args, **kwargs)
+        return instrumented
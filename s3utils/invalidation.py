@@ -0,0 +1,357 @@
+import atexit
+import logging
+import random
+import threading
+import time
+import weakref
+
+__all__ = ['QUEUED', 'InvalidationQueue', 'wait_for_invalidations']
+
+logger = logging.getLogger(__name__)
+
+# CloudFront takes at most this many paths in one invalidation request
+CLOUDFRONT_MAX_PATHS_PER_REQUEST = 1000
+# and keeps at most this many file paths and this many wildcard paths in progress on a distribution at a time
+CLOUDFRONT_MAX_PATHS_IN_FLIGHT = 3000
+CLOUDFRONT_MAX_WILDCARDS_IN_FLIGHT = 15
+
+# What S3utils.invalidate returns when the paths have to wait in the queue for earlier invalidations to complete
+QUEUED = 'queued'
+
+# Seconds between the first polls of the status of an invalidation. It doubles after every poll up to the max.
+INVALIDATION_POLL_DELAY = 10
+INVALIDATION_POLL_MAX_DELAY = 120
+
+# The queues that are still in use. Whatever is waiting in them is sent when the process exits.
+_queues = weakref.WeakSet()
+_queues_lock = threading.Lock()
+
+
+@atexit.register
+def flush_queues():
+    with _queues_lock:
+        queues = list(_queues)
+    for queue in queues:
+        queue.flush()
+
+
+def cloudfront_path(path):
+    "CloudFront paths start with a /"
+    return "/" + path.lstrip("/")
+
+
+def is_wildcard(path):
+    return path.endswith("*")
+
+
+def parent_folders(key):
+    "The folders a key is in, from the root down: a/b/c.txt is in '', 'a/' and 'a/b/'"
+    parts = key.split("/")[:-1]
+    return [""] + ["/".join(parts[:i]) + "/" for i in range(1, len(parts) + 1)]
+
+
+def collapse_paths(changed, listing=None, max_paths=10, root=""):
+    """
+    Collapse the changed keys into folder/* wildcards to invalidate fewer paths.
+
+    CloudFront bills a wildcard the same as a single file.
+
+    - A folder whose files all changed becomes one wildcard when the listing is given.
+    - While there are more than max_paths paths, the folder that saves the most paths for the fewest
+      unchanged files invalidated along with them is collapsed. Without a listing, the deepest folders go first.
+
+    Parameters
+    ----------
+
+    changed : iterable
+        Keys that changed.
+
+    listing : iterable, optional
+        Keys that exist under root, changed or not.
+
+    max_paths : integer, optional
+        Path budget. Default is 10.
+
+    root : string, optional
+        Only the folders under root are collapsed. Default is the whole bucket.
+
+    Examples
+    --------
+
+        >>> collapse_paths(["img/1.jpg", "img/2.jpg", "css/a.css"], listing=["img/1.jpg", "img/2.jpg", "css/a.css", "css/b.css"])
+        ['css/a.css', 'img/*']
+        >>> collapse_paths(["img/1.jpg", "img/2.jpg", "css/a.css"], max_paths=1)
+        ['*']
+
+    **Returns:**
+
+    Sorted list of paths.
+    """
+    changed = set(key.lstrip("/") for key in changed)
+    paths = set(changed)
+    # number of paths under each folder
+    under = {}
+    for key in changed:
+        for folder in parent_folders(key):
+            if folder.startswith(root):
+                under[folder] = under.get(folder, 0) + 1
+    # number of files under each folder that did not change but would be invalidated by its wildcard
+    unchanged = dict.fromkeys(under, 0)
+    if listing is not None:
+        for key in listing:
+            key = key.lstrip("/")
+            if key not in changed:
+                for folder in parent_folders(key):
+                    if folder in unchanged:
+                        unchanged[folder] += 1
+
+    def collapse(folder):
+        saved = under[folder] - 1
+        for path in [path for path in paths if path.startswith(folder)]:
+            paths.remove(path)
+        paths.add(folder + "*")
+        for parent in parent_folders(folder)[:-1]:
+            if parent in under:
+                under[parent] -= saved
+        # the folders inside are covered by the wildcard now
+        for inner in [inner for inner in under if inner.startswith(folder)]:
+            del under[inner]
+        under[folder] = 1
+
+    if listing is not None:
+        # parents first, so the biggest folders whose files all changed become one wildcard
+        for folder in sorted(under, key=len):
+            if under.get(folder, 0) > 1 and not unchanged[folder]:
+                collapse(folder)
+
+    while len(paths) > max_paths:
+        candidates = [folder for folder, num in under.items() if num > 1]
+        if not candidates:
+            break
+        collapse(min(candidates, key=lambda folder: (
+            float(unchanged[folder]) / (under[folder] - 1), -folder.count("/"), -under[folder], folder)))
+
+    return sorted(paths)
+
+
+def poll_delays(delay, max_delay):
+    """
+    Yield the seconds to wait between polls. They double every time up to max_delay.
+
+    Each delay is randomly cut by up to half so that many waiters do not poll in step and get throttled together.
+    """
+    while True:
+        yield delay / 2.0 + random.uniform(0, delay / 2.0)
+        delay = min(delay * 2, max_delay)
+
+
+def wait_for_invalidations(conn, requests, timeout=900, callback=None):
+    """
+    Wait for invalidation requests to complete, polling their status with exponential backoff and jitter.
+
+    Parameters
+    ----------
+
+    conn : boto CloudFrontConnection
+
+    requests : iterable
+        (distribution id, request id) of the requests, like InvalidationQueue.flush returns them.
+
+    timeout : number, optional
+        Number of seconds to wait at most. Default is 900.
+
+    callback : callable, optional
+        Called with the distribution id and the request id as soon as each request completes.
+
+    **Returns:**
+
+    The (distribution id, request id) of the requests that did not complete in time. Empty if they all did.
+    """
+    pending = list(requests)
+    deadline = time.time() + timeout
+    delays = poll_delays(INVALIDATION_POLL_DELAY, INVALIDATION_POLL_MAX_DELAY)
+    while True:
+        for request in list(pending):
+            try:
+                status = conn.invalidation_request_status(*request).status
+            except:
+                logger.warning("Error in checking the invalidation %s of %s", request[1], request[0], exc_info=True)
+                continue
+            if status == 'Completed':
+                pending.remove(request)
+                if callback:
+                    callback(*request)
+        remaining = deadline - time.time()
+        if not pending or remaining <= 0:
+            return pending
+        time.sleep(min(next(delays), remaining))
+
+
+class InvalidationQueue(object):
+
+    """
+    Paths waiting to be invalidated on CloudFront distributions, sent in batches.
+
+    The paths added to the queue are sent together delay seconds after the first of them was added,
+    or right away once there are max_paths of them. Each batch is one invalidation request per distribution.
+    A path that is already waiting, or that is covered by a wildcard that is waiting, is not added twice.
+
+    No more than max_in_flight file paths and max_wildcards_in_flight wildcards are in progress on a distribution
+    at a time. When a limit is reached, the paths stay in the queue until CloudFront has completed earlier requests.
+    The paths that could not be sent are retried delay seconds later.
+
+    Parameters
+    ----------
+
+    conn : boto CloudFrontConnection
+
+    distribution_ids : list
+        Ids of the distributions to invalidate the paths on.
+
+    delay : number, optional
+        Number of seconds the paths wait for more paths to join their batch. Default is 5.
+
+    max_paths : integer, optional
+        Number of paths in one invalidation request. Default is CloudFront's limit of 1000.
+
+    max_in_flight : integer, optional
+        Number of file paths in progress on a distribution at a time. Default is CloudFront's limit of 3000.
+
+    max_wildcards_in_flight : integer, optional
+        Number of wildcard paths in progress on a distribution at a time. Default is CloudFront's limit of 15.
+
+    Examples
+    --------
+
+        >>> for i in range(30):
+        ...     s3utils.cp("path/to/photo%s.jpg" % i, "/test/", invalidate=True)
+        >>> # one request per distribution for the 30 files
+        >>> s3utils.invalidation_queue.flush()
+        [('your distro id', u'your request id')]
+    """
+
+    def __init__(self, conn, distribution_ids, delay=5, max_paths=CLOUDFRONT_MAX_PATHS_PER_REQUEST,
+                 max_in_flight=CLOUDFRONT_MAX_PATHS_IN_FLIGHT, max_wildcards_in_flight=CLOUDFRONT_MAX_WILDCARDS_IN_FLIGHT):
+        self.conn = conn
+        self.distribution_ids = list(distribution_ids)
+        self.delay = delay
+        self.max_paths = max_paths
+        self.max_in_flight = max_in_flight
+        self.max_wildcards_in_flight = max_wildcards_in_flight
+        self.paths = []
+        self.queued = set()
+        self.wildcards = set()
+        # (request id, number of files, number of wildcards) of the requests that might still be in progress, by distribution
+        self.in_flight = dict((distribution_id, []) for distribution_id in self.distribution_ids)
+        self.timer = None
+        self.lock = threading.RLock()
+        # a queue with paths waiting is kept alive by its timer, so they are sent even if the queue is not used anymore
+        with _queues_lock:
+            _queues.add(self)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        "Whether the path is waiting to be sent, on its own or as part of a wildcard."
+        path = cloudfront_path(path)
+        with self.lock:
+            return path in self.queued or self.__covered(path)
+
+    def add(self, paths):
+        "Queue paths to be invalidated. The full batches are sent right away."
+        with self.lock:
+            for path in paths:
+                path = cloudfront_path(path)
+                if path in self.queued or self.__covered(path):
+                    continue
+                if is_wildcard(path):
+                    # the paths the wildcard covers do not need to be sent on their own
+                    self.paths = [queued for queued in self.paths if not queued.startswith(path[:-1])]
+                    self.queued = set(self.paths)
+                    self.wildcards.intersection_update(self.queued)
+                    self.wildcards.add(path)
+                self.queued.add(path)
+                self.paths.append(path)
+            if len(self.paths) >= self.max_paths:
+                self.__send(full_batches_only=True)
+            self.__schedule()
+
+    def flush(self):
+        """
+        Send the queued paths now, as far as the in flight limit lets.
+
+        **Returns:**
+
+        The (distribution id, request id) of the invalidation requests that were sent.
+        """
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            sent = self.__send()
+            self.__schedule()
+        return sent
+
+    def __schedule(self):
+        if self.paths and not self.timer and self.distribution_ids:
+            self.timer = threading.Timer(self.delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def __covered(self, path):
+        return any(path.startswith(wildcard[:-1]) for wildcard in self.wildcards)
+
+    def __send(self, full_batches_only=False):
+        sent = []
+        try:
+            while self.paths and (not full_batches_only or len(self.paths) >= self.max_paths):
+                batch = self.__next_batch()
+                if not batch:
+                    logger.info("Too many invalidations in progress. %s paths are waiting.", len(self.paths))
+                    break
+                wildcards = len([path for path in batch if is_wildcard(path)])
+                for distribution_id in self.distribution_ids:
+                    request = self.conn.create_invalidation_request(distribution_id, batch)
+                    self.in_flight[distribution_id].append((request.id, len(batch) - wildcards, wildcards))
+                    sent.append((distribution_id, request.id))
+                self.queued.difference_update(batch)
+                self.wildcards.difference_update(batch)
+                self.paths = [path for path in self.paths if path in self.queued]
+        except:
+            logger.error("Error in invalidating %s paths. They are retried later.", len(self.paths), exc_info=True)
+        return sent
+
+    def __next_batch(self):
+        "The waiting paths that fit in one request and in the room left on all the distributions."
+        rooms = [self.__room(distribution_id) for distribution_id in self.distribution_ids]
+        room = min([self.max_paths] + [files for files, wildcards in rooms])
+        wildcard_room = min([self.max_paths] + [wildcards for files, wildcards in rooms])
+        batch = []
+        for path in self.paths:
+            if len(batch) == self.max_paths:
+                break
+            if is_wildcard(path):
+                if wildcard_room > 0:
+                    wildcard_room -= 1
+                    batch.append(path)
+            elif room > 0:
+                room -= 1
+                batch.append(path)
+        return batch
+
+    def __room(self, distribution_id):
+        "Number of file paths and of wildcards that can be put in progress on the distribution."
+        in_flight = self.in_flight[distribution_id]
+        waiting = self.paths[:self.max_paths]
+        waiting_wildcards = len([path for path in waiting if is_wildcard(path)])
+        files = sum(num_files for request_id, num_files, num_wildcards in in_flight)
+        wildcards = sum(num_wildcards for request_id, num_files, num_wildcards in in_flight)
+        if (files + len(waiting) - waiting_wildcards > self.max_in_flight or
+                wildcards + waiting_wildcards > self.max_wildcards_in_flight):
+            # only asking CloudFront about the requests when they are in the way
+            in_flight[:] = [request for request in in_flight
+                            if self.conn.invalidation_request_status(distribution_id, request[0]).status != 'Completed']
+            files = sum(num_files for request_id, num_files, num_wildcards in in_flight)
+            wildcards = sum(num_wildcards for request_id, num_files, num_wildcards in in_flight)
+        return self.max_in_flight - files, self.max_wildcards_in_flight - wildcards
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import deque
+
+__all__ = ['Progress']
+
+
+class Progress(object):
+
+    """
+    Progress of a transfer of many files, or of one big file in parts, reported to a callback.
+
+    The bytes are counted as boto sends them, so a multipart upload moves forward part by part
+    and the files of a folder that are uploaded in parallel all count at the same time.
+
+    The callback is called with a dict at most once every interval seconds, plus once when the transfer is finished:
+
+        - files_done, files_failed, files_total
+        - bytes_done, bytes_total
+        - elapsed: number of seconds since the transfer started
+        - throughput: bytes per second over the last window seconds
+        - eta: number of seconds left at that throughput. None until it is known.
+        - finished: whether it is the last report
+
+    It is called from the worker threads of the transfer so it should return quickly.
+
+    Parameters
+    ----------
+
+    callback : callable
+        Called with the report dict.
+
+    interval : number, optional
+        Number of seconds between reports. Default is 1.
+
+    window : number, optional
+        Number of seconds the throughput is averaged over. Default is 10.
+
+    Examples
+    --------
+
+        >>> def show(report):
+        ...     print("%(files_done)s/%(files_total)s files %(bytes_done)s/%(bytes_total)s bytes eta %(eta)s" % report)
+        >>> s3utils.cp("path/to/folder", "/test/", max_workers=8, progress=show)
+        2/40 files 10485760/524288000 bytes eta None
+        5/40 files 41943040/524288000 bytes eta 58.3
+        ...
+        >>> # reporting every 10 seconds instead
+        >>> s3utils.cp("path/to/big_file", "/test/", progress=Progress(show, interval=10))
+    """
+
+    def __init__(self, callback, interval=1, window=10):
+        self.callback = callback
+        self.interval = interval
+        self.window = window
+        self.files_done = 0
+        self.files_failed = 0
+        self.files_total = 0
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.started_at = time.time()
+        self.reported_at = self.started_at
+        # (time, bytes done) of the last window seconds to compute the throughput from
+        self.samples = deque([(self.started_at, 0)])
+        self.lock = threading.Lock()
+
+    def add(self, files=0, bytes=0):
+        "Add to the totals. Negative numbers take the files that are not transferred after all out of them."
+        with self.lock:
+            self.files_total += files
+            self.bytes_total += bytes
+
+    def file(self, size):
+        "Start counting the transfer of one file."
+        return FileProgress(self, size)
+
+    def report(self, finished=False):
+        "Call the callback if interval seconds have passed since the last report, or right away when finished."
+        now = time.time()
+        # checked without the lock first since it is called for every chunk that is sent
+        if not finished and now - self.reported_at < self.interval:
+            return
+        with self.lock:
+            if not finished and now - self.reported_at < self.interval:
+                return
+            self.reported_at = now
+            report = self.__report(now, finished)
+        self.callback(report)
+
+    def __report(self, now, finished):
+        self.samples.append((now, self.bytes_done))
+        while len(self.samples) > 2 and self.samples[1][0] <= now - self.window:
+            self.samples.popleft()
+        then, bytes_then = self.samples[0]
+        throughput = (self.bytes_done - bytes_then) / (now - then) if now > then else 0
+        bytes_left = self.bytes_total - self.bytes_done
+        return {
+            'files_done': self.files_done,
+            'files_failed': self.files_failed,
+            'files_total': self.files_total,
+            'bytes_done': self.bytes_done,
+            'bytes_total': self.bytes_total,
+            'elapsed': now - self.started_at,
+            'throughput': throughput,
+            'eta': 0 if finished else (bytes_left / throughput if throughput > 0 else None),
+            'finished': finished,
+        }
+
+    def _sent(self, file_progress, bytes):
+        with self.lock:
+            file_progress.bytes_done += bytes
+            self.bytes_done += bytes
+        self.report()
+
+    def _file_done(self, file_progress, success):
+        with self.lock:
+            if success:
+                # whatever boto did not report, for example an empty file
+                self.bytes_done += file_progress.size - file_progress.bytes_done
+                file_progress.bytes_done = file_progress.size
+                self.files_done += 1
+            else:
+                # a file that failed is not going to be transferred, so it does not count towards the eta either
+                self.bytes_done -= file_progress.bytes_done
+                self.bytes_total -= file_progress.size
+                file_progress.bytes_done = 0
+                self.files_failed += 1
+        self.report()
+
+
+class FileProgress(object):
+
+    "Progress of one file of a Progress. Its parts can be sent in parallel, each with a callback of its own."
+
+    def __init__(self, progress, size):
+        self.progress = progress
+        self.size = size
+        self.bytes_done = 0
+
+    def callback(self):
+        "A boto progress callback for one request of the file. Pass it as cb along with num_cb=-1."
+        state = {'seen': 0}
+
+        def cb(transmitted, total):
+            # negative when boto starts sending over, which takes back what the failed attempt had counted
+            sent = transmitted - state['seen']
+            state['seen'] = transmitted
+            if sent:
+                self.progress._sent(self, sent)
+        return cb
+
+    def done(self, success=True):
+        self.progress._file_done(self, success)
@@ -0,0 +1,162 @@
+import time
+
+from .sqlite import locked_connection
+
+__all__ = ['TokenBucket']
+
+# The bytes sent or received are taken from the bucket in chunks of at least this many bytes,
+# so that the transfers do not lock the SQLite file for every 8KB boto sends.
+BYTES_PER_TAKE = 64 * 1024
+
+# Number of seconds the rate read from the file is trusted while it is unlimited. Another process can limit it meanwhile.
+RATE_CHECK_INTERVAL = 1
+
+
+class TokenBucket(object):
+
+    """
+    A token bucket that limits how many bytes or requests are sent per second.
+
+    The bucket fills up with rate tokens per second up to burst tokens. Every byte or request takes a token.
+    When the bucket is empty, the thread that took the last tokens waits for as long as it takes to refill them.
+
+    The state of the bucket is kept in a SQLite file, so the processes on the host that use the same file
+    share one budget along with all their threads. Without a path it is only shared by the threads of this process.
+
+    The rate can be changed at any time with set_rate, by any of the processes.
+    The rate given when the bucket is created is only used if the file does not have a rate for the bucket yet.
+
+    Parameters
+    ----------
+
+    name : string
+        Name of the bucket in the file, for example 'bytes' or 'requests'.
+
+    rate : number, optional
+        Number of tokens per second. Default is None which means unlimited.
+
+    burst : number, optional
+        Number of tokens that can be taken at once after being idle. Default is one second worth of tokens.
+
+    path : string, optional
+        Path to the SQLite file. It is created if it does not exist. Default is None which means in memory.
+
+    Examples
+    --------
+
+        >>> from s3utils import S3utils
+        >>> s3utils = S3utils(
+        ... AWS_STORAGE_BUCKET_NAME = 'your bucket name',
+        ... S3UTILS_BYTES_PER_SECOND = 10 * 1024 * 1024,
+        ... S3UTILS_RATE_LIMIT_PATH = '/var/run/s3utils_rate_limit.sqlite',
+        ... )
+        >>> # peak hours are over. Every process using the file can send 100MB/s now.
+        >>> s3utils.bandwidth.set_rate(100 * 1024 * 1024)
+    """
+
+    def __init__(self, name, rate=None, burst=None, path=None):
+        self.name = name
+        self.path = path
+        # the processes wait for each other's BEGIN IMMEDIATE in take, so they can wait for longer
+        self.db, self.lock = locked_connection(path, timeout=60)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS token_buckets ("
+            "name TEXT PRIMARY KEY, rate REAL, burst REAL, tokens REAL, updated_at REAL)")
+        self.db.execute(
+            "INSERT OR IGNORE INTO token_buckets VALUES (?, ?, ?, ?, ?)",
+            (name, rate, burst, burst or rate or 0, time.time()))
+        self._rate = None
+        self._rate_checked_at = None
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    @property
+    def rate(self):
+        "Number of tokens per second or None if unlimited."
+        with self.lock:
+            return self.__read_rate()
+
+    def __read_rate(self):
+        self._rate = self.db.execute("SELECT rate FROM token_buckets WHERE name = ?", (self.name,)).fetchone()[0]
+        self._rate_checked_at = time.time()
+        return self._rate
+
+    def set_rate(self, rate, burst=None):
+        """
+        Change the rate of the bucket for every process that uses it.
+
+        Parameters
+        ----------
+
+        rate : number
+            Number of tokens per second. None means unlimited.
+
+        burst : number, optional
+            Default is one second worth of tokens.
+        """
+        with self.lock:
+            self.db.execute(
+                "UPDATE token_buckets SET rate = ?, burst = ?, tokens = MIN(tokens, ?) WHERE name = ?",
+                (rate, burst, burst or rate or 0, self.name))
+            self._rate = rate
+            self._rate_checked_at = time.time()
+
+    def take(self, amount=1):
+        """
+        Take amount tokens from the bucket, waiting until they are refilled if the bucket is short of them.
+
+        Amounts bigger than the burst are taken too. The bucket then owes the difference and the next takers wait for it.
+
+        **Returns:**
+
+        Number of seconds waited.
+        """
+        if amount <= 0:
+            return 0
+        with self.lock:
+            now = time.time()
+            if self._rate is None and self._rate_checked_at and now - self._rate_checked_at < RATE_CHECK_INTERVAL:
+                return 0
+            # BEGIN IMMEDIATE locks the file so that the other processes take their tokens one after the other
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                rate, burst, tokens, updated_at = self.db.execute(
+                    "SELECT rate, burst, tokens, updated_at FROM token_buckets WHERE name = ?", (self.name,)).fetchone()
+                if rate:
+                    tokens = min(burst or rate, tokens + max(0, now - updated_at) * rate) - amount
+                    self.db.execute(
+                        "UPDATE token_buckets SET tokens = ?, updated_at = ? WHERE name = ?",
+                        (tokens, max(now, updated_at), self.name))
+                self.db.execute("COMMIT")
+            except:
+                self.db.execute("ROLLBACK")
+                raise
+            self._rate = rate or None
+            self._rate_checked_at = now
+        wait = -tokens / rate if rate and tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def callback(self):
+        """
+        A boto progress callback that takes a token for every byte sent or received.
+
+        Pass it as cb along with num_cb=-1 so that boto calls it for every chunk of the transfer.
+        Each transfer needs a callback of its own.
+        """
+        # a dict rather than nonlocal, which Python 2 does not have
+        state = {'seen': 0, 'owed': 0}
+
+        def cb(transmitted, total):
+            # boto starts counting over when it sends the file again
+            if transmitted < state['seen']:
+                state['seen'] = 0
+            state['owed'] += transmitted - state['seen']
+            state['seen'] = transmitted
+            if state['owed'] >= BYTES_PER_TAKE or (total and transmitted >= total):
+                owed, state['owed'] = state['owed'], 0
+                self.take(owed)
+        return cb
@@ -0,0 +1,161 @@
+import errno
+import logging
+import random
+import socket
+import threading
+import time
+
+from boto.exception import BotoServerError
+
+try:
+    from http.client import HTTPException
+except ImportError:  # Python 2
+    from httplib import HTTPException
+
+__all__ = ['RetryPolicy', 'AdaptiveConcurrency']
+
+logger = logging.getLogger(__name__)
+
+# S3 and CloudFront ask to slow down with these
+THROTTLING_CODES = ('SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'ServiceUnavailable')
+RETRYABLE_CODES = THROTTLING_CODES + ('RequestTimeout', 'InternalError', 'OperationAborted')
+RETRYABLE_STATUSES = (500, 502, 503, 504)
+RETRYABLE_ERRNOS = (errno.ECONNRESET, errno.ECONNREFUSED, errno.ECONNABORTED, errno.ETIMEDOUT, errno.EPIPE)
+
+# Most requests in flight that AdaptiveConcurrency lets through
+MAX_CONCURRENCY = 128
+
+
+def is_throttling(error):
+    "Whether the error is S3 asking to slow down."
+    return isinstance(error, BotoServerError) and (error.status == 503 or error.error_code in THROTTLING_CODES)
+
+
+def is_retryable(error):
+    "Whether the request that failed with the error might succeed if it is sent again."
+    if isinstance(error, BotoServerError):
+        return error.status in RETRYABLE_STATUSES or error.error_code in RETRYABLE_CODES
+    if isinstance(error, (socket.timeout, HTTPException)):
+        return True
+    # socket.error is the same as OSError on Python 3 so the local file errors are told apart by errno
+    return isinstance(error, socket.error) and error.errno in RETRYABLE_ERRNOS
+
+
+class AdaptiveConcurrency(object):
+
+    """
+    A limit on the number of requests in flight that adapts to S3 throttling, additive increase and multiplicative decrease.
+
+    - When S3 throttles a request, the limit is cut to half of the requests in flight.
+      The other requests that were already in flight then do not cut it again.
+    - After every limit requests that went fine since the last cut, roughly one round of requests,
+      the limit grows by one up to max_limit.
+
+    Parameters
+    ----------
+
+    max_limit : integer, optional
+        Default is MAX_CONCURRENCY.
+
+    min_limit : integer, optional
+        Default is 1.
+    """
+
+    def __init__(self, max_limit=MAX_CONCURRENCY, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self.successes = 0
+        # bumped on every decrease so the requests sent before it are not counted twice
+        self.generation = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        "Wait for room for one more request. Returns the token to release it with."
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+            return self.generation
+
+    def release(self, token, throttled=False):
+        with self.condition:
+            if throttled and token == self.generation:
+                self.limit = max(self.min_limit, min(self.limit, self.in_flight) // 2)
+                self.successes = 0
+                self.generation += 1
+                logger.info("S3 is throttling. Sending at most %s requests at a time.", self.limit)
+            elif not throttled and token == self.generation:
+                self.successes += 1
+                if self.successes >= self.limit:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self.successes = 0
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+
+class RetryPolicy(object):
+
+    """
+    Retries the requests that fail with an error worth retrying, with full jitter exponential backoff.
+
+    Attempt n waits a random time between 0 and base_delay * 2 ** n seconds, capped at max_delay.
+    Errors that retrying can not fix, like access denied or a missing file, are raised right away.
+
+    Parameters
+    ----------
+
+    attempts : integer, optional
+        Number of times a request is sent at most. Default is 5.
+
+    base_delay : number, optional
+        Default is 0.1 seconds.
+
+    max_delay : number, optional
+        Default is 20 seconds.
+
+    concurrency : AdaptiveConcurrency, optional
+        Every request waits for room in it and tells it whether S3 throttled it.
+
+    rate_limit : TokenBucket, optional
+        Every request takes a token from it before it is sent.
+
+    Examples
+    --------
+
+        >>> retry = RetryPolicy(attempts=3)
+        >>> retry.call(bucket.delete_key, "path/to/file")
+    """
+
+    def __init__(self, attempts=5, base_delay=0.1, max_delay=20, concurrency=None, rate_limit=None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, *args, **kwargs):
+        "Call fn with the arguments until it succeeds, it fails with an error that is not retryable or the attempts run out."
+        attempt = 0
+        while True:
+            # waiting for the rate limit does not hold a place in the concurrency limit
+            if self.rate_limit:
+                self.rate_limit.take()
+            token = self.concurrency.acquire() if self.concurrency else None
+            throttled = False
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttling(e)
+                attempt += 1
+                if attempt >= self.attempts or not is_retryable(e):
+                    raise
+                logger.warning("Retrying %s after attempt %s failed: %r", getattr(fn, '__name__', fn), attempt, e)
+            finally:
+                if self.concurrency:
+                    self.concurrency.release(token, throttled)
+            time.sleep(self.delay(attempt))
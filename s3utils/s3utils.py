@@ -1,16 +1,41 @@
 import os
 import re
+import calendar
+import mimetypes
+import uuid
+import threading
+import time
+import weakref
 import boto
 # from boto.s3.connection import S3Connection
 from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
+from boto.s3.prefix import Prefix
+from boto.s3.connection import OrdinaryCallingFormat
 from boto import connect_cloudfront
+from boto.utils import parse_ts
 from shutil import rmtree
 from collections import Iterable, OrderedDict
 from functools import wraps  # deals with decorats shpinx documentation
+from itertools import islice
 
 from sys import version
 
-__all__ = ['S3utils']
+from .index import RemoteIndex
+from .hashcache import HashCache, file_md5, md5_tuple
+from .invalidation import QUEUED, InvalidationQueue, collapse_paths, wait_for_invalidations
+from .retry import RetryPolicy, AdaptiveConcurrency, HTTPException
+from .ratelimit import TokenBucket
+from .instrumentation import Instrumentation, InstrumentationHook, LoggingHook, StatsdHook, Histogram
+from .progress import Progress
+
+try:
+    from queue import Queue, Empty
+except ImportError:  # Python 2
+    from Queue import Queue, Empty
+
+__all__ = ['S3utils', 'RemoteIndex', 'HashCache', 'InvalidationQueue', 'RetryPolicy', 'AdaptiveConcurrency', 'TokenBucket',
+           'Instrumentation', 'InstrumentationHook', 'LoggingHook', 'StatsdHook', 'Histogram', 'Progress']
 
 py_major_version = version[0]
 py_minor_version = version[2]
@@ -37,6 +62,24 @@ except:
         S3_ROOT_BASE = ""
         S3UTILS_DEBUG_LEVEL = 0
         AWS_HEADERS = dict()
+        S3UTILS_MULTIPART_THRESHOLD = 64 * 1024 * 1024
+        S3UTILS_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+        S3UTILS_MULTIPART_WORKERS = 4
+        S3UTILS_INDEX_PATH = None
+        S3UTILS_INDEX_TTL = 300
+        S3UTILS_HASH_CACHE_PATH = None
+        AWS_S3_HOST = None
+        AWS_S3_PORT = None
+        AWS_S3_USE_SSL = True
+        S3UTILS_VALIDATE_BUCKET = True
+        S3UTILS_SHARE_CONNECTIONS = False
+        S3UTILS_INVALIDATION_DELAY = 5
+        S3UTILS_INVALIDATION_MAX_PATHS = 10
+        S3UTILS_RETRIES = 5
+        S3UTILS_BYTES_PER_SECOND = None
+        S3UTILS_REQUESTS_PER_SECOND = None
+        S3UTILS_RATE_LIMIT_PATH = None
+        S3UTILS_INSTRUMENTATION_HOOKS = ()
 
 # Set default logging handler to avoid "No handler found" warnings.
 import logging
@@ -50,6 +93,21 @@ except ImportError:
 logging.getLogger(__name__).addHandler(NullHandler())
 logger = logging
 
+# S3 does not accept multipart upload parts smaller than 5MB (except the last part) or more than 10000 parts.
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+MULTIPART_MAX_PARTS = 10000
+
+# S3 deletes at most 1000 keys in one multi-object delete request.
+MULTI_DELETE_MAX_KEYS = 1000
+
+# S3 copies at most 5GB in one copy request. Bigger files are copied in parts.
+MULTIPART_COPY_THRESHOLD = 5 * 1024 * 1024 * 1024
+# The headers of a file that a multipart copy has to set itself, since S3 only copies them in a normal copy.
+MULTIPART_COPY_HEADERS = ('Content-Type', 'Cache-Control', 'Content-Encoding', 'Content-Disposition', 'Content-Language', 'Expires')
+
+# Seconds after which a bucket that had no CloudFront distribution is looked up again, in case one was made since.
+NO_DISTRIBUTION_TTL = 300
+
 
 def connectit(fn):
     @wraps(fn)
@@ -80,6 +138,202 @@ def connectit_cloudfront(fn):
     return wrapped
 
 
+def iter_batches(iterable, size):
+    """Lazily yield lists of up to size items from the iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            break
+        yield batch
+
+
+def iter_files_sorted(local_path):
+    """
+    Lazily yield (relative path, full path) of the files under local_path in the order S3 lists keys.
+
+    Each directory is sorted as its name plus / so the relative paths come out in the same order as
+    the S3 listing of the uploaded files. Only one directory listing per level is held in memory.
+    Symlinks to directories are not followed, same as os.walk.
+    """
+    entries = []
+    for name in os.listdir(local_path):
+        full_path = os.path.join(local_path, name)
+        if os.path.isdir(full_path):
+            if not os.path.islink(full_path):
+                entries.append((name + "/", full_path))
+        else:
+            entries.append((name, full_path))
+
+    for name, full_path in sorted(entries):
+        if name.endswith("/"):
+            for relative_path, file_path in iter_files_sorted(full_path):
+                yield name + relative_path, file_path
+        else:
+            yield name, full_path
+
+
+# os.rename does not replace an existing file on Windows
+replace_file = getattr(os, 'replace', os.rename)
+
+
+def makedirs(path):
+    "os.makedirs that does not fail when another thread creates the folder first."
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+_POOL_STOP = object()
+
+# The idle connections of the S3utils that have S3UTILS_SHARE_CONNECTIONS on, by their connection settings
+_shared_connections = {}
+_shared_connections_lock = threading.Lock()
+
+
+# (ids, time of the lookup) of the CloudFront distributions of the buckets, looked up once per process
+_distribution_ids = {}
+_distribution_ids_lock = threading.Lock()
+
+
+def shared_idle_connections(connection_settings):
+    "The process wide queue of idle (connection, bucket) tuples for the connection settings."
+    with _shared_connections_lock:
+        return _shared_connections.setdefault(connection_settings, Queue())
+
+
+def pool_imap_unordered(fn, iterable, max_workers=1, backlog=None, on_thread_exit=None):
+    """
+    Run fn on every item of the iterable using a pool of max_workers threads.
+
+    Yields (item, result) tuples in the order they finish.
+    The iterable is consumed lazily and no more than backlog items (2 * max_workers by default)
+    are in flight at any time, so the memory usage does not grow with the length of the iterable.
+    If fn raises an exception, the pending items are dropped and the exception is re-raised in the caller.
+    With max_workers of 1 or less everything runs in the calling thread.
+    on_thread_exit is called in each worker thread right before it exits. The worker threads have all exited
+    by the time the pool is done.
+    """
+    if max_workers <= 1:
+        for item in iterable:
+            yield item, fn(item)
+        return
+
+    backlog = backlog or max_workers * 2
+    tasks = Queue()
+    results = Queue()
+
+    def worker():
+        try:
+            while True:
+                item = tasks.get()
+                if item is _POOL_STOP:
+                    break
+                try:
+                    results.put((item, fn(item), None))
+                except Exception as e:
+                    results.put((item, None, e))
+        finally:
+            if on_thread_exit:
+                on_thread_exit()
+
+    threads = [threading.Thread(target=worker) for i in range(max_workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    items = iter(iterable)
+    pending = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and pending < backlog:
+                try:
+                    tasks.put(next(items))
+                except StopIteration:
+                    exhausted = True
+                else:
+                    pending += 1
+            if not pending:
+                break
+            item, result, error = results.get()
+            pending -= 1
+            if error is not None:
+                raise error
+            yield item, result
+    finally:
+        # drop whatever has not been picked up yet and let the workers exit
+        try:
+            while True:
+                tasks.get_nowait()
+        except Empty:
+            pass
+        for thread in threads:
+            tasks.put(_POOL_STOP)
+        # nothing is left running in the background once the pool is done
+        for thread in threads:
+            thread.join()
+
+
+def local_targets(local_path, target_path):
+    """
+    Yield (local path, target file) for every file of a local file or folder copied to target_path on S3.
+
+    The empty folders are yielded too, with a target ending in / for the key that stands for the folder.
+    """
+    if not os.path.isdir(local_path):
+        yield local_path, target_path
+        return
+
+    first_local_root = None
+    for local_root, directories, files in os.walk(local_path):
+
+        if not first_local_root:
+            first_local_root = local_root
+
+        # if folder is not empty
+        if files:
+            for a_file in files:
+                yield os.path.join(local_root, a_file), os.path.join(target_path + local_root.replace(first_local_root, ""), a_file)
+
+        # if folder is empty
+        else:
+            yield local_root, target_path + local_root.replace(first_local_root, "") + "/"
+
+
+class CheckedOutConnection(object):
+
+    """
+    The (connection, bucket) a thread checked out of the pool of an S3utils.
+
+    It is kept in the thread local data of the S3utils, which Python deletes when the thread ends.
+    The connection then goes back to the pool, so threads that never call release_connection,
+    like the threads of a server that starts one per request, do not keep a connection each.
+    """
+
+    def __init__(self, s3utils, conn, bucket):
+        # a weak reference so that the threads do not keep the S3utils alive
+        self.s3utils = weakref.ref(s3utils)
+        self.conn = conn
+        self.bucket = bucket
+
+    def __del__(self):
+        self.check_in()
+
+    def check_in(self):
+        "Give the connection back to the pool, unless it was closed by disconnect in the meantime."
+        s3utils = self.s3utils()
+        conn, self.conn = self.conn, None
+        if s3utils is None or conn is None:
+            return
+        with s3utils.connections_lock:
+            if s3utils.connections.pop(id(conn), None) is None:
+                return
+        s3utils.idle_connections.put((conn, self.bucket))
+
+
 class S3utils(object):
 
     """
@@ -97,6 +351,24 @@ class S3utils(object):
         AWS_STORAGE_BUCKET_NAME=getattr(settings, "AWS_STORAGE_BUCKET_NAME", ""),
         S3UTILS_DEBUG_LEVEL=getattr(settings, "S3UTILS_DEBUG_LEVEL", 0),
         AWS_HEADERS=getattr(settings, "AWS_HEADERS", {}),
+        S3UTILS_MULTIPART_THRESHOLD=getattr(settings, "S3UTILS_MULTIPART_THRESHOLD", 64 * 1024 * 1024),
+        S3UTILS_MULTIPART_CHUNKSIZE=getattr(settings, "S3UTILS_MULTIPART_CHUNKSIZE", 16 * 1024 * 1024),
+        S3UTILS_MULTIPART_WORKERS=getattr(settings, "S3UTILS_MULTIPART_WORKERS", 4),
+        S3UTILS_INDEX_PATH=getattr(settings, "S3UTILS_INDEX_PATH", None),
+        S3UTILS_INDEX_TTL=getattr(settings, "S3UTILS_INDEX_TTL", 300),
+        S3UTILS_HASH_CACHE_PATH=getattr(settings, "S3UTILS_HASH_CACHE_PATH", None),
+        AWS_S3_HOST=getattr(settings, "AWS_S3_HOST", None),
+        AWS_S3_PORT=getattr(settings, "AWS_S3_PORT", None),
+        AWS_S3_USE_SSL=getattr(settings, "AWS_S3_USE_SSL", True),
+        S3UTILS_VALIDATE_BUCKET=getattr(settings, "S3UTILS_VALIDATE_BUCKET", True),
+        S3UTILS_SHARE_CONNECTIONS=getattr(settings, "S3UTILS_SHARE_CONNECTIONS", False),
+        S3UTILS_INVALIDATION_DELAY=getattr(settings, "S3UTILS_INVALIDATION_DELAY", 5),
+        S3UTILS_INVALIDATION_MAX_PATHS=getattr(settings, "S3UTILS_INVALIDATION_MAX_PATHS", 10),
+        S3UTILS_RETRIES=getattr(settings, "S3UTILS_RETRIES", 5),
+        S3UTILS_BYTES_PER_SECOND=getattr(settings, "S3UTILS_BYTES_PER_SECOND", None),
+        S3UTILS_REQUESTS_PER_SECOND=getattr(settings, "S3UTILS_REQUESTS_PER_SECOND", None),
+        S3UTILS_RATE_LIMIT_PATH=getattr(settings, "S3UTILS_RATE_LIMIT_PATH", None),
+        S3UTILS_INSTRUMENTATION_HOOKS=getattr(settings, "S3UTILS_INSTRUMENTATION_HOOKS", ()),
     ):
         """
         Parameters
@@ -114,6 +386,82 @@ class S3utils(object):
             AWS Bucket name. If it is defined in your Django settings, it will grab it from there.
             Otherwise you need to specify it here.
 
+        S3UTILS_MULTIPART_THRESHOLD : integer, optional
+            Files bigger than this many bytes are uploaded as multipart uploads. Default is 64MB.
+
+        S3UTILS_MULTIPART_CHUNKSIZE : integer, optional
+            Size of each part of a multipart upload in bytes. Default is 16MB.
+            S3 needs the parts to be at least 5MB so anything less is rounded up.
+
+        S3UTILS_MULTIPART_WORKERS : integer, optional
+            Number of parts of a multipart upload that are uploaded in parallel. Default is 4.
+
+        S3UTILS_INDEX_PATH : string, optional
+            Path to a SQLite file to keep a local index of the files on S3 in. Default is None which means no index.
+            When set, cp and echo with overwrite=False check the index instead of listing the bucket every time.
+            See RemoteIndex for how the index is kept up to date.
+
+        S3UTILS_INDEX_TTL : integer, optional
+            Number of seconds the listing of a folder in the index is trusted before it is listed again. Default is 300.
+
+        S3UTILS_HASH_CACHE_PATH : string, optional
+            Path to a SQLite file to cache the md5 of the uploaded files in. Default is None which means no cache.
+            When set, the files that have not changed since they were last hashed are not read again to compute their md5.
+            The cache hits and misses are counted in s3utils.hash_cache.stats()
+
+        AWS_S3_HOST : string, optional
+            Host of an S3 compatible server, for example a local moto server for testing. Default is Amazon S3.
+            The bucket name is put in the path of the urls instead of the host name when it is set.
+
+        AWS_S3_PORT : integer, optional
+            Port of the S3 compatible server.
+
+        AWS_S3_USE_SSL : boolean, optional
+            Whether to connect with https. Default is True.
+
+        S3UTILS_VALIDATE_BUCKET : boolean, optional
+            Whether connecting sends a request to S3 to check that the bucket exists. Default is True.
+            Set it to False to save a round trip per connection. A missing bucket then fails the first real request.
+
+        S3UTILS_SHARE_CONNECTIONS : boolean, optional
+            Whether to share the connections with the other S3utils of the process that have the same credentials,
+            bucket and host. Default is False.
+            When set, a connection is given back to be reused once its S3utils is deleted instead of being closed,
+            so creating a short lived S3utils, for example in every Django view, does not cost a new TLS handshake.
+
+        S3UTILS_INVALIDATION_DELAY : number, optional
+            Number of seconds the paths to be invalidated on CloudFront wait for more paths before they are sent
+            in one invalidation request. Default is 5. Each S3utils has an InvalidationQueue of its own.
+
+        S3UTILS_INVALIDATION_MAX_PATHS : integer, optional
+            Path budget for the files that copying a folder with cp(invalidate=True) invalidates. Default is 10.
+            Above it, the files are collapsed into folder/* wildcards that invalidate as few unchanged files as possible.
+            The folders whose files all changed always become a wildcard. See collapse_paths.
+
+        S3UTILS_RETRIES : integer, optional
+            Number of times a request to S3 is sent at most when it fails with an error worth retrying,
+            like 503 SlowDown or a connection reset. Default is 5. See RetryPolicy.
+            The requests of all the threads share an AdaptiveConcurrency that sends fewer of them at a time
+            while S3 is throttling. It is in s3utils.retry.concurrency.
+
+        S3UTILS_BYTES_PER_SECOND : integer, optional
+            Number of bytes uploaded and downloaded per second at most. Default is None which means unlimited.
+            It can be changed while the transfers are running with s3utils.bandwidth.set_rate. See TokenBucket.
+
+        S3UTILS_REQUESTS_PER_SECOND : number, optional
+            Number of requests sent to S3 per second at most. Default is None which means unlimited.
+            It can be changed while the transfers are running with s3utils.request_rate.set_rate.
+
+        S3UTILS_RATE_LIMIT_PATH : string, optional
+            Path to a SQLite file to keep the rate limits in. Default is None which means the limits are
+            only shared by the threads of this S3utils. When set, all the processes on the host that use the file
+            share the same limits, and the rates set through any of them apply to all of them.
+
+        S3UTILS_INSTRUMENTATION_HOOKS : list, optional
+            InstrumentationHook objects that are told about every request sent to S3 and CloudFront,
+            for example LoggingHook or StatsdHook. Default is none.
+            The latency histograms and counters of the requests are in s3utils.instrumentation.stats() either way.
+
         """
 
         self.AWS_ACCESS_KEY_ID = AWS_ACCESS_KEY_ID
@@ -121,8 +469,35 @@ class S3utils(object):
         self.AWS_STORAGE_BUCKET_NAME = AWS_STORAGE_BUCKET_NAME
         self.S3UTILS_DEBUG_LEVEL = S3UTILS_DEBUG_LEVEL
         self.AWS_HEADERS = AWS_HEADERS
-        self.conn = None
+        self.S3UTILS_MULTIPART_THRESHOLD = S3UTILS_MULTIPART_THRESHOLD
+        self.S3UTILS_MULTIPART_CHUNKSIZE = S3UTILS_MULTIPART_CHUNKSIZE
+        self.S3UTILS_MULTIPART_WORKERS = S3UTILS_MULTIPART_WORKERS
+        self.index = RemoteIndex(S3UTILS_INDEX_PATH, AWS_STORAGE_BUCKET_NAME, S3UTILS_INDEX_TTL) if S3UTILS_INDEX_PATH else None
+        self.hash_cache = HashCache(S3UTILS_HASH_CACHE_PATH) if S3UTILS_HASH_CACHE_PATH else None
+        self.AWS_S3_HOST = AWS_S3_HOST
+        self.AWS_S3_PORT = AWS_S3_PORT
+        self.AWS_S3_USE_SSL = AWS_S3_USE_SSL
+        self.S3UTILS_VALIDATE_BUCKET = S3UTILS_VALIDATE_BUCKET
+        self.S3UTILS_SHARE_CONNECTIONS = S3UTILS_SHARE_CONNECTIONS
+        self.S3UTILS_INVALIDATION_DELAY = S3UTILS_INVALIDATION_DELAY
+        self.S3UTILS_INVALIDATION_MAX_PATHS = S3UTILS_INVALIDATION_MAX_PATHS
+        self.instrumentation = Instrumentation(S3UTILS_INSTRUMENTATION_HOOKS)
+        self.bandwidth = TokenBucket('bytes', S3UTILS_BYTES_PER_SECOND, path=S3UTILS_RATE_LIMIT_PATH)
+        self.request_rate = TokenBucket('requests', S3UTILS_REQUESTS_PER_SECOND, path=S3UTILS_RATE_LIMIT_PATH)
+        self.retry = RetryPolicy(attempts=S3UTILS_RETRIES, concurrency=AdaptiveConcurrency(), rate_limit=self.request_rate)
+        # every thread checks out a connection of its own. The connections of threads that are done wait here to be reused.
+        self.thread_local = threading.local()
+        self.connections = {}
+        self.connections_lock = threading.Lock()
+        if S3UTILS_SHARE_CONNECTIONS:
+            self.idle_connections = shared_idle_connections(
+                (AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_STORAGE_BUCKET_NAME,
+                 AWS_S3_HOST, AWS_S3_PORT, AWS_S3_USE_SSL, S3UTILS_DEBUG_LEVEL))
+        else:
+            self.idle_connections = Queue()
         self.conn_cloudfront = None
+        self.__invalidation_queue = None
+        self.invalidation_queue_lock = threading.Lock()
 
         # setting the logging level based on S3UTILS_DEBUG_LEVEL
         try:
@@ -134,7 +509,13 @@ class S3utils(object):
             pass
 
     def __del__(self):
-        if self.conn:
+        if self.S3UTILS_SHARE_CONNECTIONS:
+            # nothing can use the connections of this S3utils anymore so they are free for the next one
+            with self.connections_lock:
+                for conn, bucket in self.connections.values():
+                    self.idle_connections.put((conn, bucket))
+                self.connections.clear()
+        else:
             self.disconnect()
 
     def printv(self, msg):
@@ -142,103 +523,329 @@ class S3utils(object):
             print(msg)
             logger.info(msg)
 
+    @property
+    def conn(self):
+        "The S3 connection of the current thread or None if the thread is not connected."
+        checked_out = getattr(self.thread_local, 'checked_out', None)
+        return checked_out.conn if checked_out else None
+
+    @property
+    def bucket(self):
+        "The bucket on the S3 connection of the current thread. The thread is connected if it is not yet."
+        if not self.conn:
+            self.connect()
+        return self.thread_local.checked_out.bucket
+
     def connect(self):
         """
         Establish the connection. This is done automatically for you.
 
+        Each thread checks out its own connection so one S3utils can be shared by many threads.
+        The connection of a thread that is done, or that called release_connection, is reused by the next thread that connects.
+
         If you lose the connection, you can manually run this to be re-connected.
         """
-        self.conn = boto.connect_s3(self.AWS_ACCESS_KEY_ID, self.AWS_SECRET_ACCESS_KEY, debug=self.S3UTILS_DEBUG_LEVEL)
+        try:
+            conn, bucket = self.idle_connections.get_nowait()
+        except Empty:
+            if self.AWS_S3_HOST:
+                conn = boto.connect_s3(
+                    self.AWS_ACCESS_KEY_ID, self.AWS_SECRET_ACCESS_KEY, debug=self.S3UTILS_DEBUG_LEVEL,
+                    host=self.AWS_S3_HOST, port=self.AWS_S3_PORT, is_secure=self.AWS_S3_USE_SSL,
+                    calling_format=OrdinaryCallingFormat())
+            else:
+                conn = boto.connect_s3(self.AWS_ACCESS_KEY_ID, self.AWS_SECRET_ACCESS_KEY, debug=self.S3UTILS_DEBUG_LEVEL)
 
-        self.bucket = self.conn.get_bucket(self.AWS_STORAGE_BUCKET_NAME)
+            # the requests are retried by self.retry, where the throttling is seen by the adaptive concurrency
+            conn.num_retries = 0
+            get_bucket = conn.get_bucket
+            if self.S3UTILS_VALIDATE_BUCKET:
+                get_bucket = self.instrumentation.wrap(get_bucket, 'HeadBucket')
+            bucket = self.retry.call(get_bucket, self.AWS_STORAGE_BUCKET_NAME, validate=self.S3UTILS_VALIDATE_BUCKET)
 
-        self.k = Key(self.bucket)
+        self.release_connection()
+        with self.connections_lock:
+            self.connections[id(conn)] = (conn, bucket)
+        self.thread_local.checked_out = CheckedOutConnection(self, conn, bucket)
+
+    def release_connection(self):
+        """
+        Give the connection of the current thread back so that another thread can reuse it.
+
+        The worker threads of the parallel methods do this for you when they are done,
+        and any other thread gives its connection back when it ends.
+        """
+        checked_out = getattr(self.thread_local, 'checked_out', None)
+        if checked_out:
+            checked_out.check_in()
+            self.thread_local.checked_out = None
 
     def disconnect(self):
         """
-        Close the connection.
+        Close the connections of this S3utils and the idle connections.
+        With S3UTILS_SHARE_CONNECTIONS the idle connections shared with the other S3utils are closed too.
 
         This is normally done automatically when the garbage collector is deleting s3utils object.
         """
-        self.bucket.connection.connection.close()
-        self.conn = None
+        with self.connections_lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+        for conn, bucket in connections:
+            conn.close()
+        self.thread_local.checked_out = None
+        while True:
+            try:
+                conn, bucket = self.idle_connections.get_nowait()
+            except Empty:
+                break
+            conn.close()
+
+    def __pool_imap(self, fn, iterable, max_workers=1):
+        "pool_imap_unordered whose worker threads give their connection back when they are done."
+        return pool_imap_unordered(fn, iterable, max_workers=max_workers, on_thread_exit=self.release_connection)
 
     def connect_cloudfront(self):
         "Connect to Cloud Front. This is done automatically for you when needed."
         self.conn_cloudfront = connect_cloudfront(self.AWS_ACCESS_KEY_ID, self.AWS_SECRET_ACCESS_KEY, debug=self.S3UTILS_DEBUG_LEVEL)
 
+    @property
+    def cloudfront(self):
+        "The Cloud Front connection with its requests reported to s3utils.instrumentation."
+        return self.instrumentation.cloudfront(self.conn_cloudfront)
+
+    def __headers(self, acl=None):
+        """
+        Return the AWS_HEADERS plus the canned acl header.
+
+        Sending the acl with the upload sets the file permissions in the same request,
+        instead of a second set_acl request after the upload.
+        """
+        headers = dict(self.AWS_HEADERS)
+        if acl:
+            headers['x-amz-acl'] = acl
+        return headers
+
     @connectit
-    def mkdir(self, target_folder):
+    def mkdir(self, target_folder, acl=None):
         """
         Create a folder on S3.
 
+        Parameters
+        ----------
+
+        target_folder : string
+            Path to the folder on S3
+
+        acl : string, optional
+            Folder permissions on S3. By default the bucket's default permissions are used.
+
         Examples
         --------
             >>> s3utils.mkdir("path/to/my_folder")
             Making directory: path/to/my_folder
         """
         self.printv("Making directory: %s" % target_folder)
-        self.k.key = re.sub(r"^/|/$", "", target_folder) + "/"
-        self.k.set_contents_from_string('')
-        self.k.close()
+        k = Key(self.bucket, re.sub(r"^/|/$", "", target_folder) + "/")
+        self.retry.call(self.instrumentation.wrap(k.set_contents_from_string, 'PutObject', k.key, 0), '', self.__headers(acl))
+        k.close()
+        self.__index_add(k.key, 0, k.etag)
 
     @connectit
-    def rm(self, path):
+    def rm(self, path, max_workers=1):
         """
         Delete the path and anything under the path.
 
+        The files are deleted in batches of 1000 as soon as they are listed,
+        so the memory usage stays the same no matter how many files are under the path.
+
+        Parameters
+        ----------
+
+        path : string
+            Path to file or folder on S3
+
+        max_workers : integer, optional
+            Number of batches of files to delete in parallel. Default is 1.
+
+        **Returns**
+
+        Nothing on success, otherwise the files that could not be deleted.
+
         Example
         -------
             >>> s3utils.rm("path/to/file_or_folder")
+            >>> # When some files can not be deleted, it returns them.
+            >>> s3utils.rm("path/to/folder", max_workers=4)
+            ERROR:root:Unable to delete path/to/folder/file.txt: AccessDenied
+            >>> {'failed_to_delete_files': {'path/to/folder/file.txt'}}
         """
+        nothing_to_remove = True
+        failed_to_delete_files = set([])
+
+        # deleting the files page by page as they are listed so the whole listing is never in memory
+        batches = iter_batches(self.iter_ls(path), MULTI_DELETE_MAX_KEYS)
+        for list_of_files, failed in self.__pool_imap(self.__delete_keys, batches, max_workers=max_workers):
+            nothing_to_remove = False
+            failed_to_delete_files.update(failed)
+
+        if nothing_to_remove:
+            logger.error("There was nothing to remove under %s", path)
 
-        list_of_files = list(self.ls(path))
+        if failed_to_delete_files:
+            return {'failed_to_delete_files': failed_to_delete_files}
 
-        if list_of_files:
+    @connectit
+    def __delete_keys(self, list_of_files):
+        """Delete a batch of up to 1000 files from s3 and return the ones that failed."""
+        try:
             if len(list_of_files) == 1:
-                self.bucket.delete_key(list_of_files[0])
+                self.retry.call(self.instrumentation.wrap(self.bucket.delete_key, 'DeleteObject', list_of_files[0]), list_of_files[0])
+                errors = []
             else:
-                self.bucket.delete_keys(list_of_files)
-            self.printv("Deleted: %s" % list_of_files)
-        else:
-            logger.error("There was nothing to remove under %s", path)
+                errors = self.retry.call(self.instrumentation.wrap(self.bucket.delete_keys, 'DeleteObjects'), list_of_files, quiet=True).errors
+        except:
+            logger.error("Error in deleting %s files starting from %s", len(list_of_files), list_of_files[0], exc_info=True)
+            return list_of_files
+
+        for error in errors:
+            logger.error("Unable to delete %s: %s", error.key, error.code)
+        self.printv("Deleted: %s" % list_of_files)
+        failed = [error.key for error in errors]
+        self.__index_remove(set(list_of_files).difference(failed))
+        return failed
+
+    def __index_add(self, name, size, etag):
+        "Add a file that was written to S3 to the index, if there is one."
+        if self.index:
+            self.__update_index(self.index.add, [name], name, size, etag)
+
+    def __index_remove(self, names):
+        "Remove files that were deleted from S3 from the index, if there is one."
+        if self.index and names:
+            self.__update_index(self.index.remove, names, names)
+
+    def __update_index(self, update, names, *args):
+        """
+        Apply a change that already succeeded on S3 to the index.
+
+        If the index can not be written, for example while another process holds its lock, the folders of the files
+        are made stale instead so they are listed from S3 again. The S3 request is not reported as failed.
+        """
+        try:
+            update(*args)
+        except:
+            logger.error("Error in updating the index for %s", ", ".join(islice(names, 10)), exc_info=True)
+            for folder in set(name.rpartition("/")[0] + "/" if "/" in name else "" for name in names):
+                try:
+                    self.index.expire(folder)
+                except:
+                    logger.error("Error in expiring the index of %s", folder, exc_info=True)
 
     @connectit
-    def __put_key(self, local_file, target_file, acl='public-read', del_after_upload=False, overwrite=True, source="filename"):
-        """Copy a file to s3."""
+    def __put_key(self, local_file, target_file, acl='public-read', del_after_upload=False, overwrite=True, source="filename", progress=None):
+        """Copy a file to s3. progress is the FileProgress of the file, if its bytes are counted."""
         action_word = "moving" if del_after_upload else "copying"
 
         try:
-            self.k.key = target_file  # setting the path (key) of file in the container
-
-            if source == "filename":
+            # A new key object per upload so that uploads can run in parallel threads.
+            k = Key(self.bucket)
+            k.key = target_file  # setting the path (key) of file in the container
+            headers = self.__headers(acl)  # the file permissions are set with the upload
+
+            if source == "filename" and os.path.getsize(local_file) > self.S3UTILS_MULTIPART_THRESHOLD:
+                k.etag = self.__put_multipart(local_file, target_file, headers, progress)
+                k.size = os.path.getsize(local_file)
+            elif source == "filename":
                 # grabs the contents from local_file address. Note that it loads the whole file into memory
-                self.k.set_contents_from_filename(local_file, self.AWS_HEADERS)
+                # boto reads the file once more to compute its md5, unless the md5 is cached
+                md5 = md5_tuple(self.hash_cache.md5(local_file)) if self.hash_cache else None
+                self.retry.call(self.instrumentation.wrap(k.set_contents_from_filename, 'PutObject', target_file, os.path.getsize(local_file)),
+                                local_file, headers, md5=md5, **self.__transfer_callback(progress))
             elif source == "fileobj":
-                self.k.set_contents_from_file(local_file, self.AWS_HEADERS)
+                start = local_file.tell()
+                callback = self.__transfer_callback(progress)
+
+                def send_file():
+                    local_file.seek(start)
+                    k.set_contents_from_file(local_file, headers, **callback)
+                self.retry.call(self.instrumentation.wrap(send_file, 'PutObject', target_file))
             elif source == "string":
-                self.k.set_contents_from_string(local_file, self.AWS_HEADERS)
+                self.retry.call(self.instrumentation.wrap(k.set_contents_from_string, 'PutObject', target_file, len(local_file)),
+                                local_file, headers, **self.__transfer_callback(progress))
             else:
                 raise Exception("%s is not implemented as a source." % source)
-            self.k.set_acl(acl)  # setting the file permissions
-            self.k.close()  # not sure if it is needed. Somewhere I read it is recommended.
-
-            self.printv("%s %s to %s" % (action_word, local_file, target_file))
-            # if it is supposed to delete the local file after uploading
-            if del_after_upload and source == "filename":
-                try:
-                    os.remove(local_file)
-                except:
-                    logger.error("Unable to delete the file: ", local_file, exc_info=True)
-
-            return True
+            k.close()  # not sure if it is needed. Somewhere I read it is recommended.
 
         except:
             logger.error("Error in writing to %s", target_file, exc_info=True)
             return False
 
+        self.__index_add(target_file, k.size, k.etag)
+        self.printv("%s %s to %s" % (action_word, local_file, target_file))
+        # if it is supposed to delete the local file after uploading
+        if del_after_upload and source == "filename":
+            try:
+                os.remove(local_file)
+            except:
+                logger.error("Unable to delete the file: ", local_file, exc_info=True)
+
+        return True
+
+    def __transfer_callback(self, progress=None):
+        """
+        The boto cb and num_cb arguments that hold a transfer to S3UTILS_BYTES_PER_SECOND
+        and count its bytes in the FileProgress given.
+        """
+        bandwidth = self.bandwidth.callback()
+        if not progress:
+            return {'cb': bandwidth, 'num_cb': -1}
+        counter = progress.callback()
+
+        def cb(transmitted, total):
+            bandwidth(transmitted, total)
+            counter(transmitted, total)
+        return {'cb': cb, 'num_cb': -1}
+
+    def __put_multipart(self, local_file, target_file, headers, progress=None):
+        """
+        Upload a big file to s3 in parts.
+
+        The parts are uploaded in parallel and each part is retried on its own by self.retry if it fails.
+        If a part still fails, the multipart upload is aborted so the uploaded parts do not stay on S3.
+        """
+        file_size = os.path.getsize(local_file)
+        chunk_size = max(self.S3UTILS_MULTIPART_CHUNKSIZE, MULTIPART_MIN_PART_SIZE, -(-file_size // MULTIPART_MAX_PARTS))
+        parts = [(part_num, offset, min(chunk_size, file_size - offset))
+                 for part_num, offset in enumerate(range(0, file_size, chunk_size), 1)]
+
+        # boto guesses the content type of a file sent in one request from its name, but not of a multipart upload
+        if not any(name.lower() == 'content-type' for name in headers):
+            headers = dict(headers)
+            headers['Content-Type'] = mimetypes.guess_type(local_file)[0] or Key.DefaultContentType
+
+        mp = self.retry.call(self.instrumentation.wrap(self.bucket.initiate_multipart_upload, 'CreateMultipartUpload', target_file),
+                             target_file, headers=headers)
+
+        def send_part(thread_mp, part_num, offset, size):
+            with open(local_file, 'rb') as fp:
+                fp.seek(offset)
+                thread_mp.upload_part_from_file(fp, part_num, size=size, **self.__transfer_callback(progress))
+
+        def upload_part(part):
+            # connecting the thread is retried on its own, so it is done before
+            self.retry.call(self.instrumentation.wrap(send_part, 'UploadPart', target_file, part[2]), self.__thread_multipart(mp), *part)
+
+        try:
+            for part, result in self.__pool_imap(upload_part, parts, max_workers=self.S3UTILS_MULTIPART_WORKERS):
+                self.printv("uploaded part %s of %s to %s" % (part[0], len(parts), target_file))
+            return self.retry.call(self.instrumentation.wrap(mp.complete_upload, 'CompleteMultipartUpload', target_file)).etag
+        except:
+            logger.error("Aborting the multipart upload of %s", target_file)
+            self.retry.call(self.instrumentation.wrap(mp.cancel_upload, 'AbortMultipartUpload', target_file))
+            raise
+
     def cp(self, local_path, target_path, acl='public-read',
-           del_after_upload=False, overwrite=True, invalidate=False):
+           del_after_upload=False, overwrite=True, invalidate=False, max_workers=1, progress=None):
         """
         Copy a file or folder from local to s3.
 
@@ -275,6 +882,18 @@ class S3utils(object):
             default = False
             Note that invalidation might take up to 15 minutes to take place. It is easier and faster to use cache buster
             to grab lastest version of your file on CDN than invalidation.
+            The files are queued and invalidated in batches along with the files of other copies.
+            When a folder is copied, its files can be invalidated as folder/* wildcards.
+            See S3UTILS_INVALIDATION_DELAY and S3UTILS_INVALIDATION_MAX_PATHS.
+
+        max_workers : integer, optional
+            Number of files to upload in parallel when copying a folder. Default is 1 which uploads one file at a time.
+            When del_after_upload is set, the local folder is only deleted once every file is uploaded successfully.
+
+        progress : callable or Progress, optional
+            Called with the files and bytes done out of the total, the throughput and the eta
+            about once a second while the files are uploaded, and once more at the end. See Progress.
+            The folder is walked once beforehand to know the totals.
 
         **Returns**
 
@@ -306,10 +925,6 @@ class S3utils(object):
             >>> {'file_does_not_exist': '/tmp/does_not_exist'}
         """
         result = None
-        if overwrite:
-            list_of_files = []
-        else:
-            list_of_files = self.ls(folder=target_path, begin_from_file="", num=-1, get_grants=False, all_grant_data=False)
 
         # copying the contents of the folder and not folder itself
         if local_path.endswith("/*"):
@@ -327,7 +942,21 @@ class S3utils(object):
 
         if os.path.exists(local_path):
 
-            result = self.__find_files_and_copy(local_path, target_path, acl, del_after_upload, overwrite, invalidate, list_of_files)
+            if not overwrite:
+                # only the files under the target path that a local file would overwrite are kept,
+                # so the memory usage does not grow with the number of files already on S3
+                targets = set(target_file for local_file, target_file in local_targets(local_path, target_path))
+                list_of_files = set(name for name in self.__existing_files(target_path) if name in targets)
+            elif invalidate:
+                # all the files under the target path to invalidate as few of them as possible with wildcards
+                list_of_files = set(self.__existing_files(target_path))
+            else:
+                list_of_files = []
+
+            if progress is not None and not isinstance(progress, Progress):
+                progress = Progress(progress)
+            result = self.__find_files_and_copy(
+                local_path, target_path, acl, del_after_upload, overwrite, invalidate, list_of_files, max_workers, progress)
 
         else:
             result = {'file_does_not_exist': local_path}
@@ -335,69 +964,77 @@ class S3utils(object):
 
         return result
 
-    def __find_files_and_copy(self, local_path, target_path, acl='public-read', del_after_upload=False, overwrite=True, invalidate=False, list_of_files=[]):
+    @connectit
+    def __find_files_and_copy(self, local_path, target_path, acl='public-read', del_after_upload=False, overwrite=True, invalidate=False, list_of_files=[], max_workers=1, progress=None):
         files_to_be_invalidated = []
         failed_to_copy_files = set([])
         existing_files = set([])
 
-        def check_for_overwrite_then_write():
+        is_folder = os.path.isdir(local_path)
 
-            if overwrite or (not overwrite and target_file not in list_of_files):
-                success = self.__put_key(
-                    local_file,
-                    target_file=target_file,
-                    acl=acl,
-                    del_after_upload=del_after_upload,
-                    overwrite=overwrite,
-                )
-                if not success:
-                    failed_to_copy_files.add(target_file)
-            else:
-                existing_files.add(target_file)
-                logger.error("%s already exist. Not overwriting.", target_file)
-
-            if overwrite and target_file in list_of_files and invalidate:
-                files_to_be_invalidated.append(target_file)
-
-        first_local_root = None
-
-        # if it is a folder
-        if os.path.isdir(local_path):
-
-            for local_root, directories, files in os.walk(local_path):
-
-                if not first_local_root:
-                    first_local_root = local_root
+        def find_files():
+            """Yield (local_file, target_file) for every file that needs to be copied."""
+            for local_file, target_file in local_targets(local_path, target_path):
+                # if folder is empty
+                if target_file.endswith("/"):
+                    if target_file not in list_of_files:
+                        self.mkdir(target_file, acl=acl)
+                else:
+                    yield local_file, target_file
 
-                # if folder is not empty
-                if files:
-                    # iterating over the files in the folder
-                    for a_file in files:
-                        local_file = os.path.join(local_root, a_file)
-                        target_file = os.path.join(
-                            target_path + local_root.replace(first_local_root, ""),
-                            a_file
-                        )
-                        check_for_overwrite_then_write()
+        def check_for_overwrite(files):
+            for local_file, target_file in files:
 
-                # if folder is empty
+                if overwrite or (not overwrite and target_file not in list_of_files):
+                    yield local_file, target_file
                 else:
-                    target_file = target_path + local_root.replace(first_local_root, "") + "/"
+                    existing_files.add(target_file)
+                    logger.error("%s already exist. Not overwriting.", target_file)
+                    if progress:
+                        progress.add(files=-1, bytes=-os.path.getsize(local_file))
+
+        def write(item):
+            local_file, target_file = item
+            file_progress = progress.file(os.path.getsize(local_file)) if progress else None
+            success = self.__put_key(
+                local_file,
+                target_file=target_file,
+                acl=acl,
+                # the files in a folder are deleted only after all of them are uploaded
+                del_after_upload=del_after_upload and not is_folder,
+                overwrite=overwrite,
+                progress=file_progress,
+            )
+            if file_progress:
+                file_progress.done(success)
+            return success
+
+        if progress:
+            for local_file, target_file in local_targets(local_path, target_path):
+                if not target_file.endswith("/"):
+                    progress.add(files=1, bytes=os.path.getsize(local_file))
+
+        for (local_file, target_file), success in self.__pool_imap(write, check_for_overwrite(find_files()), max_workers=max_workers):
+            if not success:
+                failed_to_copy_files.add(target_file)
+            elif overwrite and invalidate and target_file in list_of_files:
+                files_to_be_invalidated.append(target_file)
 
-                    if target_file not in list_of_files:
-                        self.mkdir(target_file)
+        if progress:
+            progress.report(finished=True)
 
-            if del_after_upload:
+        if is_folder and del_after_upload:
+            if failed_to_copy_files:
+                logger.error("Not deleting %s since some of the files failed to upload.", local_path)
+            else:
                 rmtree(local_path)
 
-        # if it is a file
-        else:
-            local_file = local_path
-            target_file = target_path
-            check_for_overwrite_then_write()
-
-        if invalidate and files_to_be_invalidated:
-            self.invalidate(files_to_be_invalidated)
+        if files_to_be_invalidated:
+            if is_folder:
+                files_to_be_invalidated = collapse_paths(
+                    files_to_be_invalidated, list_of_files, self.S3UTILS_INVALIDATION_MAX_PATHS, root=target_path + "/" if target_path else "")
+            # sent along with the files of other copies in the next batch of invalidations
+            self.invalidation_queue.add(files_to_be_invalidated)
 
         items = ('failed_to_copy_files', 'existing_files')
         local_vars = locals()
@@ -466,8 +1103,7 @@ class S3utils(object):
         if target_path.endswith('/') or target_path.endswith('*'):
             result = {'InvalidS3Path': "Path on S3 can not end in /"}
         if not overwrite and not result:
-            file_exists = self.ls(target_path)
-            if file_exists:
+            if self.__file_exists(target_path):
                 logger.error("%s already exist. Not overwriting.", target_path)
                 result = {'existing_files': target_path}
 
@@ -480,7 +1116,7 @@ class S3utils(object):
                 result = {"TypeError": "Content is not string"}
         return result
 
-    def mv(self, local_file, target_file, acl='public-read', overwrite=True, invalidate=False):
+    def mv(self, local_file, target_file, acl='public-read', overwrite=True, invalidate=False, max_workers=1, progress=None):
         """
         Similar to Linux mv command.
 
@@ -504,7 +1140,461 @@ class S3utils(object):
         dict
 
         """
-        self.cp(local_file, target_file, acl=acl, del_after_upload=True, overwrite=overwrite, invalidate=invalidate)
+        return self.cp(local_file, target_file, acl=acl, del_after_upload=True, overwrite=overwrite, invalidate=invalidate,
+                       max_workers=max_workers, progress=progress)
+
+    def __file_md5(self, local_file):
+        """Return the hex md5 of a local file, from the hash cache if there is one."""
+        if self.hash_cache:
+            return self.hash_cache.md5(local_file)
+        return file_md5(local_file)
+
+    @connectit
+    def sync(self, local_path, target_path, acl='public-read', delete=False, checksum=False, max_workers=1):
+        """
+        Similar to rsync. Make the target path on S3 have the same files as the local folder.
+
+        Only the new files and the files that have changed are uploaded.
+        The local folder is walked in sorted order and merged with the sorted listing of S3 in one pass,
+        so neither side is ever held in memory as a whole.
+
+        Parameters
+        ----------
+
+        local_path : string
+            Path to local folder. The contents of the folder are synced into the target path.
+
+        target_path : string
+            Target path on S3 bucket.
+
+        acl : string, optional
+            File permissions on S3 of the uploaded files. Default is public-read
+
+        delete : boolean, optional
+            Delete the files on S3 that do not exist in the local folder. Default is False.
+            Folder markers (keys ending in /) are never deleted.
+
+        checksum : boolean, optional
+            When a file has the same size locally and on S3, it is compared by the md5 of the local file and the ETag on S3.
+            By default, the file is considered changed if it was modified locally after it was uploaded to S3.
+            Files uploaded as multipart uploads have no md5 ETag so they are always compared by the modification time.
+
+        max_workers : integer, optional
+            Number of files to upload in parallel. Default is 1.
+
+        **Returns**
+
+        Nothing on success, otherwise the files that failed to be copied or deleted.
+
+        Examples
+        --------
+            >>> s3utils.sync("path/to/myfolder", "/test/", delete=True)
+            copying path/to/myfolder/changed.txt to test/changed.txt
+            Deleted: [u'test/removed_locally.txt']
+            >>> # When the folder does not exist, it returns a dictionary of what went wrong.
+            >>> s3utils.sync("/tmp/does_not_exist", "/test/")
+            ERROR:root:trying to sync to s3 but folder doesn't exist: /tmp/does_not_exist
+            >>> {'file_does_not_exist': '/tmp/does_not_exist'}
+        """
+        if not os.path.isdir(local_path):
+            logger.error("trying to sync to s3 but folder doesn't exist: %s" % local_path)
+            return {'file_does_not_exist': local_path}
+
+        failed_to_copy_files = set([])
+        failed_to_delete_files = set([])
+
+        prefix = re.sub(r"^/|/$", "", target_path)
+        prefix = prefix + "/" if prefix else ""
+
+        def is_changed(local_file, key):
+            stat = os.stat(local_file)
+            if stat.st_size != key.size:
+                return True
+            etag = key.etag.strip('"')
+            if checksum and "-" not in etag:
+                return self.__file_md5(local_file) != etag
+            return stat.st_mtime > calendar.timegm(parse_ts(key.last_modified).utctimetuple())
+
+        def to_be_synced():
+            """Merge the sorted local and remote listings and yield what needs to be uploaded or deleted."""
+            local_files = iter_files_sorted(local_path)
+            remote_keys = (key for key in self.__iter_keys(folder=prefix) if not key.name.endswith("/"))
+            files_to_be_deleted = []
+
+            local = next(local_files, None)
+            remote = next(remote_keys, None)
+            while local is not None or remote is not None:
+                remote_name = remote.name[len(prefix):] if remote else None
+
+                if remote is None or (local is not None and local[0] < remote_name):
+                    # only exists locally
+                    yield "upload", (local[1], prefix + local[0])
+                    local = next(local_files, None)
+
+                elif local is None or remote_name < local[0]:
+                    # only exists on S3
+                    if delete:
+                        files_to_be_deleted.append(remote.name)
+                        if len(files_to_be_deleted) == MULTI_DELETE_MAX_KEYS:
+                            yield "delete", files_to_be_deleted
+                            files_to_be_deleted = []
+                    remote = next(remote_keys, None)
+
+                else:
+                    if is_changed(local[1], remote):
+                        yield "upload", (local[1], remote.name)
+                    local = next(local_files, None)
+                    remote = next(remote_keys, None)
+
+            if files_to_be_deleted:
+                yield "delete", files_to_be_deleted
+
+        def apply(item):
+            action, arg = item
+            if action == "upload":
+                local_file, target_file = arg
+                return self.__put_key(local_file, target_file=target_file, acl=acl)
+            else:
+                return self.__delete_keys(arg)
+
+        for (action, arg), result in self.__pool_imap(apply, to_be_synced(), max_workers=max_workers):
+            if action == "upload" and not result:
+                failed_to_copy_files.add(arg[1])
+            elif action == "delete":
+                failed_to_delete_files.update(result)
+
+        result = {}
+        if failed_to_copy_files:
+            result['failed_to_copy_files'] = failed_to_copy_files
+        if failed_to_delete_files:
+            result['failed_to_delete_files'] = failed_to_delete_files
+        return result or None
+
+    @connectit
+    def get(self, remote_path, local_path):
+        """
+        Download a file from S3. The opposite of cp.
+
+        Big files are downloaded as byte ranges in parallel, based on S3UTILS_MULTIPART_CHUNKSIZE and S3UTILS_MULTIPART_WORKERS.
+        Each range is retried on its own if it fails.
+        The file is written to a temporary file next to local_path and only renamed to local_path
+        once its size and md5 (when S3 has the md5 as the ETag) are verified.
+
+        Parameters
+        ----------
+
+        remote_path : string
+            Path to file on S3
+
+        local_path : string
+            Local path to save the file to. If it is a folder, the file is saved in the folder with the same name as on S3.
+
+        **Returns**
+
+        Nothing on success, otherwise what went wrong.
+
+        Examples
+        --------
+            >>> s3utils.get("test/myfolder/hoho/photo.JPG", "/tmp/")
+            downloading test/myfolder/hoho/photo.JPG to /tmp/photo.JPG
+            >>> s3utils.get("does_not_exist", "/tmp/")
+            ERROR:root:trying to download from s3 but file doesn't exist: does_not_exist
+            >>> {'file_does_not_exist': 'does_not_exist'}
+        """
+        remote_path = re.sub(r"^/", "", remote_path)
+        key = self.retry.call(self.instrumentation.wrap(self.bucket.get_key, 'HeadObject', remote_path), remote_path)
+
+        if key is None:
+            logger.error("trying to download from s3 but file doesn't exist: %s" % remote_path)
+            return {'file_does_not_exist': remote_path}
+
+        if os.path.isdir(local_path) or local_path.endswith("/"):
+            local_path = os.path.join(local_path, os.path.basename(remote_path))
+
+        if not self.__get_key(key, local_path):
+            return {'failed_to_download_files': set([remote_path])}
+
+    @connectit
+    def download_tree(self, folder, local_folder, max_workers=1):
+        """
+        Download everything under a folder on S3 to a local folder.
+
+        The files are downloaded as soon as they are listed, so the memory usage stays the same
+        no matter how many files there are.
+        The contents of the S3 folder go into the local folder, the same layout that
+        s3utils.cp("local_folder/*", "folder") uploads.
+        Files that already exist locally with the same size are not downloaded again.
+
+        Parameters
+        ----------
+
+        folder : string
+            Path to folder on S3
+
+        local_folder : string
+            Path to local folder. It is created if it does not exist.
+
+        max_workers : integer, optional
+            Number of files to download in parallel. Default is 1.
+
+        **Returns**
+
+        Nothing on success, otherwise the files that failed to download.
+
+        Examples
+        --------
+            >>> s3utils.download_tree("test/myfolder/", "/tmp/myfolder")
+            downloading test/myfolder/hoho/photo.JPG to /tmp/myfolder/hoho/photo.JPG
+            downloading test/myfolder/test.txt to /tmp/myfolder/test.txt
+        """
+        failed_to_download_files = set([])
+
+        prefix = re.sub(r"^/|/$", "", folder)
+        prefix = prefix + "/" if prefix else ""
+        local_folder = os.path.abspath(local_folder)
+
+        def to_be_downloaded():
+            for key in self.__iter_keys(folder=prefix):
+                local_path = os.path.normpath(os.path.join(local_folder, key.name[len(prefix):]))
+                if not (local_path + os.sep).startswith(local_folder + os.sep):
+                    logger.error("Not downloading %s since it is outside of %s", key.name, local_folder)
+                    failed_to_download_files.add(key.name)
+                # folders that were empty when uploaded
+                elif key.name.endswith("/"):
+                    makedirs(local_path)
+                elif os.path.isfile(local_path) and os.path.getsize(local_path) == key.size:
+                    self.printv("%s already exists. Not downloading." % local_path)
+                else:
+                    # the folders are made here, one at a time, rather than by the workers that download into them
+                    makedirs(os.path.dirname(local_path))
+                    yield key, local_path
+
+        def download(item):
+            key, local_path = item
+            return self.__get_key(key, local_path)
+
+        for (key, local_path), success in self.__pool_imap(download, to_be_downloaded(), max_workers=max_workers):
+            if not success:
+                failed_to_download_files.add(key.name)
+
+        if failed_to_download_files:
+            return {'failed_to_download_files': failed_to_download_files}
+
+    @connectit
+    def __get_key(self, key, local_path):
+        """Download a boto key (that has its size and etag) to local_path."""
+        local_folder = os.path.dirname(os.path.abspath(local_path))
+        etag = key.etag.strip('"')
+        chunk_size = max(self.S3UTILS_MULTIPART_CHUNKSIZE, MULTIPART_MIN_PART_SIZE)
+        ranges = [(start, min(start + chunk_size, key.size)) for start in range(0, key.size, chunk_size)]
+
+        temp_path = os.path.join(local_folder, ".%s.%s.tmp" % (os.path.basename(local_path), uuid.uuid4().hex))
+
+        def fetch_range(thread_key, start, end):
+            # If-Match fails the request if the file is changed on S3 in the middle of the download
+            headers = {'Range': 'bytes=%s-%s' % (start, end - 1), 'If-Match': key.etag}
+            with open(temp_path, 'r+b') as fp:
+                fp.seek(start)
+                thread_key.get_contents_to_file(fp, headers=headers, **self.__transfer_callback())
+                if fp.tell() != end:
+                    # a cut response is retried like any other
+                    raise HTTPException("Got %s bytes instead of %s" % (fp.tell() - start, end - start))
+
+        def download_range(byte_range):
+            start, end = byte_range
+            self.retry.call(self.instrumentation.wrap(fetch_range, 'GetObject', key.name, end - start), Key(self.bucket, key.name), start, end)
+
+        try:
+            makedirs(local_folder)
+            # preallocating the file so the ranges can be written to it in any order
+            with open(temp_path, 'wb') as fp:
+                fp.truncate(key.size)
+
+            for byte_range, result in self.__pool_imap(download_range, ranges, max_workers=self.S3UTILS_MULTIPART_WORKERS):
+                pass
+
+            if os.path.getsize(temp_path) != key.size:
+                raise IOError("The size of %s is %s instead of %s" % (key.name, os.path.getsize(temp_path), key.size))
+            # multipart uploads do not have the md5 of the file as their etag
+            if "-" not in etag and file_md5(temp_path) != etag:
+                raise IOError("The md5 of %s does not match its ETag %s" % (key.name, etag))
+
+            replace_file(temp_path, local_path)
+        except:
+            logger.error("Error in downloading %s", key.name, exc_info=True)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return False
+
+        self.printv("downloading %s to %s" % (key.name, local_path))
+        return True
+
+    @connectit
+    def copy_remote(self, src_path, target_path, acl='public-read', target_bucket=None, max_workers=1, del_after_copy=False):
+        """
+        Copy files from one path on S3 to another, without downloading them.
+
+        Every file whose path starts with src_path is copied to target_path followed by the rest of its path.
+        S3 copies the files on its side, so no data goes through this machine.
+        Files bigger than 5GB are copied in parts, S3UTILS_MULTIPART_WORKERS parts at a time.
+
+        Parameters
+        ----------
+
+        src_path : string
+            Path to file or folder on S3. End folders with / so other files starting with the same name are not copied.
+
+        target_path : string
+            Target path on S3.
+
+        acl : string, optional
+            File permissions of the copied files. Default is public-read
+
+        target_bucket : string, optional
+            Name of the bucket to copy the files to. Default is the same bucket.
+
+        max_workers : integer, optional
+            Number of files to copy in parallel. Default is 1.
+
+        del_after_copy : boolean, optional
+            Delete the source files after they are copied. This is effectively like moving the files.
+            You can use s3utils.move_remote instead which sets this flag to True.
+            Files that fail to be copied are not deleted.
+
+        **Returns**
+
+        Nothing on success, otherwise what went wrong.
+
+        Examples
+        --------
+            >>> s3utils.copy_remote("test/myfolder/", "backup/myfolder/")
+            copying test/myfolder/hoho/photo.JPG to backup/myfolder/hoho/photo.JPG
+            copying test/myfolder/test.txt to backup/myfolder/test.txt
+        """
+        src_path = re.sub(r"^/", "", src_path)
+        target_path = re.sub(r"^/", "", target_path)
+        failed_to_copy_files = set([])
+        failed_to_delete_files = set([])
+
+        target_bucket = target_bucket or self.AWS_STORAGE_BUCKET_NAME
+        if target_bucket == self.AWS_STORAGE_BUCKET_NAME:
+            # the copies would show up in the listing of the files being copied
+            if target_path.startswith(src_path):
+                return {'InvalidS3Path': "Target path can not be inside the source path"}
+
+        def copy(key):
+            return self.__copy_key(key, target_path + key.name[len(src_path):], target_bucket, acl)
+
+        files_to_be_deleted = []
+        for key, success in self.__pool_imap(copy, self.__iter_keys(folder=src_path), max_workers=max_workers):
+            if not success:
+                failed_to_copy_files.add(key.name)
+            elif del_after_copy:
+                files_to_be_deleted.append(key.name)
+                if len(files_to_be_deleted) == MULTI_DELETE_MAX_KEYS:
+                    failed_to_delete_files.update(self.__delete_keys(files_to_be_deleted))
+                    files_to_be_deleted = []
+
+        if files_to_be_deleted:
+            failed_to_delete_files.update(self.__delete_keys(files_to_be_deleted))
+
+        result = {}
+        if failed_to_copy_files:
+            result['failed_to_copy_files'] = failed_to_copy_files
+        if failed_to_delete_files:
+            result['failed_to_delete_files'] = failed_to_delete_files
+        return result or None
+
+    def move_remote(self, src_path, target_path, acl='public-read', target_bucket=None, max_workers=1):
+        """
+        Move files from one path on S3 to another, without downloading them.
+
+        It is basically s3utils.copy_remote that has del_after_copy=True.
+        The source files are deleted in batches of 1000 once they are copied.
+
+        Examples
+        --------
+            >>> s3utils.move_remote("test/myfolder/", "archive/myfolder/")
+            copying test/myfolder/hoho/photo.JPG to archive/myfolder/hoho/photo.JPG
+            copying test/myfolder/test.txt to archive/myfolder/test.txt
+            Deleted: [u'test/myfolder/hoho/photo.JPG', u'test/myfolder/test.txt']
+
+        **Returns:**
+
+        Nothing on success, otherwise what went wrong.
+        """
+        return self.copy_remote(src_path, target_path, acl=acl, target_bucket=target_bucket, max_workers=max_workers, del_after_copy=True)
+
+    def __copy_key(self, key, target_file, target_bucket_name, acl):
+        """Copy a boto key to target_file in the target bucket on the S3 side."""
+        try:
+            if target_bucket_name == self.AWS_STORAGE_BUCKET_NAME:
+                target_bucket = self.bucket
+            else:
+                target_bucket = self.bucket.connection.get_bucket(target_bucket_name, validate=False)
+            if key.size > MULTIPART_COPY_THRESHOLD:
+                etag = self.__copy_multipart(key, target_file, target_bucket, acl)
+            else:
+                etag = self.retry.call(self.instrumentation.wrap(target_bucket.copy_key, 'CopyObject', target_file, key.size),
+                                       target_file, self.bucket.name, key.name, headers=self.__headers(acl)).etag
+        except:
+            logger.error("Error in copying %s to %s", key.name, target_file, exc_info=True)
+            return False
+
+        if target_bucket_name == self.AWS_STORAGE_BUCKET_NAME:
+            self.__index_add(target_file, key.size, etag)
+        self.printv("copying %s to %s" % (key.name, target_file))
+        return True
+
+    def __thread_multipart(self, mp):
+        """
+        The multipart upload mp on the connection of the current thread, so the parts are sent in parallel
+        over different connections.
+        """
+        thread_mp = MultiPartUpload(self.bucket.connection.get_bucket(mp.bucket.name, validate=False))
+        thread_mp.key_name = mp.key_name
+        thread_mp.id = mp.id
+        return thread_mp
+
+    def __copy_multipart(self, key, target_file, target_bucket, acl):
+        """
+        Copy a file bigger than 5GB in parts on the S3 side. Works the same way as __put_multipart.
+        """
+        # a multipart copy does not copy the headers and metadata of the file like a normal copy does
+        src_key = self.retry.call(self.instrumentation.wrap(self.bucket.get_key, 'HeadObject', key.name), key.name)
+        headers = {}
+        for header in MULTIPART_COPY_HEADERS:
+            value = getattr(src_key, header.lower().replace('-', '_'), None)
+            if value:
+                headers[header] = value
+        for name, value in src_key.metadata.items():
+            headers['x-amz-meta-%s' % name] = value
+        # like a normal copy, which keeps the headers of the source, the AWS_HEADERS are not applied to the copy
+        if acl:
+            headers['x-amz-acl'] = acl
+
+        chunk_size = max(self.S3UTILS_MULTIPART_CHUNKSIZE, MULTIPART_MIN_PART_SIZE, -(-key.size // MULTIPART_MAX_PARTS))
+        parts = [(part_num, start, min(start + chunk_size, key.size) - 1)
+                 for part_num, start in enumerate(range(0, key.size, chunk_size), 1)]
+
+        mp = self.retry.call(self.instrumentation.wrap(target_bucket.initiate_multipart_upload, 'CreateMultipartUpload', target_file),
+                             target_file, headers=headers)
+
+        def copy_part(part):
+            part_num, start, end = part
+            self.retry.call(self.instrumentation.wrap(self.__thread_multipart(mp).copy_part_from_key, 'UploadPartCopy', target_file, end - start + 1),
+                            self.bucket.name, key.name, part_num, start, end)
+
+        try:
+            for part, result in self.__pool_imap(copy_part, parts, max_workers=self.S3UTILS_MULTIPART_WORKERS):
+                self.printv("copied part %s of %s to %s" % (part[0], len(parts), target_file))
+            return self.retry.call(self.instrumentation.wrap(mp.complete_upload, 'CompleteMultipartUpload', target_file)).etag
+        except:
+            logger.error("Aborting the multipart copy of %s", target_file)
+            self.retry.call(self.instrumentation.wrap(mp.cancel_upload, 'AbortMultipartUpload', target_file))
+            raise
 
     @connectit
     def cp_cropduster_image(self, the_image_path, del_after_upload=False, overwrite=False, invalidate=False):
@@ -553,7 +1643,6 @@ class S3utils(object):
     def __get_grants(self, target_file, all_grant_data):
         """
         Return grant permission, grant owner, grant owner email and grant id  as a list.
-        It needs you to set k.key to a key on amazon (file path) before running this.
         note that Amazon returns a list of grants for each file.
 
         options:
@@ -563,9 +1652,8 @@ class S3utils(object):
             - authenticated-read: Owner gets FULL_CONTROL and any principal authenticated as a registered Amazon S3 user is granted READ access
 
         """
-        self.k.key = target_file
-
-        the_grants = self.k.get_acl().acl.grants
+        # A new key object per call so that grants can be fetched in parallel threads.
+        the_grants = self.retry.call(self.instrumentation.wrap(Key(self.bucket, target_file).get_acl, 'GetObjectAcl', target_file)).acl.grants
 
         grant_list = []
 
@@ -605,12 +1693,139 @@ class S3utils(object):
 
 
         """
-        self.k.key = target_file  # setting the path (key) of file in the container
-        self.k.set_acl(acl)  # setting the file permissions
-        self.k.close()
+        k = Key(self.bucket, target_file)  # setting the path (key) of file in the container
+        self.retry.call(self.instrumentation.wrap(k.set_acl, 'PutObjectAcl', target_file), acl)  # setting the file permissions
+        k.close()
+
+    def __existing_files(self, folder):
+        """Lazily yield the file names under the folder from the index if there is one, otherwise from S3."""
+        if self.index:
+            self.refresh_index(folder)
+            return self.index.iter_names(re.sub(r"^/", "", folder))
+        return self.iter_ls(folder)
+
+    def __file_exists(self, target_file):
+        """
+        Whether the file exists on S3, answered by the index if its folder is fresh there.
+
+        Otherwise S3 is asked about this one file. Its folder is not listed, which for a file at the top
+        would list the whole bucket.
+        """
+        target_file = re.sub(r"^/", "", target_file)
+        if self.index:
+            if self.index.is_fresh(target_file.rpartition("/")[0] + "/" if "/" in target_file else ""):
+                return self.index.exists(target_file)
+            key = self.retry.call(self.instrumentation.wrap(self.bucket.get_key, 'HeadObject', target_file), target_file)
+            if key is None:
+                return False
+            self.__index_add(key.name, key.size, key.etag)
+            return True
+        # if the file exists, it is the first one listed under its own name
+        return list(self.iter_ls(target_file, num=1)) == [target_file]
+
+    @connectit
+    def refresh_index(self, folder="", force=False):
+        """
+        Update the local index of the folder by listing it from S3, if it is stale.
+
+        This is done automatically for you when the index is used.
+        Only this folder is listed again. The other folders in the index stay as they are.
+
+        Parameters
+        ----------
+
+        folder : string
+            Path to folder on S3
+
+        force : boolean, optional
+            List the folder from S3 even if the index of the folder is not stale yet. Default is False.
+        """
+        if not self.index:
+            return
+        folder = re.sub(r"^/", "", folder)
+        if force or not self.index.is_fresh(folder):
+            self.printv("Refreshing the index of %s" % folder)
+            self.index.replace(folder, self.__iter_keys(folder=folder))
+
+    @connectit
+    def __iter_keys(self, folder="", begin_from_file="", num=-1, recursive=True):
+        """
+        Lazily yield the boto keys in a s3 folder, in the order S3 lists them.
+
+        When not recursive, the subdirectories are yielded as boto Prefix objects.
+        """
+        # S3 object key can't start with /
+        folder = re.sub(r"^/", "", folder)
+
+        if recursive:
+            delimiter = ""
+        else:
+            # S3 rolls up everything after the next / into a "subdirectory" so only one level is listed
+            delimiter = "/"
+            if folder and not folder.endswith("/"):
+                folder += "/"
+
+        def list_pages(marker):
+            # each page is retried on its own, which a failure half way through bucket.list can not be
+            while True:
+                page = self.retry.call(self.instrumentation.wrap(self.bucket.get_all_keys, 'ListObjects', folder),
+                                       prefix=folder, delimiter=delimiter, marker=marker)
+                for key in page:
+                    yield key
+                if not page.is_truncated or not len(page):
+                    break
+                marker = page.next_marker or page[-1].name
+
+        bucket_files = list_pages(begin_from_file)
+
+        if num >= 0:
+            bucket_files = islice(bucket_files, num)
+
+        return bucket_files
+
+    def iter_ls(self, folder="", begin_from_file="", num=-1, recursive=True):
+        """
+        Lazily yield the file names (keys) in a s3 folder, in the order S3 lists them.
+
+        Unlike ls, the file names are yielded as each page of the listing arrives from S3
+        and the whole list of files is never held in memory.
+
+        Parameters
+        ----------
+
+        folder : string
+            Path to file on S3
+
+        num: integer, optional
+            number of results to return, by default it returns all results.
+
+        begin_from_file: string, optional
+            List the files that come after this file on S3.
+            The last file name you received is the cursor to resume the listing from.
+
+        recursive: Boolean, optional
+            If False, only the files directly in the folder and its subdirectories (ending in /) are listed.
+            Default is True which lists everything under the folder.
+
+        Examples
+        --------
+
+            >>> for key in s3utils.iter_ls("test/", num=2):
+            ...     print(key)
+            test/myfolder/
+            test/myfolder/em/
+            >>> # resuming the listing after the last file
+            >>> for key in s3utils.iter_ls("test/", begin_from_file="test/myfolder/em/", num=2):
+            ...     print(key)
+            test/myfolder/hoho/
+            test/myfolder/hoho/.DS_Store
+
+        """
+        for v in self.__iter_keys(folder=folder, begin_from_file=begin_from_file, num=num, recursive=recursive):
+            yield v.name
 
     @connectit
-    def ls(self, folder="", begin_from_file="", num=-1, get_grants=False, all_grant_data=False):
+    def ls(self, folder="", begin_from_file="", num=-1, get_grants=False, all_grant_data=False, max_workers=1, recursive=True):
         """
         gets the list of file names (keys) in a s3 folder
 
@@ -628,6 +1843,17 @@ class S3utils(object):
             This is usedful in case you are iterating over lists of files and you need to page the result by
             starting listing from a certain file and fetching certain num (number) of files.
 
+        get_grants : Boolean, optional
+            Return an OrderedDict of the files and their permissions instead of a set of the files.
+
+        max_workers : integer, optional
+            Number of files whose permissions are fetched in parallel when get_grants is set. Default is 1.
+
+        recursive: Boolean, optional
+            If False, only the files directly in the folder and its subdirectories (ending in /) are listed.
+            The subdirectories have no permissions of their own so their grants are empty.
+            Default is True which lists everything under the folder.
+
 
         Examples
         --------
@@ -641,32 +1867,37 @@ class S3utils(object):
             ... )
             >>> print(s3utils.ls("test/"))
             {u'test/myfolder/', u'test/myfolder/em/', u'test/myfolder/hoho/', u'test/myfolder/hoho/.DS_Store', u'test/myfolder/hoho/haha/', u'test/myfolder/hoho/haha/ff', u'test/myfolder/hoho/haha/photo.JPG'}
+            >>> print(s3utils.ls("test/myfolder/hoho/", recursive=False))
+            {u'test/myfolder/hoho/', u'test/myfolder/hoho/.DS_Store', u'test/myfolder/hoho/haha/'}
 
         """
-        # S3 object key can't start with /
-        folder = re.sub(r"^/", "", folder)
-
-        bucket_files = self.bucket.list(prefix=folder, marker=begin_from_file)
+        bucket_files = self.__iter_keys(folder=folder, begin_from_file=begin_from_file, num=num, recursive=recursive)
 
         # in case listing grants
         if get_grants:
             list_of_files = OrderedDict()
-            for (i, v) in enumerate(bucket_files):
-                file_info = {v.name: self.__get_grants(v.name, all_grant_data)}
-                list_of_files.update(file_info)
-                if i == num:
-                    break
+
+            def files():
+                for v in bucket_files:
+                    if isinstance(v, Prefix):
+                        list_of_files[v.name] = []
+                    else:
+                        # reserving the spot of the file so the order of the listing is kept
+                        list_of_files[v.name] = None
+                        yield v.name
+
+            def get_grants(target_file):
+                return self.__get_grants(target_file, all_grant_data)
+
+            for target_file, grants in self.__pool_imap(get_grants, files(), max_workers=max_workers):
+                list_of_files[target_file] = grants
 
         else:
-            list_of_files = set([])
-            for (i, v) in enumerate(bucket_files):
-                list_of_files.add(v.name)
-                if i == num:
-                    break
+            list_of_files = set([v.name for v in bucket_files])
 
         return list_of_files
 
-    def ll(self, folder="", begin_from_file="", num=-1, all_grant_data=False):
+    def ll(self, folder="", begin_from_file="", num=-1, all_grant_data=False, max_workers=1):
         """
         Get the list of files and permissions from S3.
 
@@ -689,6 +1920,9 @@ class S3utils(object):
         all_grant_data : Boolean, optional
             More detailed file permission data will be returned.
 
+        max_workers : integer, optional
+            Number of files whose permissions are fetched in parallel. Default is 1.
+
         Examples
         --------
 
@@ -761,13 +1995,64 @@ class S3utils(object):
             }
 
         """
-        return self.ls(folder=folder, begin_from_file=begin_from_file, num=num, get_grants=True, all_grant_data=all_grant_data)
+        return self.ls(folder=folder, begin_from_file=begin_from_file, num=num, get_grants=True, all_grant_data=all_grant_data, max_workers=max_workers)
+
+    def distribution_ids(self):
+        """
+        The ids of the CloudFront distributions whose origin is the bucket.
+
+        They are looked up once and cached for the life of the process, for all the S3utils of the bucket.
+        When the bucket has no distribution, they are looked up again NO_DISTRIBUTION_TTL seconds later.
+        """
+        distribution_key = (self.AWS_ACCESS_KEY_ID, self.AWS_STORAGE_BUCKET_NAME)
+        with _distribution_ids_lock:
+            distribution_ids, looked_up_at = _distribution_ids.get(distribution_key, (None, None))
+            if distribution_ids is None or (not distribution_ids and time.time() - looked_up_at >= NO_DISTRIBUTION_TTL):
+                if not self.conn_cloudfront:
+                    self.connect_cloudfront()
+                distribution_ids = self.__find_distribution_ids()
+                _distribution_ids[distribution_key] = (distribution_ids, time.time())
+            return distribution_ids
+
+    @property
+    def invalidation_queue(self):
+        """
+        The InvalidationQueue of this S3utils. It is created the first time it is needed.
+
+        It sends its requests over the CloudFront connection of this S3utils, so they are reported
+        to its instrumentation, and waits S3UTILS_INVALIDATION_DELAY seconds for more paths.
+        A queue made while the bucket had no distribution is made again once the bucket has one.
+        """
+        with self.invalidation_queue_lock:
+            if self.__invalidation_queue is None or not self.__invalidation_queue.distribution_ids:
+                distribution_ids = self.distribution_ids()
+                if self.__invalidation_queue is not None and not distribution_ids:
+                    return self.__invalidation_queue
+                if not self.conn_cloudfront:
+                    self.connect_cloudfront()
+                self.__invalidation_queue = InvalidationQueue(
+                    self.cloudfront, distribution_ids, delay=self.S3UTILS_INVALIDATION_DELAY)
+            return self.__invalidation_queue
+
+    def __find_distribution_ids(self):
+        # S3 origins are like bucket.s3.amazonaws.com or bucket.s3-website-us-east-1.amazonaws.com
+        bucket_origin = re.compile(r"^%s\.s3[.-]" % re.escape(self.AWS_STORAGE_BUCKET_NAME))
+        distribution_ids = []
+        for distro in self.cloudfront.get_all_distributions():
+            if bucket_origin.match(getattr(distro.origin, 'dns_name', distro.origin) or ""):
+                distribution_ids.append(distro.id)
+        if not distribution_ids:
+            logger.warning("No CloudFront distribution has %s as its origin. Nothing is invalidated.", self.AWS_STORAGE_BUCKET_NAME)
+        return distribution_ids
 
     @connectit_cloudfront
     def invalidate(self, files_to_be_invalidated):
         """
         Invalidate the CDN (distribution) cache for a certain file of files. This might take up to 15 minutes to be effective.
 
+        Only the distributions whose origin is the bucket are invalidated.
+        The files waiting in the invalidation queue, for example from cp(invalidate=True), are sent in the same request.
+
         You can check for the invalidation status using check_invalidation_request.
 
         Examples
@@ -788,20 +2073,86 @@ class S3utils(object):
             >>> for inval in bb:
             ...     print('Object: %s, ID: %s, Status: %s' % (inval, inval.id, inval.status))
 
+        **Returns:**
+
+        The (distribution id, request id) of the last invalidation request sent.
 
+        QUEUED ('queued') if some of the files are still waiting in the invalidation queue because too many invalidations
+        are in progress on the distributions. The queue sends them on its own once CloudFront has completed earlier
+        requests. s3utils.invalidation_queue.flush() returns the requests of whatever it sends.
+
+        None if the bucket has no CloudFront distribution.
         """
-        if not isinstance(files_to_be_invalidated, Iterable):
+        if isinstance(files_to_be_invalidated, strings) or not isinstance(files_to_be_invalidated, Iterable):
             files_to_be_invalidated = (files_to_be_invalidated,)
+        files_to_be_invalidated = list(files_to_be_invalidated)
 
-        # Your CDN is called distribution on Amazaon. And you can have more than one distro
-        all_distros = self.conn_cloudfront.get_all_distributions()
-
-        for distro in all_distros:
-            invalidation_request = self.conn_cloudfront.create_invalidation_request(distro.id, files_to_be_invalidated)
+        # the files are sent along with whatever is waiting in the invalidation queue of the bucket
+        queue = self.invalidation_queue
+        queue.add(files_to_be_invalidated)
+        sent = queue.flush()
 
-        return (distro.id, invalidation_request.id)
+        if any(path in queue for path in files_to_be_invalidated):
+            return QUEUED
+        return sent[-1] if sent else None
 
     @connectit_cloudfront
     def check_invalidation_request(self, distro, request_id):
 
-        return self.conn_cloudfront.get_invalidation_requests(distro, request_id)
+        return self.cloudfront.get_invalidation_requests(distro, request_id)
+
+    @connectit_cloudfront
+    def invalidation_status(self, distro, request_id):
+        "The status of an invalidation request: InProgress or Completed."
+        return self.cloudfront.invalidation_request_status(distro, request_id).status
+
+    def wait_for_invalidation(self, distro, request_id, timeout=900):
+        """
+        Wait for an invalidation request to complete.
+
+        The status is polled with exponential backoff and jitter: 10 seconds apart at first, up to 2 minutes apart.
+
+        Examples
+        --------
+
+            >>> distro, request_id = s3utils.invalidate("test/myfolder/hoho/photo.JPG")
+            >>> s3utils.wait_for_invalidation(distro, request_id, timeout=600)
+            True
+
+        **Returns:**
+
+        True if the request completed within timeout seconds, False otherwise.
+        """
+        return not self.wait_for_invalidations([(distro, request_id)], timeout=timeout)
+
+    @connectit_cloudfront
+    def wait_for_invalidations(self, requests, timeout=900, callback=None):
+        """
+        Wait for many invalidation requests to complete at once. See wait_for_invalidation.
+
+        Parameters
+        ----------
+
+        requests : iterable
+            (distribution id, request id) of the requests, like s3utils.invalidation_queue.flush() returns them.
+
+        timeout : number, optional
+            Number of seconds to wait at most. Default is 900.
+
+        callback : callable, optional
+            Called with the distribution id and the request id as soon as each request completes.
+
+        Examples
+        --------
+
+            >>> def done(distro, request_id):
+            ...     print("%s is done on %s" % (request_id, distro))
+            >>> s3utils.wait_for_invalidations(s3utils.invalidation_queue.flush(), callback=done)
+            I2J0I21PCUYOIK is done on E1ZK8QP6T3NFEA
+            []
+
+        **Returns:**
+
+        The (distribution id, request id) of the requests that did not complete in time. Empty if they all did.
+        """
+        return wait_for_invalidations(self.cloudfront, requests, timeout, callback)
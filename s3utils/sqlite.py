@@ -0,0 +1,30 @@
+import sqlite3
+import threading
+
+
+def locked_connection(path=None, timeout=5):
+    """
+    Open a SQLite connection for RemoteIndex, HashCache and TokenBucket, along with the lock to use it with.
+
+    The transfers of s3utils run in worker threads, so one connection is shared by all of them and is only
+    used with the lock held. It is in autocommit mode: a change that takes several statements opens its own
+    transaction with BEGIN. A file is put in WAL mode so that other processes can read it while it is written.
+
+    Parameters
+    ----------
+
+    path : string, optional
+        Path to the SQLite file. It is created if it does not exist. Default is None which means in memory.
+
+    timeout : number, optional
+        Number of seconds to wait for another process to unlock the file. Default is 5.
+
+    **Returns:**
+
+    (sqlite3 connection, threading.Lock)
+    """
+    db = sqlite3.connect(path or ":memory:", check_same_thread=False, isolation_level=None, timeout=timeout)
+    if path:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+    return db, threading.Lock()
@@ -1,219 +1,1562 @@
-#!/usr/bin/env python
-# -*- coding: utf-8 -*-
-
-"""
-To run the test, run this in the root of repo:
-python -m unittest discover
-
-To run a specific test, run this from the root of repo:
-python -m unittest tests.S3utilsTestCase.test_cp_folder_content
-"""
-import os
-import unittest
-import boto
-from boto.s3.key import Key
-from moto import mock_s3
-from s3utils import S3utils
-from sys import version
-
-py3 = version[0] == '3'
-
-
-class S3utilsTestCase(unittest.TestCase):
-
-    """S3utils Tests."""
-
-    def setup_bucket(self):
-        self.conn = boto.connect_s3()
-        self.conn.create_bucket('testbucket')
-        self.bucket = self.conn.get_bucket('testbucket')
-        self.k = Key(self.bucket)
-
-    @mock_s3
-    def test_rm(self):
-        self.setup_bucket()
-
-        key = "somefile.txt"
-        self.k.key = key
-        self.k.set_contents_from_string("some content")
-
-        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
-        s3utils.rm(key)
-
-        remote_files = self.bucket.list(prefix='', marker='')
-        remote_files_names = [i.name for i in remote_files]
-
-        self.assertEqual(remote_files_names, [])
-
-    @mock_s3
-    def test_cp_overwrite_fails(self):
-        self.setup_bucket()
-
-        filecontent_local = "some content not to be overwritten"
-        key = "somewhere_remote/test_file_for_s3.txt"
-        self.k.key = key
-        self.k.set_contents_from_string(filecontent_local)
-
-        self.copy_base(action='cp', overwrite=False)
-
-        remote_content = self.bucket.get_key(key).get_contents_as_string()
-        self.assertEqual(filecontent_local, remote_content.decode('utf-8'))
-
-    @mock_s3
-    def test_rm_folder(self):
-        self.setup_bucket()
-
-        keys = ('/folder/file1.txt', '/folder/file2.txt', '/folder/folder2/file3.txt')
-        for key in keys:
-            self.k.key = key
-            self.k.set_contents_from_string("some content")
-
-        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
-        s3utils.rm('/folder/')
-
-        remote_files = self.bucket.list(prefix='', marker='')
-        remote_files_names = [i.name for i in remote_files]
-
-        self.assertEqual(remote_files_names, [])
-
-    @mock_s3
-    def test_mkdir(self):
-        self.setup_bucket()
-
-        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
-        s3utils.mkdir("folder")
-
-        remote_files = self.bucket.list(prefix='', marker='')
-        remote_folder = next(iter(remote_files)).name
-        self.assertEqual(remote_folder, "folder/")
-
-    @mock_s3
-    def test_mkdir2(self):
-        self.setup_bucket()
-
-        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
-        s3utils.mkdir("/folder/")
-
-        remote_files = self.bucket.list(prefix='', marker='')
-        remote_folder = next(iter(remote_files)).name
-        self.assertEqual(remote_folder, "folder/")
-
-    def copy_base(self, action, overwrite=True):
-        self.setup_bucket()
-
-        filename = 'test_file_for_s3.txt'
-        filecontent = 'this is the first line added using python'
-        filepath_local = '/tmp/%s' % filename
-        filepath_remote = '/somewhere_remote/'
-        filepath_remote_on_s3 = 'somewhere_remote/%s' % filename
-
-        with open(filepath_local, 'w') as f:
-            f.write(filecontent)
-
-        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
-        getattr(s3utils, action)(filepath_local, filepath_remote, overwrite=overwrite)
-
-        remote_files = self.bucket.list(prefix='', marker='')
-        remote_file = next(iter(remote_files)).name
-        self.assertEqual(remote_file, filepath_remote_on_s3)
-
-        if overwrite:
-            remote_content = self.bucket.get_key(filepath_remote_on_s3).get_contents_as_string()
-            self.assertEqual(filecontent, remote_content.decode('utf-8'))
-
-        return filepath_local
-
-    def copy_folder_base(self, action, folder='/tmp/test_s3_folder', filepath_remote_prefix='test_s3_folder/'):
-        self.setup_bucket()
-
-        folder_local = '/tmp/test_s3_folder'
-        filename_list = ['test_file_for_s3.txt', 'test_file_for_s3_b.txt']
-        filecontent = 'this is the first line added using python'
-        filepath_local_list = ['/tmp/test_s3_folder/%s' % filename for filename in filename_list]
-        filepath_remote = '/somewhere_remote/'
-        filepath_remote_on_s3_set_expected = {'somewhere_remote/%s%s' % (filepath_remote_prefix, filename) for filename in filename_list}
-
-        if not os.path.exists(folder_local):
-            os.makedirs(folder_local)
-
-        for filepath_local in filepath_local_list:
-            with open(filepath_local, 'w') as f:
-                f.write(filecontent)
-
-        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
-        s3utils_result = getattr(s3utils, action)(folder, filepath_remote)
-
-        remote_files = self.bucket.list(prefix='', marker='')
-        remote_files_names = {i.name for i in remote_files}
-
-        # If s3utils returns something, it means there was a problem
-        if s3utils_result:
-            self.assertEqual(remote_files_names, set([]))
-        else:
-            self.assertEqual(remote_files_names, filepath_remote_on_s3_set_expected)
-
-            filepath_remote_on_s3 = next(iter(filepath_remote_on_s3_set_expected))
-            remote_content = self.bucket.get_key(filepath_remote_on_s3).get_contents_as_string()
-            self.assertEqual(filecontent, remote_content.decode('utf-8'))
-
-        return (folder_local, s3utils_result)
-
-    @mock_s3
-    def test_cp(self):
-        filepath_local = self.copy_base(action='cp')
-        self.assertTrue(os.path.exists(filepath_local))
-
-    @mock_s3
-    def test_mv(self):
-        filepath_local = self.copy_base(action='mv')
-        self.assertFalse(os.path.exists(filepath_local))
-
-    @mock_s3
-    def test_cp_folder(self):
-        folder_local, s3utils_result = self.copy_folder_base(action='cp')
-        self.assertTrue(os.path.exists(folder_local))
-
-    @mock_s3
-    def test_mv_folder(self):
-        folder_local, s3utils_result = self.copy_folder_base(action='mv')
-        self.assertFalse(os.path.exists(folder_local))
-
-    @mock_s3
-    def test_cp_folder_content(self):
-        folder_local, s3utils_result = self.copy_folder_base(action='cp', folder='/tmp/test_s3_folder/*', filepath_remote_prefix='')
-        self.assertTrue(os.path.exists(folder_local))
-        self.assertEqual(s3utils_result, None)
-
-    @mock_s3
-    def test_cp_folder_that_does_not_exist(self):
-        folder_local, s3utils_result = self.copy_folder_base(action='cp', folder='/tmp/test_s3_folder_that_does_not_exist/', filepath_remote_prefix='')
-        self.assertEqual(s3utils_result, {'file_does_not_exist': '/tmp/test_s3_folder_that_does_not_exist'})
-
-    @mock_s3
-    def test_echo(self):
-        self.setup_bucket()
-
-        filename = 'test_file_for_s3.txt'
-        filecontent = 'this is the first line added using python'
-        filepath_remote_on_s3 = 'somewhere_remote/%s' % filename
-
-        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
-        s3utils.echo(filecontent, filepath_remote_on_s3)
-
-        remote_files = self.bucket.list(prefix='', marker='')
-        remote_file = next(iter(remote_files)).name
-        self.assertEqual(remote_file, filepath_remote_on_s3)
-
-        remote_content = self.bucket.get_key(filepath_remote_on_s3).get_contents_as_string()
-        self.assertEqual(filecontent, remote_content.decode('utf-8'))
-
-    @mock_s3
-    def test_echo_with_invalid_path(self):
-        self.setup_bucket()
-
-        filecontent = 'this is the first line added using python'
-        filepath_remote_on_s3 = 'somewhere_remote/'
-
-        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
-        result = s3utils.echo(filecontent, filepath_remote_on_s3)
-        self.assertEqual(result, {'InvalidS3Path': "Path on S3 can not end in /"})
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+To run the test, run this in the root of repo:
+python -m unittest discover
+
+To run a specific test, run this from the root of repo:
+python -m unittest tests.S3utilsTestCase.test_cp_folder_content
+"""
+import os
+import errno
+import gc
+import logging
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import unittest
+from functools import wraps
+from itertools import islice
+import boto
+from boto.s3.acl import ACL, Grant, Policy
+from boto.s3.key import Key
+from boto.cloudfront.distribution import DistributionSummary
+from boto.cloudfront.invalidation import InvalidationBatch
+from boto.cloudfront.origin import S3Origin
+from moto import mock_s3
+from s3utils import S3utils, RemoteIndex, InvalidationQueue, RetryPolicy, AdaptiveConcurrency, TokenBucket
+from s3utils import InstrumentationHook, LoggingHook, StatsdHook, Histogram, Progress
+from s3utils import invalidation as invalidation_module
+from s3utils.invalidation import collapse_paths
+from s3utils import s3utils as s3utils_module
+from benchmarks import benchmark
+from sys import version
+
+py3 = version[0] == '3'
+
+try:
+    import asyncio
+    from s3utils import AsyncS3utils
+except ImportError:
+    AsyncS3utils = None
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+# Number of keys in the synthetic listings of the memory tests and the most memory an operation can take on them.
+# Holding the names of the keys alone would take about 100MB.
+MEMORY_TEST_KEYS = 1000000
+MEMORY_CEILING = 5 * 1024 * 1024
+
+def requests_one_at_a_time(test):
+    """
+    Send the requests of the test to the moto mocks one at a time.
+
+    The mocks keep the request they are answering on the url they match, so requests sent at the same time
+    from several threads can get each other's response. The code under test still runs in its threads.
+    ThreadSafeBucket is for the tests where the requests really overlap.
+    """
+    @wraps(test)
+    def wrapped(*args, **kwargs):
+        lock = threading.RLock()
+        make_request = boto.connection.AWSAuthConnection.make_request
+
+        def make_request_one_at_a_time(self, *args, **kwargs):
+            with lock:
+                return make_request(self, *args, **kwargs)
+
+        boto.connection.AWSAuthConnection.make_request = make_request_one_at_a_time
+        try:
+            return test(*args, **kwargs)
+        finally:
+            boto.connection.AWSAuthConnection.make_request = make_request
+    return wrapped
+
+
+class ThreadSafeBucket(object):
+
+    """
+    A bucket of the given keys that answers the listing, delete and grant requests of several threads at once.
+
+    Every request takes delay seconds. max_in_flight is the most requests that were being answered at the same time.
+    """
+
+    name = 'testbucket'
+
+    def __init__(self, names, delay=0.01):
+        self.names = set(names)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def request(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+
+    def get_all_keys(self, prefix='', delimiter='', marker='', **kwargs):
+        self.request()
+        with self.lock:
+            names = sorted(name for name in self.names if name.startswith(prefix) and name > marker)
+        page = SyntheticPage(SyntheticKey(name) for name in names[:1000])
+        page.is_truncated = len(names) > 1000
+        return page
+
+    def delete_keys(self, names, quiet=False):
+        self.request()
+        with self.lock:
+            self.names.difference_update(names)
+        return SyntheticDeletes()
+
+    def get_acl(self, key_name, headers=None, version_id=None):
+        self.request()
+        policy = Policy()
+        policy.acl = ACL()
+        policy.acl.add_grant(Grant(permission='FULL_CONTROL', display_name=key_name))
+        return policy
+
+
+class FakeCloudFront(object):
+
+    """A CloudFront connection with the given {distribution id: origin}, since moto does not mock CloudFront."""
+
+    def __init__(self, origins):
+        self.origins = origins
+        self.distribution_lookups = 0
+        self.requests = []
+        self.completed = set()
+        # {request id: number of status checks after which it completes}
+        self.complete_after = {}
+        self.status_checks = {}
+
+    def get_all_distributions(self):
+        self.distribution_lookups += 1
+        return [DistributionSummary(id=distribution_id, origin=S3Origin(origin))
+                for distribution_id, origin in sorted(self.origins.items())]
+
+    def create_invalidation_request(self, distribution_id, paths):
+        self.requests.append((distribution_id, list(paths)))
+        request = InvalidationBatch(list(paths))
+        request.id = 'I%s' % len(self.requests)
+        return request
+
+    def invalidation_request_status(self, distribution_id, request_id):
+        self.status_checks[request_id] = self.status_checks.get(request_id, 0) + 1
+        if self.status_checks[request_id] >= self.complete_after.get(request_id, float('inf')):
+            self.completed.add(request_id)
+        request = InvalidationBatch()
+        request.id = request_id
+        request.status = 'Completed' if request_id in self.completed else 'InProgress'
+        return request
+
+
+class S3utilsTestCase(unittest.TestCase):
+
+    """S3utils Tests."""
+
+    def setup_bucket(self):
+        self.conn = boto.connect_s3()
+        self.conn.create_bucket('testbucket')
+        self.bucket = self.conn.get_bucket('testbucket')
+        self.k = Key(self.bucket)
+
+    @mock_s3
+    def test_rm(self):
+        self.setup_bucket()
+
+        key = "somefile.txt"
+        self.k.key = key
+        self.k.set_contents_from_string("some content")
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils.rm(key)
+
+        remote_files = self.bucket.list(prefix='', marker='')
+        remote_files_names = [i.name for i in remote_files]
+
+        self.assertEqual(remote_files_names, [])
+
+    @mock_s3
+    def test_cp_overwrite_fails(self):
+        self.setup_bucket()
+
+        filecontent_local = "some content not to be overwritten"
+        key = "somewhere_remote/test_file_for_s3.txt"
+        self.k.key = key
+        self.k.set_contents_from_string(filecontent_local)
+
+        self.copy_base(action='cp', overwrite=False)
+
+        remote_content = self.bucket.get_key(key).get_contents_as_string()
+        self.assertEqual(filecontent_local, remote_content.decode('utf-8'))
+
+    @mock_s3
+    def test_rm_folder(self):
+        self.setup_bucket()
+
+        keys = ('/folder/file1.txt', '/folder/file2.txt', '/folder/folder2/file3.txt')
+        for key in keys:
+            self.k.key = key
+            self.k.set_contents_from_string("some content")
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils.rm('/folder/')
+
+        remote_files = self.bucket.list(prefix='', marker='')
+        remote_files_names = [i.name for i in remote_files]
+
+        self.assertEqual(remote_files_names, [])
+
+    @mock_s3
+    def test_iter_ls(self):
+        self.setup_bucket()
+
+        keys = ['folder/file%s.txt' % i for i in range(5)]
+        for key in keys:
+            self.k.key = key
+            self.k.set_contents_from_string("some content")
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        first_page = list(s3utils.iter_ls('/folder/', num=2))
+        self.assertEqual(first_page, keys[:2])
+
+        rest = list(s3utils.iter_ls('/folder/', begin_from_file=first_page[-1]))
+        self.assertEqual(rest, keys[2:])
+        self.assertEqual(s3utils.ls('folder/', num=3), set(keys[:3]))
+
+    @mock_s3
+    def test_ls_not_recursive(self):
+        self.setup_bucket()
+
+        keys = ('folder/file1.txt', 'folder/file2.txt', 'folder/folder2/file3.txt', 'folder/folder2/folder3/file4.txt')
+        for key in keys:
+            self.k.key = key
+            self.k.set_contents_from_string("some content")
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        expected = {'folder/file1.txt', 'folder/file2.txt', 'folder/folder2/'}
+        self.assertEqual(s3utils.ls('/folder', recursive=False), expected)
+        self.assertEqual(list(s3utils.iter_ls('folder/', recursive=False)), sorted(expected))
+
+        grants = s3utils.ls('folder/', get_grants=True, recursive=False)
+        self.assertEqual(grants['folder/folder2/'], [])
+        self.assertEqual(grants['folder/file1.txt'][0]['permission'], 'FULL_CONTROL')
+
+    @mock_s3
+    def test_echo_overwrite_with_similar_file_name(self):
+        self.setup_bucket()
+
+        self.k.key = 'somewhere_remote/test_file_for_s3.txt.bak'
+        self.k.set_contents_from_string("some content")
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        self.assertEqual(s3utils.echo('new content', 'somewhere_remote/test_file_for_s3.txt', overwrite=False), True)
+        self.assertEqual(s3utils.echo('new content', 'somewhere_remote/test_file_for_s3.txt', overwrite=False),
+                         {'existing_files': 'somewhere_remote/test_file_for_s3.txt'})
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_ll_parallel(self):
+        self.setup_bucket()
+
+        keys = ['folder/file%s.txt' % i for i in range(10)]
+        for key in keys:
+            self.k.key = key
+            self.k.set_contents_from_string("some content")
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        result = s3utils.ll('folder/', max_workers=4)
+
+        self.assertEqual(list(result.keys()), sorted(keys))
+        self.assertEqual(result, s3utils.ll('folder/'))
+        for grants in result.values():
+            self.assertEqual(grants[0]['permission'], 'FULL_CONTROL')
+
+    def test_requests_overlap(self):
+        names = ['folder/file%s.txt' % i for i in range(20)]
+        bucket = ThreadSafeBucket(names)
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        # every thread that connects checks out one of these connections, whose requests all go to the fake bucket
+        for i in range(8):
+            s3utils.idle_connections.put((boto.connect_s3('key', 'secret'), bucket))
+
+        result = s3utils.ll('folder/', max_workers=4)
+        self.assertEqual(result, dict((name, [{'permission': 'FULL_CONTROL', 'name': name}]) for name in sorted(names)))
+        self.assertGreater(bucket.max_in_flight, 1)
+
+        bucket.max_in_flight = 0
+        multi_delete_max_keys = s3utils_module.MULTI_DELETE_MAX_KEYS
+        s3utils_module.MULTI_DELETE_MAX_KEYS = 2
+        try:
+            self.assertEqual(s3utils.rm('folder/', max_workers=4), None)
+        finally:
+            s3utils_module.MULTI_DELETE_MAX_KEYS = multi_delete_max_keys
+        self.assertEqual(bucket.names, set())
+        self.assertGreater(bucket.max_in_flight, 1)
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_shared_between_threads(self):
+        self.setup_bucket()
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        connections = set()
+
+        def work(i):
+            s3utils.mkdir('folder%s' % i)
+            s3utils.echo('content', 'folder%s/file.txt' % i)
+            s3utils.chmod('folder%s/file.txt' % i, 'private')
+            connections.add(id(s3utils.conn))
+            return sorted(s3utils.ls('folder%s/' % i))
+
+        results = dict(s3utils_module.pool_imap_unordered(
+            work, range(4), max_workers=4, on_thread_exit=s3utils.release_connection))
+
+        self.assertEqual(results, dict((i, ['folder%s/' % i, 'folder%s/file.txt' % i]) for i in range(4)))
+        self.assertEqual(len(connections), 4)
+        # the connections of the finished threads are reused
+        self.assertEqual(s3utils.idle_connections.qsize(), 4)
+        s3utils.ls('folder0/')
+        self.assertEqual(s3utils.idle_connections.qsize(), 3)
+        s3utils.disconnect()
+        self.assertEqual(s3utils.idle_connections.qsize(), 0)
+
+    @mock_s3
+    def test_connections_of_ended_threads_are_reused(self):
+        self.setup_bucket()
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        connections = set()
+
+        def request(i):
+            s3utils.echo('content', 'file%s.txt' % i)
+            connections.add(id(s3utils.conn))
+
+        # like a server that starts a thread per request and never calls release_connection
+        for i in range(30):
+            thread = threading.Thread(target=request, args=(i,))
+            thread.start()
+            thread.join()
+
+        self.assertEqual(len(connections), 1)
+        self.assertEqual(len(s3utils.connections), 0)
+        self.assertEqual(s3utils.idle_connections.qsize(), 1)
+
+    @mock_s3
+    def test_shared_connections(self):
+        self.setup_bucket()
+
+        try:
+            s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_SHARE_CONNECTIONS=True)
+            s3utils.echo('content', 'file.txt')
+            conn = s3utils.conn
+            del s3utils
+
+            s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_SHARE_CONNECTIONS=True)
+            self.assertEqual(s3utils.ls(), set(['file.txt']))
+            self.assertIs(s3utils.conn, conn)
+
+            # not shared between different buckets or without S3UTILS_SHARE_CONNECTIONS
+            self.conn.create_bucket('otherbucket')
+            self.assertIsNot(S3utils(AWS_STORAGE_BUCKET_NAME='otherbucket', S3UTILS_SHARE_CONNECTIONS=True).bucket.connection, conn)
+            self.assertIsNot(S3utils(AWS_STORAGE_BUCKET_NAME='testbucket').bucket.connection, conn)
+        finally:
+            s3utils_module._shared_connections.clear()
+
+    @mock_s3
+    def test_connect_without_validating_the_bucket(self):
+        self.setup_bucket()
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='missingbucket')
+        self.assertRaises(boto.exception.S3ResponseError, s3utils.connect)
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='missingbucket', S3UTILS_VALIDATE_BUCKET=False)
+        s3utils.connect()
+        self.assertRaises(boto.exception.S3ResponseError, s3utils.ls)
+
+    @mock_s3
+    def test_cp_invalidate_in_batches(self):
+        self.setup_bucket()
+
+        folder_local = '/tmp/test_s3_invalidate'
+        if not os.path.exists(folder_local):
+            os.makedirs(folder_local)
+        for i in range(31):
+            with open('%s/photo%s.jpg' % (folder_local, i), 'w') as f:
+                f.write('new content')
+        # only the files that are overwritten need to be invalidated
+        for i in range(30):
+            self.k.key = 'somewhere_remote/photo%s.jpg' % i
+            self.k.set_contents_from_string('old content')
+
+        cloudfront = FakeCloudFront({'D1': 'testbucket.s3.amazonaws.com', 'D2': 'otherbucket.s3.amazonaws.com'})
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_INVALIDATION_DELAY=60)
+        s3utils.conn_cloudfront = cloudfront
+        try:
+            for i in range(31):
+                self.assertEqual(s3utils.cp('%s/photo%s.jpg' % (folder_local, i), '/somewhere_remote/', invalidate=True), None)
+            self.assertEqual(cloudfront.requests, [])
+
+            self.assertEqual(s3utils.invalidation_queue.flush(), [('D1', 'I1')])
+            self.assertEqual(cloudfront.requests, [('D1', ['/somewhere_remote/photo%s.jpg' % i for i in range(30)])])
+            self.assertEqual(s3utils.invalidate('somewhere_remote/photo0.jpg'), ('D1', 'I2'))
+            self.assertEqual(cloudfront.distribution_lookups, 1)
+        finally:
+            s3utils_module._distribution_ids.clear()
+            shutil.rmtree(folder_local)
+
+    @mock_s3
+    def test_cp_folder_invalidate_with_wildcards(self):
+        self.setup_bucket()
+
+        folder_local = '/tmp/test_s3_collapse'
+        files = ['a/%s.jpg' % i for i in range(5)] + ['b/%s.jpg' % i for i in range(5)] + ['c.txt']
+        for name in files:
+            if not os.path.exists(os.path.dirname('%s/%s' % (folder_local, name))):
+                os.makedirs(os.path.dirname('%s/%s' % (folder_local, name)))
+            with open('%s/%s' % (folder_local, name), 'w') as f:
+                f.write('new content')
+        # b/old.jpg does not change so b/ can not be a wildcard for free
+        for name in files + ['b/old.jpg']:
+            self.k.key = 'somewhere_remote/test_s3_collapse/%s' % name
+            self.k.set_contents_from_string('old content')
+        self.k.key = 'somewhere_remote/other.txt'
+        self.k.set_contents_from_string('old content')
+
+        cloudfront = FakeCloudFront({'D1': 'testbucket.s3.amazonaws.com'})
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_INVALIDATION_DELAY=60)
+        s3utils.conn_cloudfront = cloudfront
+        try:
+            s3utils.cp(folder_local, '/somewhere_remote/', invalidate=True)
+            s3utils.invalidation_queue.flush()
+            self.assertEqual(cloudfront.requests, [('D1', ['/somewhere_remote/test_s3_collapse/%s' % path for path in
+                                                           ['a/*'] + ['b/%s.jpg' % i for i in range(5)] + ['c.txt']])])
+        finally:
+            s3utils_module._distribution_ids.clear()
+            shutil.rmtree(folder_local)
+
+    def test_invalidation_queue_of_each_s3utils(self):
+        cloudfront = FakeCloudFront({'D1': 'testbucket.s3.amazonaws.com'})
+        first = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_INVALIDATION_DELAY=60)
+        second = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_INVALIDATION_DELAY=30)
+        first.conn_cloudfront = second.conn_cloudfront = cloudfront
+        try:
+            self.assertEqual(first.invalidate('a.jpg'), ('D1', 'I1'))
+            self.assertEqual(second.invalidate('b.jpg'), ('D1', 'I2'))
+
+            self.assertEqual(second.invalidation_queue.delay, 30)
+            # the requests are reported to the S3utils that sent them, while the distributions are looked up once
+            self.assertEqual(first.instrumentation.stats()['cloudfront.CreateInvalidation']['requests'], 1)
+            self.assertEqual(second.instrumentation.stats()['cloudfront.CreateInvalidation']['requests'], 1)
+            self.assertEqual(cloudfront.distribution_lookups, 1)
+        finally:
+            s3utils_module._distribution_ids.clear()
+
+    def test_invalidate_queued(self):
+        cloudfront = FakeCloudFront({'D1': 'testbucket.s3.amazonaws.com'})
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_INVALIDATION_DELAY=60)
+        s3utils.conn_cloudfront = cloudfront
+        try:
+            s3utils.invalidation_queue.max_in_flight = 1
+            self.assertEqual(s3utils.invalidate('a.jpg'), ('D1', 'I1'))
+            # a.jpg is still in progress so b.jpg has to wait for it
+            self.assertEqual(s3utils.invalidate(['b.jpg']), invalidation_module.QUEUED)
+            self.assertIn('b.jpg', s3utils.invalidation_queue)
+
+            cloudfront.completed.add('I1')
+            self.assertEqual(s3utils.invalidate('c.jpg'), invalidation_module.QUEUED)
+            self.assertEqual(cloudfront.requests, [('D1', ['/a.jpg']), ('D1', ['/b.jpg'])])
+        finally:
+            s3utils.invalidation_queue.timer.cancel()
+            s3utils_module._distribution_ids.clear()
+
+    def test_invalidate_without_distribution(self):
+        cloudfront = FakeCloudFront({})
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_INVALIDATION_DELAY=60)
+        s3utils.conn_cloudfront = cloudfront
+        no_distribution_ttl = s3utils_module.NO_DISTRIBUTION_TTL
+        try:
+            self.assertEqual(s3utils.invalidate('a.jpg'), None)
+            self.assertEqual(s3utils.invalidate('a.jpg'), None)
+            self.assertEqual(cloudfront.distribution_lookups, 1)
+
+            # a distribution made since is found once the empty lookup is too old
+            cloudfront.origins['D1'] = 'testbucket.s3.amazonaws.com'
+            s3utils_module.NO_DISTRIBUTION_TTL = 0
+            self.assertEqual(s3utils.invalidate('a.jpg'), ('D1', 'I1'))
+            self.assertEqual(s3utils.invalidate('b.jpg'), ('D1', 'I2'))
+            self.assertEqual(cloudfront.distribution_lookups, 2)
+        finally:
+            s3utils_module.NO_DISTRIBUTION_TTL = no_distribution_ttl
+            s3utils_module._distribution_ids.clear()
+
+    def test_collapse_paths(self):
+        changed = ['site/a/%s.jpg' % i for i in range(5)] + ['site/b/%s.jpg' % i for i in range(5)]
+        listing = changed + ['site/b/old.jpg', 'site/c/old.jpg']
+
+        self.assertEqual(collapse_paths(changed, listing), sorted(['site/a/*'] + changed[5:]))
+        self.assertEqual(collapse_paths(changed, listing, max_paths=2), ['site/a/*', 'site/b/*'])
+        # the unchanged files under site/ make it more expensive than site/b/
+        self.assertEqual(collapse_paths(changed, listing, max_paths=1), ['site/*'])
+        self.assertEqual(collapse_paths(changed, listing, max_paths=1, root='site/b/'), sorted(changed[:5] + ['site/b/*']))
+        # without a listing nothing is known to be free, so only the path budget counts
+        self.assertEqual(collapse_paths(changed), sorted(changed))
+        self.assertEqual(collapse_paths(changed, max_paths=6), sorted(['site/a/*'] + changed[5:]))
+
+    def test_invalidation_queue_limits(self):
+        cloudfront = FakeCloudFront({'D1': 'testbucket.s3.amazonaws.com'})
+        queue = InvalidationQueue(cloudfront, ['D1'], delay=60, max_paths=2, max_in_flight=4)
+
+        # the full batches are sent right away
+        queue.add(['a', 'b', 'c', 'd', 'e', 'a'])
+        self.assertEqual(cloudfront.requests, [('D1', ['/a', '/b']), ('D1', ['/c', '/d'])])
+
+        # 4 paths are in progress already
+        self.assertEqual(queue.flush(), [])
+        self.assertEqual(len(queue), 1)
+
+        cloudfront.completed.add('I1')
+        self.assertEqual(queue.flush(), [('D1', 'I3')])
+        self.assertEqual(cloudfront.requests[-1], ('D1', ['/e']))
+        self.assertEqual(len(queue), 0)
+
+        # a wildcard replaces the paths it covers
+        queue = InvalidationQueue(cloudfront, ['D1'], delay=60, max_wildcards_in_flight=1)
+        queue.add(['img/1.jpg', 'css/a.css', 'img/*', 'img/2.jpg', 'js/*'])
+        self.assertEqual(queue.paths, ['/css/a.css', '/img/*', '/js/*'])
+        queue.flush()
+        self.assertEqual(cloudfront.requests[-1], ('D1', ['/css/a.css', '/img/*']))
+        self.assertEqual(queue.paths, ['/js/*'])
+
+    def test_wait_for_invalidations(self):
+        cloudfront = FakeCloudFront({'D1': 'testbucket.s3.amazonaws.com'})
+        cloudfront.complete_after = {'I1': 3, 'I2': 1}
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils.conn_cloudfront = cloudfront
+        completed = []
+
+        poll_delay = invalidation_module.INVALIDATION_POLL_DELAY
+        invalidation_module.INVALIDATION_POLL_DELAY = 0.01
+        try:
+            self.assertEqual(s3utils.wait_for_invalidations([('D1', 'I1'), ('D1', 'I2')],
+                                                            callback=lambda *request: completed.append(request)), [])
+            self.assertEqual(completed, [('D1', 'I2'), ('D1', 'I1')])
+            self.assertEqual(cloudfront.status_checks, {'I1': 3, 'I2': 1})
+
+            self.assertEqual(s3utils.wait_for_invalidation('D1', 'I1'), True)
+            self.assertEqual(s3utils.wait_for_invalidation('D1', 'I3', timeout=0.05), False)
+            self.assertEqual(s3utils.wait_for_invalidations([('D1', 'I2'), ('D1', 'I3')], timeout=0.05), [('D1', 'I3')])
+        finally:
+            invalidation_module.INVALIDATION_POLL_DELAY = poll_delay
+
+    def test_poll_delays(self):
+        delays = list(islice(invalidation_module.poll_delays(10, 60), 6))
+        for delay, max_delay in zip(delays, [10, 20, 40, 60, 60, 60]):
+            self.assertTrue(max_delay / 2.0 <= delay <= max_delay)
+
+    @unittest.skipIf(AsyncS3utils is None, "AsyncS3utils needs Python 3.5 or newer")
+    def test_async_wait_for_invalidations(self):
+        cloudfront = FakeCloudFront({'D1': 'testbucket.s3.amazonaws.com'})
+        cloudfront.complete_after = {'I1': 2, 'I2': 1}
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        s3utils = AsyncS3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils.client.conn_cloudfront = cloudfront
+        completed = []
+
+        poll_delay = invalidation_module.INVALIDATION_POLL_DELAY
+        invalidation_module.INVALIDATION_POLL_DELAY = 0.01
+        try:
+            self.assertEqual(loop.run_until_complete(s3utils.wait_for_invalidations(
+                [('D1', 'I1'), ('D1', 'I2')], callback=lambda *request: completed.append(request))), [])
+            self.assertEqual(completed, [('D1', 'I2'), ('D1', 'I1')])
+            self.assertEqual(loop.run_until_complete(s3utils.wait_for_invalidation('D1', 'I3', timeout=0.05)), False)
+        finally:
+            invalidation_module.INVALIDATION_POLL_DELAY = poll_delay
+            s3utils.close()
+            loop.close()
+            asyncio.set_event_loop(None)
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_rm_folder_in_parallel_batches(self):
+        self.setup_bucket()
+
+        keys = ['folder/file%s.txt' % i for i in range(5)]
+        for key in keys:
+            self.k.key = key
+            self.k.set_contents_from_string("some content")
+
+        multi_delete_max_keys = s3utils_module.MULTI_DELETE_MAX_KEYS
+        s3utils_module.MULTI_DELETE_MAX_KEYS = 2
+        try:
+            s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+            result = s3utils.rm('folder/', max_workers=2)
+        finally:
+            s3utils_module.MULTI_DELETE_MAX_KEYS = multi_delete_max_keys
+
+        self.assertEqual(result, None)
+        self.assertEqual(list(self.bucket.list()), [])
+
+    @mock_s3
+    def test_rm_folder_reports_failures(self):
+        self.setup_bucket()
+
+        keys = ['folder/file%s.txt' % i for i in range(3)]
+        for key in keys:
+            self.k.key = key
+            self.k.set_contents_from_string("some content")
+
+        def delete_keys(*args, **kwargs):
+            raise boto.exception.S3ResponseError(500, 'InternalError')
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils.connect()
+        s3utils.bucket.delete_keys = delete_keys
+        result = s3utils.rm('folder/')
+
+        self.assertEqual(result, {'failed_to_delete_files': set(keys)})
+
+    @mock_s3
+    def test_retry_throttled_requests(self):
+        self.setup_bucket()
+
+        keys = ['folder/file%s.txt' % i for i in range(3)]
+        for key in keys:
+            self.k.key = key
+            self.k.set_contents_from_string("some content")
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils.retry.base_delay = 0
+        s3utils.connect()
+        calls = []
+
+        def flaky(fn, error):
+            def wrapped(*args, **kwargs):
+                calls.append(fn.__name__)
+                if calls.count(fn.__name__) == 1:
+                    raise error
+                return fn(*args, **kwargs)
+            return wrapped
+
+        s3utils.bucket.get_all_keys = flaky(s3utils.bucket.get_all_keys, socket.error(errno.ECONNRESET, 'Connection reset by peer'))
+        s3utils.bucket.delete_keys = flaky(s3utils.bucket.delete_keys, boto.exception.S3ResponseError(503, 'Slow Down'))
+        self.assertEqual(s3utils.ls('folder/'), set(keys))
+        self.assertEqual(s3utils.rm('folder/'), None)
+        self.assertEqual(calls, ['get_all_keys', 'get_all_keys', 'get_all_keys', 'delete_keys', 'delete_keys'])
+        self.assertEqual(list(self.bucket.list()), [])
+        # S3 asked to slow down once, which cut the limit to 1. The retry that went fine then grew it by one.
+        self.assertEqual(s3utils.retry.concurrency.generation, 1)
+        self.assertEqual(s3utils.retry.concurrency.limit, 2)
+
+    def test_retry_policy(self):
+        retry = RetryPolicy(attempts=3, base_delay=0)
+        errors = [boto.exception.S3ResponseError(503, 'Slow Down'), boto.exception.S3ResponseError(500, 'Internal Error')]
+
+        def fail_then_succeed():
+            if errors:
+                raise errors.pop()
+            return 'done'
+
+        self.assertEqual(retry.call(fail_then_succeed), 'done')
+
+        errors = [boto.exception.S3ResponseError(503, 'Slow Down')] * 3
+        self.assertRaises(boto.exception.S3ResponseError, retry.call, fail_then_succeed)
+        self.assertEqual(len(errors), 0)
+
+        # not worth retrying
+        errors = [boto.exception.S3ResponseError(503, 'Slow Down'), boto.exception.S3ResponseError(403, 'Forbidden')]
+        self.assertRaises(boto.exception.S3ResponseError, retry.call, fail_then_succeed)
+        self.assertEqual(len(errors), 1)
+        errors = [IOError(errno.ENOENT, 'No such file or directory')]
+        self.assertRaises(IOError, retry.call, fail_then_succeed)
+        self.assertEqual(len(errors), 0)
+
+    def test_adaptive_concurrency(self):
+        concurrency = AdaptiveConcurrency(max_limit=8)
+        tokens = [concurrency.acquire() for i in range(8)]
+
+        # the requests in flight when the limit was cut do not cut it again
+        concurrency.release(tokens.pop(), throttled=True)
+        self.assertEqual(concurrency.limit, 4)
+        concurrency.release(tokens.pop(), throttled=True)
+        self.assertEqual(concurrency.limit, 4)
+        for token in tokens:
+            concurrency.release(token)
+        self.assertEqual(concurrency.in_flight, 0)
+
+        # grows by one after limit successful requests
+        for i in range(4):
+            concurrency.release(concurrency.acquire())
+        self.assertEqual(concurrency.limit, 5)
+
+        concurrency.release(concurrency.acquire(), throttled=True)
+        self.assertEqual(concurrency.limit, 1)
+
+    def test_token_bucket(self):
+        rate_limit_path = '/tmp/test_s3utils_rate_limit.sqlite'
+        if os.path.exists(rate_limit_path):
+            os.remove(rate_limit_path)
+
+        # two processes using the same file
+        bucket = TokenBucket('requests', rate=100, path=rate_limit_path)
+        other = TokenBucket('requests', rate=1000, path=rate_limit_path)
+        self.assertEqual(other.rate, 100)
+
+        self.assertEqual(bucket.take(100), 0)
+        # the burst is used up, so the other process waits for the tokens to refill
+        self.assertAlmostEqual(other.take(10), 0.1, delta=0.05)
+
+        bucket.set_rate(None)
+        self.assertEqual(other.take(1000000), 0)
+        other.set_rate(1000)
+        self.assertEqual(bucket.rate, 1000)
+
+    @mock_s3
+    def test_rate_limits(self):
+        self.setup_bucket()
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_BYTES_PER_SECOND=100000, S3UTILS_REQUESTS_PER_SECOND=1000)
+        start = time.time()
+        s3utils.echo("x" * 150000, "test/big.txt")
+        # the first 100000 bytes are the burst and the other 50000 wait half a second
+        self.assertGreater(time.time() - start, 0.4)
+        self.assertEqual(self.bucket.get_key("test/big.txt").size, 150000)
+
+        # opened up while the S3utils is in use
+        s3utils.bandwidth.set_rate(None)
+        start = time.time()
+        s3utils.echo("x" * 150000, "test/big2.txt")
+        s3utils.get("test/big2.txt", "/tmp/test_s3utils_big2.txt")
+        self.assertLess(time.time() - start, 0.4)
+        os.remove("/tmp/test_s3utils_big2.txt")
+
+        requests = s3utils.request_rate.db.execute("SELECT tokens FROM token_buckets").fetchone()[0]
+        self.assertLess(requests, 1000)
+
+    @mock_s3
+    def test_instrumentation(self):
+        self.setup_bucket()
+
+        class RecordingHook(InstrumentationHook):
+            def __init__(self):
+                self.events = []
+
+            def start(self, event):
+                self.events.append(('start', event.operation, event.key))
+
+            def end(self, event):
+                self.events.append(('end', event.operation, event.key, event.bytes, event.status, event.retries))
+
+        class BrokenHook(InstrumentationHook):
+            def end(self, event):
+                raise ValueError("a broken hook does not break the transfers")
+
+        statsd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        statsd.bind(('127.0.0.1', 0))
+        statsd.settimeout(5)
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        log = logging.getLogger('test_s3utils_instrumentation')
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+
+        hook = RecordingHook()
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_INSTRUMENTATION_HOOKS=[
+            hook, BrokenHook(), LoggingHook(logger=log), StatsdHook(port=statsd.getsockname()[1], prefix='test')])
+        s3utils.retry.base_delay = 0
+        s3utils.echo("hello", "test/hello.txt")
+        get_all_keys = self.bucket.__class__.get_all_keys
+        calls = []
+
+        def flaky_get_all_keys(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise boto.exception.S3ResponseError(503, 'Slow Down')
+            return get_all_keys(s3utils.bucket, *args, **kwargs)
+        s3utils.bucket.get_all_keys = flaky_get_all_keys
+        self.assertEqual(s3utils.ls("test/"), {"test/hello.txt"})
+
+        self.assertEqual(hook.events, [
+            ('start', 'HeadBucket', None), ('end', 'HeadBucket', None, None, 200, 0),
+            ('start', 'PutObject', 'test/hello.txt'), ('end', 'PutObject', 'test/hello.txt', 5, 200, 0),
+            ('start', 'ListObjects', 'test/'), ('end', 'ListObjects', 'test/', None, 503, 0),
+            ('start', 'ListObjects', 'test/'), ('end', 'ListObjects', 'test/', None, 200, 1),
+        ])
+
+        stats = s3utils.instrumentation.stats()
+        self.assertEqual(sorted(stats), ['s3.HeadBucket', 's3.ListObjects', 's3.PutObject'])
+        self.assertEqual(dict((name, stats['s3.ListObjects'][name]) for name in ('requests', 'errors', 'retries', 'bytes')),
+                         {'requests': 2, 'errors': 1, 'retries': 1, 'bytes': 0})
+        self.assertEqual(stats['s3.PutObject']['bytes'], 5)
+        self.assertEqual(stats['s3.PutObject']['duration']['count'], 1)
+
+        self.assertEqual(len(messages), 4)
+        self.assertTrue(messages[1].startswith("s3 PutObject test/hello.txt bytes=5 status=200 retries=0 "))
+        lines = statsd.recv(1024).decode('ascii').split("\n")
+        self.assertTrue(lines[0].startswith("test.s3.HeadBucket.duration:"))
+        self.assertEqual(lines[1:], ["test.s3.HeadBucket.requests:1|c"])
+        statsd.close()
+
+        # the CloudFront requests are reported too
+        s3utils.conn_cloudfront = FakeCloudFront({'D1': 'testbucket.s3.amazonaws.com'})
+        s3utils.invalidation_status('D1', 'I1')
+        self.assertEqual(hook.events[-1], ('end', 'GetInvalidation', 'D1', None, 200, 0))
+        self.assertEqual(s3utils.instrumentation.stats()['cloudfront.GetInvalidation']['requests'], 1)
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.1, 1, 10))
+        for value in (0.05, 0.5, 0.5, 5, 50):
+            histogram.observe(value)
+        self.assertEqual(histogram.stats(), {'count': 5, 'sum': 56.05, 'buckets': {0.1: 1, 1: 2, 10: 1, 'inf': 1}})
+        self.assertEqual(histogram.percentile(50), 1)
+        self.assertEqual(histogram.percentile(80), 10)
+        self.assertEqual(histogram.percentile(99), None)
+
+    def test_benchmark(self):
+        report = benchmark.run(scales=[20])
+        self.assertEqual([(result['operation'], result['keys'], result['failed']) for result in report['results']],
+                         [('upload', 20, False), ('list', 20, False), ('acl', 20, False), ('delete', 20, False)])
+        # ll and rm list the folder first
+        self.assertEqual([result['requests'] for result in report['results']], [20, 1, 21, 2])
+
+        lines, slower = benchmark.compare(report, report)
+        self.assertEqual(len(lines), 4)
+        self.assertFalse(slower)
+        baseline = {'results': [dict(result, keys_per_second=result['keys_per_second'] * 2) for result in report['results']]}
+        self.assertTrue(benchmark.compare(report, baseline)[1])
+
+    @mock_s3
+    def test_mkdir(self):
+        self.setup_bucket()
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils.mkdir("folder")
+
+        remote_files = self.bucket.list(prefix='', marker='')
+        remote_folder = next(iter(remote_files)).name
+        self.assertEqual(remote_folder, "folder/")
+
+    @mock_s3
+    def test_mkdir2(self):
+        self.setup_bucket()
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils.mkdir("/folder/")
+
+        remote_files = self.bucket.list(prefix='', marker='')
+        remote_folder = next(iter(remote_files)).name
+        self.assertEqual(remote_folder, "folder/")
+
+    def copy_base(self, action, overwrite=True):
+        self.setup_bucket()
+
+        filename = 'test_file_for_s3.txt'
+        filecontent = 'this is the first line added using python'
+        filepath_local = '/tmp/%s' % filename
+        filepath_remote = '/somewhere_remote/'
+        filepath_remote_on_s3 = 'somewhere_remote/%s' % filename
+
+        with open(filepath_local, 'w') as f:
+            f.write(filecontent)
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        getattr(s3utils, action)(filepath_local, filepath_remote, overwrite=overwrite)
+
+        remote_files = self.bucket.list(prefix='', marker='')
+        remote_file = next(iter(remote_files)).name
+        self.assertEqual(remote_file, filepath_remote_on_s3)
+
+        if overwrite:
+            remote_content = self.bucket.get_key(filepath_remote_on_s3).get_contents_as_string()
+            self.assertEqual(filecontent, remote_content.decode('utf-8'))
+
+        return filepath_local
+
+    def copy_folder_base(self, action, folder='/tmp/test_s3_folder', filepath_remote_prefix='test_s3_folder/', s3utils=None, **kwargs):
+        if not s3utils:
+            self.setup_bucket()
+
+        folder_local = '/tmp/test_s3_folder'
+        filename_list = ['test_file_for_s3.txt', 'test_file_for_s3_b.txt']
+        filecontent = 'this is the first line added using python'
+        filepath_local_list = ['/tmp/test_s3_folder/%s' % filename for filename in filename_list]
+        filepath_remote = '/somewhere_remote/'
+        filepath_remote_on_s3_set_expected = {'somewhere_remote/%s%s' % (filepath_remote_prefix, filename) for filename in filename_list}
+
+        if not os.path.exists(folder_local):
+            os.makedirs(folder_local)
+
+        for filepath_local in filepath_local_list:
+            with open(filepath_local, 'w') as f:
+                f.write(filecontent)
+
+        s3utils = s3utils or S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils_result = getattr(s3utils, action)(folder, filepath_remote, **kwargs)
+
+        remote_files = self.bucket.list(prefix='', marker='')
+        remote_files_names = {i.name for i in remote_files}
+
+        # If s3utils returns something, it means there was a problem
+        if s3utils_result:
+            self.assertEqual(remote_files_names, set([]))
+        else:
+            self.assertEqual(remote_files_names, filepath_remote_on_s3_set_expected)
+
+            filepath_remote_on_s3 = next(iter(filepath_remote_on_s3_set_expected))
+            remote_content = self.bucket.get_key(filepath_remote_on_s3).get_contents_as_string()
+            self.assertEqual(filecontent, remote_content.decode('utf-8'))
+
+        return (folder_local, s3utils_result)
+
+    @mock_s3
+    def test_cp(self):
+        filepath_local = self.copy_base(action='cp')
+        self.assertTrue(os.path.exists(filepath_local))
+
+    @mock_s3
+    def test_mv(self):
+        filepath_local = self.copy_base(action='mv')
+        self.assertFalse(os.path.exists(filepath_local))
+
+    @mock_s3
+    def test_cp_folder(self):
+        folder_local, s3utils_result = self.copy_folder_base(action='cp')
+        self.assertTrue(os.path.exists(folder_local))
+
+    @mock_s3
+    def test_mv_folder(self):
+        folder_local, s3utils_result = self.copy_folder_base(action='mv')
+        self.assertFalse(os.path.exists(folder_local))
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_cp_folder_parallel(self):
+        folder_local, s3utils_result = self.copy_folder_base(action='cp', max_workers=4)
+        self.assertTrue(os.path.exists(folder_local))
+        self.assertEqual(s3utils_result, None)
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_mv_folder_parallel(self):
+        folder_local, s3utils_result = self.copy_folder_base(action='mv', max_workers=4)
+        self.assertFalse(os.path.exists(folder_local))
+        self.assertEqual(s3utils_result, None)
+
+    @mock_s3
+    def test_cp_folder_content(self):
+        folder_local, s3utils_result = self.copy_folder_base(action='cp', folder='/tmp/test_s3_folder/*', filepath_remote_prefix='')
+        self.assertTrue(os.path.exists(folder_local))
+        self.assertEqual(s3utils_result, None)
+
+    @mock_s3
+    def test_cp_folder_that_does_not_exist(self):
+        folder_local, s3utils_result = self.copy_folder_base(action='cp', folder='/tmp/test_s3_folder_that_does_not_exist/', filepath_remote_prefix='')
+        self.assertEqual(s3utils_result, {'file_does_not_exist': '/tmp/test_s3_folder_that_does_not_exist'})
+
+    @mock_s3
+    def test_cp_folder_sends_acl_with_upload(self):
+        self.setup_bucket()
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils.connect()
+        requests = []
+        make_request = s3utils.conn.make_request
+
+        def counting_make_request(method, *args, **kwargs):
+            requests.append(method)
+            return make_request(method, *args, **kwargs)
+
+        s3utils.conn.make_request = counting_make_request
+        folder_local, s3utils_result = self.copy_folder_base(action='cp', s3utils=s3utils, acl='public-read')
+
+        # one PUT per file and no extra set_acl request
+        self.assertEqual(requests, ['PUT', 'PUT'])
+        grants = self.bucket.get_key('somewhere_remote/test_s3_folder/test_file_for_s3.txt').get_acl().acl.grants
+        self.assertIn('READ', [grant.permission for grant in grants])
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_cp_multipart(self):
+        self.setup_bucket()
+
+        filepath_local = '/tmp/test_file_for_s3_multipart.bin'
+        filecontent = os.urandom(1024) * (6 * 1024)  # 6MB, which is 2 parts
+        with open(filepath_local, 'wb') as f:
+            f.write(filecontent)
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_MULTIPART_THRESHOLD=1024,
+                          S3UTILS_MULTIPART_CHUNKSIZE=1024)
+        s3utils_result = s3utils.cp(filepath_local, '/somewhere_remote/')
+        self.assertEqual(s3utils_result, None)
+
+        remote_key = self.bucket.get_key('somewhere_remote/test_file_for_s3_multipart.bin')
+        self.assertTrue(remote_key.etag.endswith('-2"'))
+        self.assertEqual(filecontent, remote_key.get_contents_as_string())
+        self.assertEqual(list(self.bucket.get_all_multipart_uploads()), [])
+
+        # the content type is guessed from the file name like for the files sent in one request, unless AWS_HEADERS sets it
+        video_local = '/tmp/test_video_for_s3_multipart.mp4'
+        with open(video_local, 'wb') as f:
+            f.write(filecontent[:2048])
+        self.assertEqual(s3utils.cp(video_local, '/somewhere_remote/'), None)
+        self.assertEqual(self.bucket.get_key('somewhere_remote/test_video_for_s3_multipart.mp4').content_type, 'video/mp4')
+
+        s3utils.AWS_HEADERS = {'Content-Type': 'application/x-test'}
+        self.assertEqual(s3utils.cp(video_local, '/other_remote/'), None)
+        self.assertEqual(self.bucket.get_key('other_remote/test_video_for_s3_multipart.mp4').content_type, 'application/x-test')
+        os.remove(video_local)
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_cp_multipart_progress(self):
+        self.setup_bucket()
+
+        filepath_local = '/tmp/test_file_for_s3_multipart.bin'
+        with open(filepath_local, 'wb') as f:
+            f.write(os.urandom(1024) * (12 * 1024))  # 12MB, which is 3 parts
+
+        reports = []
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_MULTIPART_THRESHOLD=1024,
+                          S3UTILS_MULTIPART_CHUNKSIZE=1024)
+        self.assertEqual(s3utils.cp(filepath_local, '/somewhere_remote/', progress=Progress(reports.append, interval=0)), None)
+
+        # reported as the parts are sent, not only once the file is done
+        bytes_done = [report['bytes_done'] for report in reports]
+        self.assertEqual(bytes_done, sorted(bytes_done))
+        self.assertTrue(any(0 < done < 12 * 1024 * 1024 for done in bytes_done))
+        self.assertEqual(reports[0]['files_done'], 0)
+        self.assertEqual(dict((name, reports[-1][name]) for name in ('files_done', 'files_total', 'bytes_done', 'bytes_total', 'eta', 'finished')),
+                         {'files_done': 1, 'files_total': 1, 'bytes_done': 12 * 1024 * 1024, 'bytes_total': 12 * 1024 * 1024,
+                          'eta': 0, 'finished': True})
+        self.assertTrue(reports[-1]['throughput'] > 0)
+        os.remove(filepath_local)
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_cp_folder_progress(self):
+        self.setup_bucket()
+        self.k.key = 'somewhere_remote/test_s3_progress/a.txt'
+        self.k.set_contents_from_string("already there")
+
+        folder_local = '/tmp/test_s3_progress'
+        os.makedirs(os.path.join(folder_local, 'sub'))
+        for path, content in (('a.txt', 'a' * 10), ('b.txt', 'b' * 20), ('sub/c.txt', 'c' * 30)):
+            with open(os.path.join(folder_local, path), 'w') as f:
+                f.write(content)
+
+        reports = []
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        try:
+            s3utils_result = s3utils.cp(folder_local, '/somewhere_remote/', overwrite=False, max_workers=2, progress=reports.append)
+        finally:
+            shutil.rmtree(folder_local)
+        self.assertEqual(s3utils_result, {'existing_files': {'somewhere_remote/test_s3_progress/a.txt'}})
+        # the file that was not overwritten is taken out of the totals
+        self.assertEqual(dict((name, reports[-1][name]) for name in ('files_done', 'files_failed', 'files_total', 'bytes_done', 'bytes_total', 'finished')),
+                         {'files_done': 2, 'files_failed': 0, 'files_total': 2, 'bytes_done': 50, 'bytes_total': 50, 'finished': True})
+
+    def test_progress(self):
+        reports = []
+        progress = Progress(reports.append, interval=60)
+        progress.add(files=2, bytes=300)
+        first, second = progress.file(100), progress.file(200)
+        callback = first.callback()
+        callback(50, 100)
+        # boto started sending the file over
+        callback(20, 100)
+        first.done()
+        second.callback()(150, 200)
+        second.done(success=False)
+        # the reports wait for the interval
+        self.assertEqual(reports, [])
+        progress.report(finished=True)
+        self.assertEqual(dict((name, reports[-1][name]) for name in ('files_done', 'files_failed', 'files_total', 'bytes_done', 'bytes_total')),
+                         {'files_done': 1, 'files_failed': 1, 'files_total': 2, 'bytes_done': 100, 'bytes_total': 100})
+
+    @mock_s3
+    def test_sync(self):
+        self.setup_bucket()
+
+        folder_local = '/tmp/test_s3_sync_folder'
+        if os.path.exists(folder_local):
+            shutil.rmtree(folder_local)
+        os.makedirs(os.path.join(folder_local, 'b'))
+        local_files = {'a.txt': 'unchanged', 'b/c.txt': 'new', 'b-d.txt': 'changed content'}
+        for name, content in local_files.items():
+            with open(os.path.join(folder_local, name), 'w') as f:
+                f.write(content)
+
+        remote_files = {'a.txt': 'unchanged', 'b-d.txt': 'old', 'z.txt': 'removed locally', 'b/e.txt': 'removed locally'}
+        for name, content in remote_files.items():
+            self.k.key = 'synced/%s' % name
+            self.k.set_contents_from_string(content)
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils.connect()
+        requests = []
+        make_request = s3utils.conn.make_request
+
+        def counting_make_request(method, bucket='', key='', *args, **kwargs):
+            requests.append((method, key))
+            return make_request(method, bucket, key, *args, **kwargs)
+
+        s3utils.conn.make_request = counting_make_request
+        result = s3utils.sync(folder_local, '/synced/', delete=True, checksum=True)
+
+        self.assertEqual(result, None)
+        self.assertEqual(sorted(name for method, name in requests if method == 'PUT'), ['synced/b-d.txt', 'synced/b/c.txt'])
+        remote_files_names = {i.name for i in self.bucket.list()}
+        self.assertEqual(remote_files_names, {'synced/%s' % name for name in local_files})
+        self.assertEqual(self.bucket.get_key('synced/b-d.txt').get_contents_as_string().decode('utf-8'), 'changed content')
+
+        # like cp, a missing local folder or a file is not synced
+        self.assertEqual(s3utils.sync('/tmp/does_not_exist', '/synced/'), {'file_does_not_exist': '/tmp/does_not_exist'})
+        self.assertEqual(s3utils.sync(os.path.join(folder_local, 'a.txt'), '/synced/'),
+                         {'file_does_not_exist': os.path.join(folder_local, 'a.txt')})
+
+    def test_iter_files_sorted(self):
+        folder_local = '/tmp/test_s3_sorted_folder'
+        if os.path.exists(folder_local):
+            shutil.rmtree(folder_local)
+        for folder in ('a', 'a/b', 'a-b'):
+            os.makedirs(os.path.join(folder_local, folder))
+        names = ['a/b/c', 'a/b.txt', 'a-b/c', 'a.txt', 'a0']
+        for name in names:
+            with open(os.path.join(folder_local, name), 'w') as f:
+                f.write('some content')
+
+        relative_paths = [relative_path for relative_path, full_path in s3utils_module.iter_files_sorted(folder_local)]
+        self.assertEqual(relative_paths, sorted(names))
+
+    @mock_s3
+    def test_index(self):
+        self.setup_bucket()
+
+        index_path = '/tmp/test_s3utils_index.sqlite'
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+        self.k.key = 'folder/existing.txt'
+        self.k.set_contents_from_string("some content")
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_INDEX_PATH=index_path)
+        s3utils.connect()
+        requests = []
+        make_request = s3utils.conn.make_request
+
+        def counting_make_request(method, *args, **kwargs):
+            requests.append(method)
+            return make_request(method, *args, **kwargs)
+
+        s3utils.conn.make_request = counting_make_request
+
+        self.assertEqual(s3utils.echo('content', 'folder/existing.txt', overwrite=False), {'existing_files': 'folder/existing.txt'})
+        self.assertEqual(s3utils.echo('content', 'top.txt', overwrite=False), True)
+        # the files of a stale folder are asked about one at a time, without listing the folder or the bucket
+        self.assertEqual(requests, ['HEAD', 'HEAD', 'PUT'])
+        self.assertTrue(s3utils.index.exists('folder/existing.txt'))
+
+        s3utils.refresh_index('folder/')
+        del requests[:]
+        self.assertEqual(s3utils.echo('content', 'folder/new.txt', overwrite=False), True)
+        # the folder is fresh now so the check was answered from the index
+        self.assertEqual(requests, ['PUT'])
+        self.assertEqual(s3utils.echo('content', 'folder/new.txt', overwrite=False), {'existing_files': 'folder/new.txt'})
+
+        s3utils.rm('folder/new.txt')
+        self.assertFalse(s3utils.index.exists('folder/new.txt'))
+
+        # changes made by others are seen once the folder is expired
+        self.k.key = 'folder/by_others.txt'
+        self.k.set_contents_from_string("some content")
+        self.assertFalse(s3utils.index.exists('folder/by_others.txt'))
+        s3utils.index.expire('folder/')
+        self.assertEqual(s3utils.echo('content', 'folder/by_others.txt', overwrite=False), {'existing_files': 'folder/by_others.txt'})
+
+        # a write to S3 that succeeded is not failed by the index, whose folder is listed again instead
+        def locked(*args):
+            raise sqlite3.OperationalError("database is locked")
+
+        s3utils.refresh_index('folder/')
+        s3utils.index.add = s3utils.index.remove = locked
+        self.assertTrue(s3utils.index.is_fresh('folder/'))
+        self.assertEqual(s3utils.echo('content', 'folder/locked.txt'), True)
+        self.assertFalse(s3utils.index.is_fresh('folder/'))
+        s3utils.refresh_index('folder/')
+        self.assertEqual(s3utils.rm('folder/'), None)
+        self.assertFalse(s3utils.index.is_fresh('folder/'))
+        self.assertEqual(s3utils.ls('folder/'), set())
+
+    def test_index_replace_in_pages(self):
+        index_path = '/tmp/test_s3utils_index_pages.sqlite'
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        index = RemoteIndex(index_path, 'testbucket')
+        for name in ['a/1', 'a/2', 'a/3', 'a/4', 'a/5', 'b/1']:
+            index.add(name, 1, '"0"')
+
+        def listing():
+            for name in ['a/2', 'a/4', 'a/6', 'a/7']:
+                # the index is not locked while S3 is being listed
+                self.assertFalse(index.lock.locked())
+                yield SyntheticKey(name)
+
+        index.replace('a/', listing(), page_size=2)
+        self.assertEqual(list(index.iter_names()), ['a/2', 'a/4', 'a/6', 'a/7', 'b/1'])
+        self.assertTrue(index.is_fresh('a/'))
+        index.close()
+
+    @mock_s3
+    def test_cp_folder_with_hash_cache(self):
+        hash_cache_path = '/tmp/test_s3utils_hashes.sqlite'
+        if os.path.exists(hash_cache_path):
+            os.remove(hash_cache_path)
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_HASH_CACHE_PATH=hash_cache_path)
+        self.setup_bucket()
+        self.copy_folder_base(action='cp', s3utils=s3utils)
+        self.assertEqual(s3utils.hash_cache.stats(), {'hits': 0, 'misses': 2})
+
+        s3utils.cp('/tmp/test_s3_folder', '/somewhere_remote/')
+        self.assertEqual(s3utils.hash_cache.stats(), {'hits': 2, 'misses': 2})
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_get(self):
+        self.setup_bucket()
+
+        filecontent = os.urandom(1024) * (6 * 1024)  # 6MB, which is 2 ranges
+        self.k.key = 'somewhere_remote/test_file_for_s3.bin'
+        self.k.set_contents_from_string(filecontent)
+
+        folder_local = '/tmp/test_s3_get_folder'
+        if os.path.exists(folder_local):
+            shutil.rmtree(folder_local)
+
+        # The ranges are downloaded one at a time since the mocked S3 mixes up big responses sent in parallel.
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_MULTIPART_CHUNKSIZE=1024)
+        result = s3utils.get('/somewhere_remote/test_file_for_s3.bin', folder_local + '/')
+
+        self.assertEqual(result, None)
+        self.assertEqual(os.listdir(folder_local), ['test_file_for_s3.bin'])
+        with open(os.path.join(folder_local, 'test_file_for_s3.bin'), 'rb') as f:
+            self.assertEqual(f.read(), filecontent)
+
+    @mock_s3
+    def test_get_file_that_does_not_exist(self):
+        self.setup_bucket()
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        result = s3utils.get('does_not_exist.txt', '/tmp/')
+        self.assertEqual(result, {'file_does_not_exist': 'does_not_exist.txt'})
+        self.assertFalse(os.path.exists('/tmp/does_not_exist.txt'))
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_download_tree(self):
+        self.setup_bucket()
+
+        remote_files = {'file1.txt': 'content 1', 'folder2/file2.txt': 'content 2', 'empty_folder/': ''}
+        for name, content in remote_files.items():
+            self.k.key = 'folder/%s' % name
+            self.k.set_contents_from_string(content)
+
+        folder_local = '/tmp/test_s3_download_folder'
+        if os.path.exists(folder_local):
+            shutil.rmtree(folder_local)
+        os.makedirs(folder_local)
+        # same size so it is not downloaded again
+        with open(os.path.join(folder_local, 'file1.txt'), 'w') as f:
+            f.write('local   1')
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        result = s3utils.download_tree('/folder/', folder_local, max_workers=2)
+
+        self.assertEqual(result, None)
+        self.assertTrue(os.path.isdir(os.path.join(folder_local, 'empty_folder')))
+        with open(os.path.join(folder_local, 'file1.txt')) as f:
+            self.assertEqual(f.read(), 'local   1')
+        with open(os.path.join(folder_local, 'folder2', 'file2.txt')) as f:
+            self.assertEqual(f.read(), 'content 2')
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_download_tree_in_parallel(self):
+        self.setup_bucket()
+
+        names = ['folder%s/file%s.txt' % (i, j) for i in range(5) for j in range(8)]
+        for name in names:
+            self.k.key = 'tree/%s' % name
+            self.k.set_contents_from_string(name)
+
+        folder_local = '/tmp/test_s3_download_tree_parallel'
+        if os.path.exists(folder_local):
+            shutil.rmtree(folder_local)
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        makedirs = os.makedirs
+
+        def slow_makedirs(*args, **kwargs):
+            # so that the folder would be made by several of the workers at once if they made it
+            time.sleep(0.05)
+            return makedirs(*args, **kwargs)
+
+        os.makedirs = slow_makedirs
+        try:
+            self.assertEqual(s3utils.download_tree('tree/', folder_local, max_workers=8), None)
+        finally:
+            os.makedirs = makedirs
+        for name in names:
+            with open(os.path.join(folder_local, name)) as f:
+                self.assertEqual(f.read(), name)
+        shutil.rmtree(folder_local)
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_copy_remote(self):
+        self.setup_bucket()
+        self.conn.create_bucket('otherbucket')
+
+        remote_files = {'file1.txt': 'content 1', 'folder2/file2.txt': 'content 2'}
+        for name, content in remote_files.items():
+            self.k.key = 'folder/%s' % name
+            self.k.set_contents_from_string(content)
+        self.k.key = 'folder_not_copied.txt'
+        self.k.set_contents_from_string('content')
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        self.assertEqual(s3utils.copy_remote('folder/', 'backup/folder/', max_workers=2), None)
+        self.assertEqual(s3utils.copy_remote('/folder/', 'folder/', target_bucket='otherbucket'), None)
+
+        self.assertEqual(s3utils.ls('backup/'), {'backup/folder/%s' % name for name in remote_files})
+        self.assertEqual(self.bucket.get_key('backup/folder/folder2/file2.txt').get_contents_as_string().decode('utf-8'), 'content 2')
+        other_bucket_files = {key.name for key in self.conn.get_bucket('otherbucket').list()}
+        self.assertEqual(other_bucket_files, {'folder/%s' % name for name in remote_files})
+
+        self.assertEqual(s3utils.copy_remote('folder/', 'folder/inside/'),
+                         {'InvalidS3Path': "Target path can not be inside the source path"})
+
+    @mock_s3
+    @requests_one_at_a_time
+    def test_move_remote(self):
+        self.setup_bucket()
+
+        filecontent = os.urandom(1024) * (6 * 1024)  # 6MB, which is 2 parts
+        headers = {'Content-Type': 'application/x-test', 'Cache-Control': 'max-age=60', 'Content-Encoding': 'identity',
+                   'Content-Disposition': 'attachment', 'Content-Language': 'en', 'Expires': 'Thu, 01 Dec 2033 16:00:00 GMT'}
+        self.k.key = 'folder/big_file.bin'
+        self.k.set_contents_from_string(filecontent, headers=headers)
+        self.k.key = 'folder/small_file.txt'
+        self.k.set_contents_from_string('content')
+
+        multipart_copy_threshold = s3utils_module.MULTIPART_COPY_THRESHOLD
+        s3utils_module.MULTIPART_COPY_THRESHOLD = 1024
+        try:
+            s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket', S3UTILS_MULTIPART_CHUNKSIZE=1024,
+                              AWS_HEADERS={'Cache-Control': 'no-cache'})
+            result = s3utils.move_remote('folder/', 'archive/')
+        finally:
+            s3utils_module.MULTIPART_COPY_THRESHOLD = multipart_copy_threshold
+
+        self.assertEqual(result, None)
+        self.assertEqual(s3utils.ls(''), {'archive/big_file.bin', 'archive/small_file.txt'})
+        big_file = self.bucket.get_key('archive/big_file.bin')
+        self.assertTrue(big_file.etag.endswith('-2"'))
+        self.assertEqual(big_file.get_contents_as_string(), filecontent)
+        # the same headers as a file copied in one request, which keeps the Cache-Control of the source over AWS_HEADERS
+        for header, value in headers.items():
+            self.assertEqual(getattr(big_file, header.lower().replace('-', '_')), value)
+        self.assertEqual(self.bucket.get_key('archive/small_file.txt').cache_control, None)
+
+    @unittest.skipIf(AsyncS3utils is None, "AsyncS3utils needs Python 3.5 or newer")
+    @mock_s3
+    @requests_one_at_a_time
+    def test_async(self):
+        self.setup_bucket()
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        # This runs against the in-process mock_s3 like the other tests, since moto's standalone server needs flask.
+        # Against a server started with `moto_server s3 -p 5000`, pass AWS_S3_HOST='localhost', AWS_S3_PORT=5000
+        # and AWS_S3_USE_SSL=False. The requests of several threads in flight at once are covered by test_requests_overlap.
+        s3utils = AsyncS3utils(AWS_STORAGE_BUCKET_NAME='testbucket', max_concurrency=4)
+        keys = ['folder/file%s.txt' % i for i in range(10)]
+
+        loop.run_until_complete(asyncio.gather(*[s3utils.echo('content', key) for key in keys]))
+
+        async_listing = s3utils.ls('folder/')
+        listed_keys = []
+        try:
+            while True:
+                listed_keys.append(loop.run_until_complete(async_listing.__anext__()))
+        except StopAsyncIteration:
+            pass
+        self.assertEqual(listed_keys, keys)
+
+        loop.run_until_complete(s3utils.rm('folder/'))
+        self.assertEqual(list(self.bucket.list()), [])
+        s3utils.close()
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    @mock_s3
+    def test_echo(self):
+        self.setup_bucket()
+
+        filename = 'test_file_for_s3.txt'
+        filecontent = 'this is the first line added using python'
+        filepath_remote_on_s3 = 'somewhere_remote/%s' % filename
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        s3utils.echo(filecontent, filepath_remote_on_s3)
+
+        remote_files = self.bucket.list(prefix='', marker='')
+        remote_file = next(iter(remote_files)).name
+        self.assertEqual(remote_file, filepath_remote_on_s3)
+
+        remote_content = self.bucket.get_key(filepath_remote_on_s3).get_contents_as_string()
+        self.assertEqual(filecontent, remote_content.decode('utf-8'))
+
+    @mock_s3
+    def test_echo_with_invalid_path(self):
+        self.setup_bucket()
+
+        filecontent = 'this is the first line added using python'
+        filepath_remote_on_s3 = 'somewhere_remote/'
+
+        s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        result = s3utils.echo(filecontent, filepath_remote_on_s3)
+        self.assertEqual(result, {'InvalidS3Path': "Path on S3 can not end in /"})
+
+
+class SyntheticKey(object):
+
+    __slots__ = ('name', 'size', 'etag', 'last_modified')
+
+    def __init__(self, name):
+        self.name = name
+        self.size = 1
+        self.etag = '"0"'
+        self.last_modified = '2016-01-01T00:00:00.000Z'
+
+
+class SyntheticPage(list):
+    is_truncated = False
+    next_marker = None
+
+
+class SyntheticListing(object):
+
+    """
+    bucket.get_all_keys of a bucket with num_keys keys under prefix, made up a page at a time so that they are never all in memory.
+
+    The keys are named prefix + file000000000.txt and so on, in the order S3 lists them.
+    """
+
+    def __init__(self, prefix, num_keys, page_size=1000):
+        self.prefix = prefix
+        self.num_keys = num_keys
+        self.page_size = page_size
+        self.pages = 0
+
+    def name(self, i):
+        return "%sfile%09d.txt" % (self.prefix, i)
+
+    def __call__(self, prefix='', delimiter='', marker='', **kwargs):
+        self.pages += 1
+        start = int(marker[len(self.prefix) + len('file'):-len('.txt')]) + 1 if marker else 0
+        if not self.prefix.startswith(prefix):
+            start = self.num_keys
+        page = SyntheticPage(SyntheticKey(self.name(i)) for i in range(start, min(start + self.page_size, self.num_keys)))
+        page.is_truncated = start + self.page_size < self.num_keys
+        return page
+
+
+class SyntheticDeletes(object):
+
+    "bucket.delete_keys that counts the keys instead of deleting them."
+
+    errors = []
+
+    def __init__(self):
+        self.deleted = 0
+
+    def __call__(self, keys, quiet=False):
+        self.deleted += len(keys)
+        return self
+
+
+@unittest.skipIf(tracemalloc is None, "tracemalloc needs Python 3.4 or newer")
+class MemoryScalingTestCase(unittest.TestCase):
+
+    """
+    The peak memory of the operations that go through a whole listing, on a listing of MEMORY_TEST_KEYS keys.
+
+    They stream the listing so their memory usage should not grow with the number of keys.
+    """
+
+    def setUp(self):
+        self.mock = mock_s3()
+        self.mock.start()
+        boto.connect_s3().create_bucket('testbucket')
+        self.s3utils = S3utils(AWS_STORAGE_BUCKET_NAME='testbucket')
+        self.listing = self.s3utils.bucket.get_all_keys = SyntheticListing('big/', MEMORY_TEST_KEYS)
+        self.deletes = self.s3utils.bucket.delete_keys = SyntheticDeletes()
+        self.folder_local = '/tmp/test_s3_memory'
+        if os.path.exists(self.folder_local):
+            shutil.rmtree(self.folder_local)
+        os.makedirs(self.folder_local)
+        # one file that is on S3 already and one that is not
+        for name in (self.listing.name(5)[len('big/'):], 'new.txt'):
+            with open(os.path.join(self.folder_local, name), 'w') as f:
+                f.write('changed')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_local)
+        self.mock.stop()
+
+    def peak_memory(self, fn):
+        "Number of bytes allocated at the peak while fn runs, and what it returned."
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = fn()
+            return tracemalloc.get_traced_memory()[1], result
+        finally:
+            tracemalloc.stop()
+
+    def test_iter_ls(self):
+        peak, num_keys = self.peak_memory(lambda: sum(1 for name in self.s3utils.iter_ls('big/')))
+        self.assertEqual(num_keys, MEMORY_TEST_KEYS)
+        self.assertLess(peak, MEMORY_CEILING)
+
+    def test_rm(self):
+        peak, result = self.peak_memory(lambda: self.s3utils.rm('big/'))
+        self.assertEqual(result, None)
+        self.assertEqual(self.deletes.deleted, MEMORY_TEST_KEYS)
+        self.assertLess(peak, MEMORY_CEILING)
+
+    def test_sync(self):
+        peak, result = self.peak_memory(lambda: self.s3utils.sync(self.folder_local, 'big/', delete=True))
+        self.assertEqual(result, None)
+        # every key but the one that is also local
+        self.assertEqual(self.deletes.deleted, MEMORY_TEST_KEYS - 1)
+        self.assertEqual(self.listing.pages, MEMORY_TEST_KEYS // self.listing.page_size)
+        self.assertLess(peak, MEMORY_CEILING)
+
+    def test_cp_without_overwriting(self):
+        peak, result = self.peak_memory(lambda: self.s3utils.cp(self.folder_local + '/*', 'big/', overwrite=False))
+        self.assertEqual(result, {'existing_files': {self.listing.name(5)}})
+        self.assertEqual(self.listing.pages, MEMORY_TEST_KEYS // self.listing.page_size)
+        self.assertLess(peak, MEMORY_CEILING)